@@ -0,0 +1,61 @@
+############################################
+# PROGAF                                   #
+# Projection Games Framework               #
+############################################
+# AssociationBenchmark.py                  #
+############################################
+#
+# 2026/10/18 Initial Release
+#
+############################################
+from progaf.AssociationEngine import GreedyAssociation, HungarianAssociation, SparseAssociation
+import numpy as np
+import time
+
+
+def makeScene(nObjects, width, height, step, rng):
+    # Random object centroids, and the same centroids after one frame of
+    # random motion (shuffled, as detections come in arbitrary order)
+    objects = rng.uniform((0, 0), (width, height), (nObjects, 2))
+    moved = objects + rng.normal(0, step, (nObjects, 2))
+    order = rng.permutation(nObjects)
+    return objects, moved[order], order
+
+
+def runEngine(engine, objects, detections, order, repeat):
+    # Return (milliseconds per match, ratio of correct matches)
+    start = time.perf_counter()
+    for n in range(repeat):
+        rows, cols = engine.match(objects, detections)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    # Detection 'col' comes from object order[col]
+    correct = np.count_nonzero(order[cols] == rows)
+    return elapsed * 1000, correct / len(objects)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    width, height = 1920, 1080
+    step = 4
+
+    engines = [("Greedy", GreedyAssociation(), 2000),
+               ("Hungarian", HungarianAssociation(maxDistance=50), 2000),
+               ("Sparse", SparseAssociation(maxDistance=50), None)]
+
+    print("{:>8} {:>10} {:>12} {:>10}".format("Objects", "Engine", "Time (ms)", "Correct"))
+    for nObjects in (10, 100, 1000, 2000, 10000):
+        objects, detections, order = makeScene(nObjects, width, height, step, rng)
+        repeat = max(1, 1000 // nObjects)
+        for (name, engine, maxObjects) in engines:
+            # Dense engines need O(N*M) memory. Skip them for huge scenes
+            if maxObjects is not None and nObjects > maxObjects:
+                print("{:>8} {:>10} {:>12} {:>10}".format(nObjects, name, "-", "-"))
+                continue
+            ms, correct = runEngine(engine, objects, detections, order, repeat)
+            print("{:>8} {:>10} {:>12.3f} {:>9.1f}%".format(nObjects, name, ms, correct * 100))
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    main()
@@ -9,16 +9,29 @@
 #
 ############################################
 from progaf.CentroidTracker import CentroidTracker
+from progaf.TrackStore import TrackSnapshot
 from progaf.Projector import Projector
 from progaf.Profiler import Profiler
+from progaf.Tracer import Tracer
+from progaf.QualityController import QualityController
 from progaf.Camera import Camera
 from collections import OrderedDict
+from threading import Event, Lock
+import numpy as np
+import time
+import zlib
+import os
 
 
 class Application:
     """Application encapsulates the Application logic"""
 
-    def __init__(self):
+    def __init__(self, headless=False, headlessRendering=True):
+        # Events used to signal (without polling) that the game loop has
+        # stopped and that the tracker has published new objects
+        self.stoppedEvent = Event()
+        self.trackerUpdateEvent = Event()
+
         # Class attributes
         self.isRunning = False
         self.isStopped = True
@@ -27,6 +40,8 @@ class Application:
         self.tracker = None
         self.projector = None
         self.profiler = None
+        self.tracer = None
+        self.qualityController = None
         self.monitor = None
         self.screen = None
 
@@ -35,8 +50,72 @@ class Application:
         self.trackerObjectStatus = OrderedDict()
         self.trackerUpdateFlag = False
 
-    def setCamera(self, src, width, height, cameraMatrix=None, cameraDistor=None):
-        self.camera = Camera(src, width, height, cameraMatrix, cameraDistor)
+        # Provenance of trackerObjects: sequence number and capture time
+        # (time.perf_counter clock) of the camera frame of the last tracker
+        # update consumed (see getTrackerAge). Every object detection also
+        # records its own frame (Detection.frameSeq and frameTime)
+        self.trackerFrameSeq = -1
+        self.trackerFrameTime = 0.0
+
+        # Game objects (returned by objectAdd) of all tracked objects, by id.
+        # When batchObjectUpdates is True, updated (and predicted) objects are
+        # reported with one objectsUpdate (objectsPredict) call per frame,
+        # instead of one objectUpdate (objectPredict) call per object
+        self.gameObjects = OrderedDict()
+        self.batchObjectUpdates = False
+
+        # Tracker snapshots (see TrackSnapshot), triple buffered: the tracker
+        # fills one snapshot while another one waits to be consumed (ready)
+        # and the game loop reads the last consumed one (front). Snapshots
+        # are swapped under trackerLock, never copied
+        self.trackerLock = Lock()
+        self.trackerSnapshot = None
+        self.trackerReadySnapshot = None
+        self.trackerSpareSnapshot = None
+
+        # Latency compensation. When enabled, objectPredict is invoked on
+        # every game loop iteration with the position of every tracked object
+        # predicted for the time it will actually be displayed: frame capture
+        # time plus the end-to-end latency measured by the Profiler
+        # (defaultLatency seconds until measured), plus displayLatency
+        # seconds (projector input lag, not measurable by the framework)
+        self.latencyCompensation = False
+        self.defaultLatency = 0.1
+        self.displayLatency = 0.0
+
+        # Headless mode (servers, soak and throughput tests): no window is
+        # opened. Frames are rendered offscreen, or not rendered at all when
+        # headlessRendering is False, and the game loop and all its hooks run
+        # as usual. frameCounter counts game loop frames, and the game loop
+        # stops after maxFrames frames (None: never). Rendered frames can be
+        # checksummed (frameChecksum: last frame, framesChecksum: all frames
+        # so far, CRC32) and dumped as images into frameDumpPath (one every
+        # frameDumpInterval frames)
+        self.headless = headless
+        self.headlessRendering = headlessRendering
+        self.frameCounter = 0
+        self.maxFrames = None
+        self.frameChecksums = False
+        self.frameChecksum = 0
+        self.framesChecksum = 0
+        self.frameDumpPath = None
+        self.frameDumpInterval = 1
+
+    @property
+    def isStopped(self):
+        # The game loop stopped indicator is backed by an Event, so close()
+        # can sleep until the loop actually stops
+        return self.stoppedEvent.is_set()
+
+    @isStopped.setter
+    def isStopped(self, value):
+        if value is True:
+            self.stoppedEvent.set()
+        else:
+            self.stoppedEvent.clear()
+
+    def setCamera(self, src, width, height, cameraMatrix=None, cameraDistor=None, bufferCapacity=4):
+        self.camera = Camera(src, width, height, cameraMatrix, cameraDistor, bufferCapacity)
 
     def setProjector(self, width, height, transform=None, createShapeFactory=False):
         self.projector = Projector(width, height, transform, createShapeFactory)
@@ -44,13 +123,41 @@ class Application:
     def setDetector(self, detector):
         self.detector = detector
 
-    def setTracker(self):
-        self.tracker = CentroidTracker(self.detector, self, 20)
+    def setTracker(self, association=None, motionModel="velocity"):
+        self.tracker = CentroidTracker(self.detector, self, 20, association, motionModel)
 
     def enableMonitor(self, updateRate=1):
         # self.monitor = Monitor(self.camera, self.detector, self.tracker, self.projector)
         self.profiler = Profiler(updateRate, self.camera, self.detector, self.tracker, self.projector, self.monitor)
 
+    def enableQualityControl(self, budget=0.033, ladder=None, percentile="p95"):
+        # Keep the end-to-end latency within budget seconds, degrading quality
+        # when required (see QualityController). Enables the monitor (the
+        # Profiler provides the latency measurements) if not enabled yet.
+        # Must be invoked after setting the camera, detector, tracker and
+        # projector
+        if self.profiler is None:
+            self.enableMonitor()
+        self.qualityController = QualityController(self, budget, self.profiler.updateRate, ladder, percentile)
+
+    def enableTracing(self, capacity=65536):
+        # Record pipeline spans of all framework objects (see Tracer). Must
+        # be invoked after setting the camera, detector, tracker and projector
+        self.tracer = Tracer(capacity, self.camera, self.detector, self.tracker, self.projector, self)
+
+    def dumpTrace(self, path):
+        # Write the spans recorded so far as a Chrome trace (see Tracer)
+        if self.tracer is not None:
+            self.tracer.dump(path)
+
+    def traceSpan(self, name, start):
+        # Record a game loop span started at start (time.perf_counter_ns)
+        # when tracing is enabled. Returns the current time, so consecutive
+        # phases can be chained
+        if self.tracer is None:
+            return time.perf_counter_ns()
+        return self.tracer.span(name, start, self.trackerFrameSeq)
+
     def start(self):
         if self.camera is not None:
             self.camera.start()
@@ -62,6 +169,8 @@ class Application:
             self.monitor.start()
         if self.profiler is not None:
             self.profiler.start()
+        if self.qualityController is not None:
+            self.qualityController.start()
 
         return self
 
@@ -71,16 +180,225 @@ class Application:
         return None
 
     def updateTrackedObjects(self):
-        # This is an abstract method to be implemented in sub-classes,
-        # responsible of updating tracked objects in the game application
+        """
+        Reconcile game objects with the tracker, invoked by the game loop of
+        every engine integration (PyGameApp, panda3DApp). Only the changes
+        published by the tracker since the last call are processed, and
+        every user-space hook is invoked exactly once per change.
+        """
+        if self.trackerUpdateFlag is not True:
+            # Nothing to do...
+            return
+
+        # Get the changes published by the tracker since the last update
+        snapshot = self.consumeTrackerDelta()
+        if snapshot is None:
+            return
+
+        # 1. Delete "Lost" objects
+        for id_ in snapshot.removed:
+            if id_ in self.gameObjects:
+                self.objectDelete(id_)
+                self.gameObjectRemoved(id_, self.gameObjects.pop(id_))
+
+        # 2. Process new objects received from tracker
+        for id_ in snapshot.added:
+            self.addGameObject(id_, self.trackerObjects[id_])
+
+        # 3. Process updated objects (creating them if not existing yet)
+        updatedIds = []
+        for id_ in snapshot.updated:
+            if id_ in self.gameObjects:
+                updatedIds.append(id_)
+            else:
+                self.addGameObject(id_, self.trackerObjects[id_])
+
+        if self.batchObjectUpdates is True:
+            if len(updatedIds) > 0:
+                rows = np.array([snapshot.rowOf[id_] for id_ in updatedIds], np.intp)
+                positions = np.stack((snapshot.x[rows], snapshot.y[rows]), axis=1)
+                self.objectsUpdate(snapshot.ids[rows], positions, snapshot.dets[rows])
+        else:
+            for id_ in updatedIds:
+                self.objectUpdate(id_, self.trackerObjects[id_])
+
+    def addGameObject(self, id_, obj):
+        # Create the game object (user-space hook) for a new tracked object
+        self.gameObjects[id_] = self.objectAdd(id_, obj)
+        self.gameObjectAdded(id_, self.gameObjects[id_])
+
+    def gameObjectAdded(self, id_, gameObject):
+        # This is an abstract method to be implemented by engine integrations
+        # (PyGameApp, panda3DApp) when required: a game object (as returned
+        # by objectAdd, possibly None) has been created
+        return None
+
+    def gameObjectRemoved(self, id_, gameObject):
+        # This is an abstract method to be implemented by engine integrations
+        # (PyGameApp, panda3DApp) when required: a game object has been
+        # deleted
+        return None
+
+    def publishTrackerSnapshot(self, snapshot):
+        """
+        Invoked by the tracker to hand a new snapshot to the application.
+        Returns the snapshot the tracker must fill next time. If the previous
+        snapshot was not consumed yet, its changes are merged into the new
+        one (so no object addition or removal is lost) and it is recycled.
+        """
+        with self.trackerLock:
+            if self.trackerReadySnapshot is not None:
+                snapshot.mergePrevious(self.trackerReadySnapshot)
+                recycled = self.trackerReadySnapshot
+            elif self.trackerSpareSnapshot is not None:
+                recycled = self.trackerSpareSnapshot
+                self.trackerSpareSnapshot = None
+            else:
+                recycled = TrackSnapshot()
+            self.trackerReadySnapshot = snapshot
+
+        self.notifyTrackerUpdate()
+        return recycled
+
+    def consumeTrackerDelta(self):
+        """
+        Invoked by the game loop to get the latest tracker snapshot. Applies
+        the snapshot changes to trackerObjects and trackerObjectStatus, and
+        returns the snapshot (its added, updated, troubled and removed sets
+        are the changes since the previous call), or None if the tracker did
+        not publish anything new.
+        """
+        with self.trackerLock:
+            snapshot = self.trackerReadySnapshot
+            if snapshot is None:
+                self.trackerUpdateFlag = False
+                return None
+            self.trackerReadySnapshot = None
+            self.trackerSpareSnapshot = self.trackerSnapshot
+            self.trackerSnapshot = snapshot
+            self.trackerUpdateFlag = False
+
+        self.trackerFrameSeq = snapshot.frameSeq
+        self.trackerFrameTime = snapshot.timestamp
+        if self.profiler is not None:
+            self.profiler.collectGLTSample(time.perf_counter() - snapshot.timestamp)
+
+        # Only objects that changed are touched
+        for id_ in snapshot.removed:
+            self.trackerObjects.pop(id_, None)
+            self.trackerObjectStatus.pop(id_, None)
+        for id_ in snapshot.added | snapshot.updated | snapshot.troubled:
+            self.trackerObjects[id_], self.trackerObjectStatus[id_] = snapshot.get(id_)
+
+        return snapshot
+
+    def getTrackerAge(self):
+        """
+        Return (seconds, frames) elapsed since the capture of the camera
+        frame trackerObjects come from: time, and camera frames captured
+        since then (None without a camera). (None, None) before the first
+        tracker update.
+        """
+        if self.trackerFrameSeq < 0:
+            return None, None
+        frames = None
+        if self.camera is not None:
+            frames = self.camera.frameSeq - self.trackerFrameSeq
+        return time.perf_counter() - self.trackerFrameTime, frames
+
+    def getLatency(self):
+        # Time (seconds) from frame capture to display
+        latency = self.defaultLatency
+        if self.profiler is not None and self.profiler.LATaverage > 0:
+            latency = self.profiler.LATaverage
+        return latency + self.displayLatency
+
+    def predictTrackedPositions(self, timestamp=None):
+        """
+        Return (ids, positions) for the tracked objects of the last tracker
+        snapshot consumed, with positions (float array, one (x, y) row per
+        object) extrapolated to timestamp (time.perf_counter clock). By
+        default, the predicted display time of the snapshot frame.
+        """
+        snapshot = self.trackerSnapshot
+        if snapshot is None or self.tracker is None:
+            return None, None
+        if timestamp is None:
+            timestamp = max(snapshot.timestamp + self.getLatency(), time.perf_counter())
+        return snapshot.ids[:snapshot.count], self.tracker.kalman.extrapolate(snapshot, timestamp)
+
+    def updatePredictedObjects(self):
+        # Invoke objectPredict (user-space hook) for every game object, when
+        # latency compensation is enabled
+        if self.latencyCompensation is False:
+            return
+        ids, positions = self.predictTrackedPositions()
+        if ids is None or len(ids) == 0:
+            return
+        if self.batchObjectUpdates is True:
+            existing = np.array([id_ in self.gameObjects for id_ in ids.tolist()], bool)
+            self.objectsPredict(ids[existing], positions[existing])
+            return
+        for id_, (xpos, ypos) in zip(ids.tolist(), positions.tolist()):
+            if id_ in self.gameObjects:
+                self.objectPredict(id_, xpos, ypos)
+
+    def collectLatencySample(self):
+        # Invoked after the screen is updated: end-to-end latency of the
+        # tracking information displayed
+        if self.profiler is not None and self.trackerSnapshot is not None:
+            self.profiler.collectLATSample(time.perf_counter() - self.trackerSnapshot.timestamp)
+
+    def collectRenderedFrame(self, rendered=True):
+        """
+        Invoked by the game loop after every frame (rendered is False if the
+        frame was not rendered). Checksums and dumps rendered frames when
+        required (see headless mode) and stops the game loop after maxFrames
+        frames.
+        """
+        self.frameCounter += 1
+        if rendered is True:
+            if self.frameChecksums is True:
+                self.frameChecksum = zlib.crc32(self.getFrameBuffer())
+                self.framesChecksum = zlib.crc32(self.frameChecksum.to_bytes(4, "little"), self.framesChecksum)
+            if self.frameDumpPath is not None and (self.frameCounter - 1) % self.frameDumpInterval == 0:
+                self.saveFrame(os.path.join(self.frameDumpPath, "frame{:06d}.png".format(self.frameCounter)))
+
+        if self.maxFrames is not None and self.frameCounter >= self.maxFrames:
+            self.isRunning = False
+
+    def getFrameBuffer(self):
+        # This is an abstract method to be implemented by engine integrations
+        # (PyGameApp, panda3DApp): pixels of the last rendered frame (any
+        # object supporting the buffer protocol), for frame checksums
+        return b""
+
+    def saveFrame(self, path):
+        # This is an abstract method to be implemented by engine integrations
+        # (PyGameApp, panda3DApp): save the last rendered frame as an image
         return None
 
+    def notifyTrackerUpdate(self):
+        # Invoked after the tracker publishes new tracking information
+        self.trackerUpdateFlag = True
+        self.trackerUpdateEvent.set()
+
+    def waitForTrackerUpdate(self, timeout=None):
+        # Block until the tracker publishes new tracking information, the
+        # application is stopped, or timeout seconds elapse. Returns True if
+        # new tracking information is available
+        self.trackerUpdateEvent.wait(timeout)
+        self.trackerUpdateEvent.clear()
+        return self.trackerUpdateFlag
 
     def stop(self):
-        # Stop update thread
+        # Stop update thread and wake it up if waiting for the tracker
         self.isRunning = False
+        self.trackerUpdateEvent.set()
 
         # stop framework objects
+        if self.qualityController is not None:
+            self.qualityController.stop()
         if self.profiler is not None:
             self.profiler.stop()
         if self.projector is not None:
@@ -97,10 +415,9 @@ class Application:
         self.stop()
 
         # Wait for the game loop to actually stop before quitting pygame
-        # Warning! Do not call self.close() inside main game loop or this while
-        # loop will block the execution forever!.
-        while self.isStopped is False:
-            pass
+        # Warning! Do not call self.close() inside main game loop or this wait
+        # will block the execution forever!.
+        self.stoppedEvent.wait()
 
     ##############################
     # Userspace Application Hooks
@@ -129,6 +446,29 @@ class Application:
         # by CentroidTracker). The id received is the unique id assigned to this object by the framework
         return None
 
+    def objectsUpdate(self, ids, positions, objs):
+        # This is an abstract method to be implemented in sub-classes when required
+        # The method replaces objectUpdate when batched updates are enabled (self.batchObjectUpdates == True). It
+        # will be invoked by Application once per tracker update, with the ids (int array) of all the objects updated,
+        # their positions (float array, one (x, y) row per object) and their detections (object array, see
+        # objectUpdate)
+        return None
+
+    def objectsPredict(self, ids, positions):
+        # This is an abstract method to be implemented in sub-classes when required
+        # The method replaces objectPredict when batched updates are enabled (self.batchObjectUpdates == True). It
+        # will be invoked by Application once per game loop iteration with the ids (int array) of all game objects and
+        # their predicted positions (float array, one (x, y) row per object)
+        return None
+
+    def objectPredict(self, id_, xpos, ypos):
+        # This is an abstract method to be implemented in sub-classes when required
+        # The method will be invoked by Application on every game loop iteration when latency compensation is
+        # enabled (self.latencyCompensation == True), for every tracked object. xpos and ypos are the position of the
+        # object predicted for the time the current game frame will be displayed (see self.getLatency), so sprites
+        # can be drawn where the real world object actually is
+        return None
+
     def objectDelete(self, id_):
         # This is an abstract method to be implemented in sub-classes when required
         # The method will be invoked by the Application every time an object is no longer detected (is lost) in the
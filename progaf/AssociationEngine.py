@@ -0,0 +1,178 @@
+############################################
+# PROGAF                                   #
+# Projection Games Framework               #
+############################################
+# AssociationEngine.py                     #
+############################################
+#
+# 2026/10/18 Initial Release
+#
+############################################
+import numpy as np
+
+
+class AssociationEngine:
+    """
+    Base class for all association engines. An association engine matches
+    the centroids of tracked objects (rows) with the centroids of new
+    detections (columns), and is used by CentroidTracker on every frame.
+
+    Pairs farther apart than maxDistance (pixels) are never matched
+    (gating). Use maxDistance=None to disable gating.
+
+    scipy is only imported when an engine is created (not when this module
+    is imported), so applications without a tracker never load it.
+    """
+
+    def __init__(self, maxDistance=None):
+        self.maxDistance = maxDistance
+        from scipy.spatial.distance import cdist
+        self.distances = cdist
+
+    def match(self, objectCentroids, inputCentroids):
+        """
+        Match objectCentroids (N, 2) with inputCentroids (M, 2). Returns
+        (rows, cols), two int arrays with the indexes of every matched pair.
+        Every row and every column is matched at most once.
+        """
+        # This is an abstract method to be implemented in sub-classes
+        return np.zeros(0, np.intp), np.zeros(0, np.intp)
+
+    def gate(self, rows, cols, distances):
+        # Discard pairs farther apart than maxDistance
+        if self.maxDistance is None:
+            return rows, cols
+        valid = distances <= self.maxDistance
+        return rows[valid], cols[valid]
+
+
+class GreedyAssociation(AssociationEngine):
+    """
+    Global greedy association over the dense distance matrix: pairs are
+    matched nearest first, as long as both their row and their column are
+    still available (like the original CentroidTracker algorithm, but a row
+    whose nearest column is taken falls back to its nearest available one,
+    so every row is matched while columns remain, and objects are not lost
+    and re-registered when two of them compete for one detection).
+
+    Implemented as rounds over the whole matrix: every round matches all
+    mutually nearest (row, column) pairs, which are exactly the pairs a
+    pair by pair greedy would match next. O(N*M) time and memory per round,
+    and only a few rounds in practice.
+    """
+
+    def match(self, objectCentroids, inputCentroids):
+        # Compute the distance between each pair of object centroids and
+        # detection (input) centroids. Gated pairs are never matched
+        D = self.distances(objectCentroids, inputCentroids)
+        if self.maxDistance is not None:
+            D[D > self.maxDistance] = np.inf
+
+        # Rows and columns still available (indexes into the original
+        # matrix), and pairs matched
+        rows = np.arange(D.shape[0])
+        cols = np.arange(D.shape[1])
+        matchedRows = []
+        matchedCols = []
+        while len(rows) > 0 and len(cols) > 0:
+            # Nearest column of every row, and nearest row of every column
+            rowNearest = D.argmin(axis=1)
+            colNearest = D.argmin(axis=0)
+            index = np.arange(len(rows))
+            mutual = (colNearest[rowNearest] == index) & np.isfinite(D[index, rowNearest])
+            if not np.any(mutual):
+                break
+            matchedRows.append(rows[mutual])
+            matchedCols.append(cols[rowNearest[mutual]])
+
+            # Drop matched rows and columns
+            remainingRows = ~mutual
+            remainingCols = np.ones(len(cols), bool)
+            remainingCols[rowNearest[mutual]] = False
+            rows = rows[remainingRows]
+            cols = cols[remainingCols]
+            D = D[remainingRows][:, remainingCols]
+
+        if len(matchedRows) == 0:
+            return np.zeros(0, np.intp), np.zeros(0, np.intp)
+        return np.concatenate(matchedRows), np.concatenate(matchedCols)
+
+
+class HungarianAssociation(AssociationEngine):
+    """
+    Optimal association (minimum total distance) over the dense distance
+    matrix, using scipy linear_sum_assignment (Hungarian algorithm). Avoids
+    ID swaps when objects cross. Pairs farther apart than maxDistance are
+    never matched.
+    """
+
+    def __init__(self, maxDistance=None):
+        super().__init__(maxDistance)
+        from scipy.optimize import linear_sum_assignment
+        self.linearSumAssignment = linear_sum_assignment
+
+    def match(self, objectCentroids, inputCentroids):
+        D = self.distances(objectCentroids, inputCentroids)
+
+        # Gated pairs get a prohibitive cost, so the solver does not bend the
+        # assignment of other pairs to match them
+        if self.maxDistance is not None:
+            D[D > self.maxDistance] = 1e9
+
+        rows, cols = self.linearSumAssignment(D)
+        return self.gate(rows, cols, D[rows, cols])
+
+
+class SparseAssociation(AssociationEngine):
+    """
+    Sparse association for scenes with thousands of objects. Candidate pairs
+    are found with a k-d tree (the k nearest detections of every object,
+    within maxDistance), and matched greedily, nearest pairs first. Time is
+    close to O((N + M) log M), and memory O(N * k). maxDistance is required.
+    """
+
+    def __init__(self, maxDistance=50, k=4):
+        super().__init__(maxDistance)
+        self.k = k
+        from scipy.spatial import cKDTree
+        self.KDTree = cKDTree
+
+    def match(self, objectCentroids, inputCentroids):
+        k = min(self.k, len(inputCentroids))
+        tree = self.KDTree(inputCentroids)
+        distances, cols = tree.query(objectCentroids, k=k, distance_upper_bound=self.maxDistance)
+        distances = distances.reshape(len(objectCentroids), k)
+        cols = cols.reshape(len(objectCentroids), k)
+
+        # Candidate pairs (missing neighbours have infinite distance)
+        rows = np.repeat(np.arange(len(objectCentroids)), k)
+        distances = distances.ravel()
+        cols = cols.ravel()
+        valid = np.isfinite(distances)
+        rows, cols, distances = rows[valid], cols[valid], distances[valid]
+
+        # Sort candidate pairs by distance
+        order = np.argsort(distances, kind="stable")
+        rows, cols = rows[order], cols[order]
+
+        # Greedy matching, vectorized: on every round, accept the pairs that
+        # are the nearest remaining candidate for both their row and their
+        # column, then drop every candidate using an accepted row or column
+        matchedRows = []
+        matchedCols = []
+        while len(rows) > 0:
+            firstRow = np.zeros(len(rows), bool)
+            firstRow[np.unique(rows, return_index=True)[1]] = True
+            firstCol = np.zeros(len(cols), bool)
+            firstCol[np.unique(cols, return_index=True)[1]] = True
+            accepted = firstRow & firstCol
+
+            matchedRows.append(rows[accepted])
+            matchedCols.append(cols[accepted])
+
+            remaining = ~(np.isin(rows, rows[accepted]) | np.isin(cols, cols[accepted]))
+            rows, cols = rows[remaining], cols[remaining]
+
+        if len(matchedRows) == 0:
+            return np.zeros(0, np.intp), np.zeros(0, np.intp)
+        return np.concatenate(matchedRows), np.concatenate(matchedCols)
@@ -45,3 +45,31 @@ class BlobDetector(Detector):
                          point.response,
                          point.angle)
             self.detections.append(Detection(int(point.pt[0]), int(point.pt[1]), detection))
+
+    def refineDetection(self, frame, detection):
+        # Refine the centroid and size of a blob detected over a downscaled
+        # frame (see Detector.detectionScale) with the moments of the blob
+        # over the full resolution frame
+        size = detection.detection[1]
+        radius = int(size * 0.75) + 2
+        x, y = int(round(detection.xpos)), int(round(detection.ypos))
+        x1, y1 = max(x - radius, 0), max(y - radius, 0)
+        patch = frame[y1:y + radius + 1, x1:x + radius + 1]
+        if patch.shape[0] < 3 or patch.shape[1] < 3:
+            return
+        if patch.ndim == 3:
+            patch = cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY)
+
+        # Blob pixels: the side of the (Otsu) threshold of the blob center
+        threshold, mask = cv2.threshold(patch, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        if mask[min(y - y1, mask.shape[0] - 1), min(x - x1, mask.shape[1] - 1)] == 0:
+            cv2.bitwise_not(mask, mask)
+        moments = cv2.moments(mask, True)
+        if moments["m00"] == 0:
+            return
+
+        # Positions (and sizes) are integers (see Detection)
+        detection.xpos = int(round(x1 + moments["m10"] / moments["m00"]))
+        detection.ypos = int(round(y1 + moments["m01"] / moments["m00"]))
+        size = int(round(2 * np.sqrt(moments["m00"] / np.pi)))
+        detection.detection = (detection.detection[0], size) + detection.detection[2:]
@@ -8,6 +8,7 @@
 # 2021/02/25 Initial Release (by Keko)
 #
 ############################################
+from progaf.FrameBuffer import FrameBuffer
 from threading import Thread
 import numpy as np
 import time
@@ -39,31 +40,42 @@ when reading from files.
     the camera
 
     **- cameraDistor** contains the distortion coefficients for the camera
+
+    **- frameBuffer** is the ring of preallocated frame slots where processed
+    frames are published. Consumers should read frames through a
+    FrameBuffer reader instead of polling frameIsNew
+
+    **- bufferCapacity** is the number of slots in the frame buffer
     """
 
-    def __init__(self, src, width, height, cameraMatrix, cameraDistor):
+    def __init__(self, src, width, height, cameraMatrix, cameraDistor, bufferCapacity=4):
         """
         :param src: contains the source stream for the object. Source can be
                an index to a video stream (example: '0' for /dev/video0 in
-               linux) or a filename (example: 'video.mp4')
+               linux), a filename (example: 'video.mp4') or a
+               VideoCapture-like object (example: a SyntheticStream)
         :param width: contains the frame width in pixels
         :param height: contains the frame height in pixels
         :param cameraMatrix: contains the intrinsic and extrinsic parameters
                for the camera as calculated by OpenCV
         :param cameraDistor: contains the distortion coefficients for the
                camera as calculated by OpenCV
+        :param bufferCapacity: number of preallocated slots in the frame
+               buffer shared with the camera consumers
         """
 
         # Class attributes
         self.isRunning = False
         self.stream = None
         self.source = None
-        self.frame = None
         self.frameWidth = None
         self.frameHeight = None
         self.frameIsNew = False
         self.frameIsValid = False
         self.frameCounter = 0
+        self.frameSeq = 0
+        self.frameTime = 0.0
+        self.frameBuffer = FrameBuffer(bufferCapacity)
         self.flip = True
         self.undist = False
         self.crop = False
@@ -76,10 +88,21 @@ when reading from files.
         self.displayFPS = True
         self.capturePath = ".\\captures\\"
 
+        # Remap tables fusing flip, undistort and crop in one cv2.remap call.
+        # Tables are cached and rebuilt only when camera coefficients, crop
+        # area, resolution or flip/crop settings change. Fixed-point tables
+        # (CV_16SC2) are faster, with a small loss of accuracy
+        self.remapFixedPoint = False
+        self.remapInterpolation = cv2.INTER_LINEAR
+        self.remapKey = None
+        self.remapMap1 = None
+        self.remapMap2 = None
+
         self.frameIsNew = False
         self.frameIsValid = False
         self.source = None
         self.profiler = None
+        self.tracer = None
 
         # Default value for camera intrinsic/extrinsic coefficients
         if cameraMatrix is not None:
@@ -100,6 +123,9 @@ when reading from files.
         if type(src) == int:
             # Initialize from Stream
             self.initFromStream(src, width, height)
+        elif hasattr(src, "read"):
+            # Initialize from a VideoCapture-like object
+            self.initFromSource(src)
         else:
             # Initialize from file
             self.initFromFile(src)
@@ -207,10 +233,46 @@ when reading from files.
         if restartUpdateIsRequired is True:
             self.start()
 
+    def initFromSource(self, src):
+        # Initialize the camera object using a VideoCapture-like object
+        # (providing read, get, isOpened and release methods) as a video
+        # source. See SyntheticCamera
+
+        # Check if a previous stream is opened and release it
+        restartUpdateIsRequired = False
+        if self.stream is not None:
+            # Stop the update thread
+            self.stop()
+            restartUpdateIsRequired = True
+
+        # Set new source
+        self.source = src
+        self.stream = src
+
+        # Check if the stream is open
+        if self.stream.isOpened() is False:
+            print("Error: Camera.InitFromSource unable to open source {}".format(self.source))
+
+        self.frameWidth = int(self.stream.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.frameHeight = int(self.stream.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        # Set Crop default values if required
+        if self.cropx1 is None:
+            # Set Cropping default values (50 pixels border)
+            self.cropx1 = 50
+            self.cropx2 = self.frameWidth - 50
+            self.cropy1 = 50
+            self.cropy2 = self.frameHeight - 50
+
+        # Restart update thread if required
+        if restartUpdateIsRequired is True:
+            self.start()
+
     def start(self):
         # Start the thread to read frames
         self.isRunning = True
-        Thread(target=self.update, args=()).start()
+        self.frameBuffer.open()
+        Thread(target=self.update, args=(), name="Camera").start()
         return self
 
     def update(self):
@@ -218,7 +280,7 @@ when reading from files.
         # Keep looping infinitely until the thread is stopped
         while True:
             # Get update loop starting time for performance monitoring
-            start = time.time()
+            start = time.perf_counter_ns()
 
             # Check status and stop thread if required
             if self.isRunning is False:
@@ -226,38 +288,43 @@ when reading from files.
 
             # Read the next frame from the stream
             ok, frame = self.stream.read()
+            captureTime = time.perf_counter()
+            if self.tracer is not None:
+                self.tracer.span("Camera.read", start)
 
-            # Frame Pre-processing: Un-distort, Crop, Save
+            # Frame Pre-processing: Flip, Un-distort, Crop, Save
             if ok:
 
-                # Flip
-                if self.flip is True:
-                    frame = cv2.flip(frame, 1)
+                # Flip, Un-distort and Crop the frame directly into the next
+                # free frame buffer slot
+                x1, y1, x2, y2 = self.getOutputArea(frame)
+                index, slot = self.frameBuffer.acquire((y2 - y1, x2 - x1) + frame.shape[2:], frame.dtype)
 
-                # Un-distort
-                if self.undist is True:
-                    frame = cv2.undistort(frame, self.cameraMatrix, self.cameraDistor)
+                if index >= 0:
+                    self.preprocessFrame(frame, slot)
 
-                # Draw grid
-                if self.displayGrid is True:
-                    self.drawGrid(frame)
+                    # Draw grid
+                    if self.displayGrid is True:
+                        self.drawGrid(slot, x1, y1)
 
-                # Display cropping area (only when frame isn't cropped)
-                if self.displayCrop is True and self.crop is False:
-                    self.drawCropArea(frame)
+                    # Display cropping area (only when frame isn't cropped)
+                    if self.displayCrop is True and self.crop is False:
+                        self.drawCropArea(slot)
 
-                # Crop
-                if self.crop is True:
-                    frame = frame[self.cropy1:self.cropy2, self.cropx1:self.cropx2]
+                    # FPS
+                    if self.displayFPS is True:
+                        self.drawFPS(slot)
 
-                # FPS
-                if self.displayFPS is True:
-                    self.drawFPS(frame)
+                    # Publish the frame in the frame buffer. The frame is
+                    # complete at this point (no more drawing over it), so
+                    # readers never get torn frames
+                    seq = self.frameBuffer.publish(index, captureTime)
 
-                # Set properties for the new frame
-                self.frame = frame
-                self.frameIsValid = True
-                self.frameIsNew = True
+                    # Set properties for the new frame
+                    self.frameSeq = seq
+                    self.frameTime = captureTime
+                    self.frameIsValid = True
+                    self.frameIsNew = True
                 self.frameCounter += 1
 
             else:
@@ -265,26 +332,108 @@ when reading from files.
 
             # Get loop end time and update performance monitor
             if self.profiler is not None:
-                end = time.time()
-                self.profiler.collectFATSample(end - start)
+                self.profiler.FAThistogram.record(time.perf_counter_ns() - start)
+            if self.tracer is not None:
+                self.tracer.span("Camera.update", start, self.frameSeq)
+
+    def getOutputArea(self, frame):
+        # Return the area (x1, y1, x2, y2) of the source frame kept after
+        # pre-processing (the crop area, or the whole frame). The crop area
+        # is clamped to the frame, so the output area is never empty and
+        # never extends past the frame edges
+        h, w = frame.shape[:2]
+        if self.crop is True:
+            x1 = min(max(self.cropx1, 0), w - 1)
+            y1 = min(max(self.cropy1, 0), h - 1)
+            x2 = min(max(self.cropx2, x1 + 1), w)
+            y2 = min(max(self.cropy2, y1 + 1), h)
+            return x1, y1, x2, y2
+        return 0, 0, w, h
+
+    def preprocessFrame(self, frame, dst):
+        """
+        Flip, un-distort and crop frame, writing the result into dst. When
+        un-distortion is enabled, the three operations are performed by a
+        single cv2.remap call using cached remap tables. Otherwise, only the
+        pixels inside the crop area are flipped (or copied).
+        """
+        if self.undist is True:
+            self.updateRemapTables(frame)
+            cv2.remap(frame, self.remapMap1, self.remapMap2, self.remapInterpolation, dst=dst)
+            return dst
+
+        # Crop before flipping, so discarded pixels are never touched. The
+        # crop area is defined over the flipped frame, so it is mirrored
+        x1, y1, x2, y2 = self.getOutputArea(frame)
+        if self.flip is True:
+            w = frame.shape[1]
+            cv2.flip(frame[y1:y2, w - x2:w - x1], 1, dst=dst)
+        else:
+            np.copyto(dst, frame[y1:y2, x1:x2])
+        return dst
+
+    def updateRemapTables(self, frame):
+        """
+        Build (only when required) remap tables mapping every pixel of the
+        output frame (flipped, un-distorted and cropped) to the source frame.
+        """
+        x1, y1, x2, y2 = self.getOutputArea(frame)
+        h, w = frame.shape[:2]
+        key = (self.cameraMatrix.tobytes(), np.asarray(self.cameraDistor).tobytes(),
+               w, h, x1, y1, x2, y2, self.flip, self.remapFixedPoint)
+        if key == self.remapKey:
+            return
 
-    def drawGrid(self, frame):
+        # Un-distort and crop: output pixel (u, v) is un-distorted pixel
+        # (u + x1, v + y1), so the principal point of the new camera matrix
+        # is shifted by the crop offset
+        newCameraMatrix = np.array(self.cameraMatrix, dtype=np.float64)
+        newCameraMatrix[0, 2] -= x1
+        newCameraMatrix[1, 2] -= y1
+        map1, map2 = cv2.initUndistortRectifyMap(self.cameraMatrix, self.cameraDistor, None,
+                                                 newCameraMatrix, (x2 - x1, y2 - y1), cv2.CV_32FC1)
+
+        # Flip: un-distortion is applied over the flipped frame, so mirror
+        # the source x coordinates
+        if self.flip is True:
+            np.subtract(w - 1, map1, out=map1)
+
+        # Fixed-point tables
+        if self.remapFixedPoint is True:
+            map1, map2 = cv2.convertMaps(map1, map2, cv2.CV_16SC2)
+
+        self.remapMap1 = map1
+        self.remapMap2 = map2
+        self.remapKey = key
+
+    def drawGrid(self, frame, offsetx=0, offsety=0):
         pixels = 0
         white = (255, 255, 255)
         thickness = 1
         w = self.frameWidth
         h = self.frameHeight
+        # Grid is defined over the full frame. Offset is the top left corner
+        # of the crop area when the frame is cropped
+        cx = int(w / 2) - offsetx
+        cy = int(h / 2) - offsety
         # Reference Lines
-        cv2.line(frame, (0 + pixels, int(h / 2)), (w - pixels, int(h / 2)), white, thickness)
-        cv2.line(frame, (int(w / 2), 0 + pixels), (int(w / 2), h - pixels), white, thickness)
+        cv2.line(frame, (0 + pixels - offsetx, cy), (w - pixels - offsetx, cy), white, thickness)
+        cv2.line(frame, (cx, 0 + pixels - offsety), (cx, h - pixels - offsety), white, thickness)
         # Frame Center
-        cv2.drawMarker(frame, (int(w / 2), int(h / 2)), white, cv2.MARKER_SQUARE)
+        cv2.drawMarker(frame, (cx, cy), white, cv2.MARKER_SQUARE)
 
     def setCropArea(self, roi):
-        self.cropx1 = roi[0]
-        self.cropy1 = roi[1]
-        self.cropx2 = roi[0] + roi[2]
-        self.cropy2 = roi[1] + roi[3]
+        # Set the crop area (x, y, width, height), clamped to the frame size
+        x1, y1, x2, y2 = roi[0], roi[1], roi[0] + roi[2], roi[1] + roi[3]
+        if self.frameWidth is not None and self.frameHeight is not None:
+            x1 = min(max(x1, 0), self.frameWidth - 1)
+            y1 = min(max(y1, 0), self.frameHeight - 1)
+            x2 = min(max(x2, x1 + 1), self.frameWidth)
+            y2 = min(max(y2, y1 + 1), self.frameHeight)
+        self.cropx1 = x1
+        self.cropy1 = y1
+        self.cropx2 = x2
+        self.cropy2 = y2
 
     def drawCropArea(self, frame):
         red = (0, 0, 255)
@@ -306,13 +455,28 @@ when reading from files.
 
 
     def read(self):
-        # return the last available frame read
-        return self.frameIsValid, self.frame
+        # return a copy of the last available frame read. Frame buffer slots
+        # are overwritten by the camera thread after bufferCapacity frames,
+        # so legacy accessors (read, frame, writeToFile) return copies owned
+        # by the caller. Consumers processing every frame should use a
+        # FrameReader (see FrameBuffer) instead, which avoids the copy
+        if self.frameIsValid is False:
+            return False, None
+        ok, seq, timestamp, frame = self.frameBuffer.copyLatest()
+        return ok, frame
+
+    @property
+    def frame(self):
+        # Legacy accessor: a copy of the last available frame (see read)
+        return self.read()[1]
 
     def writeToFile(self):
         # save last valid frame to file
+        ok, frame = self.read()
+        if ok is False:
+            return
         filename = "Camera {} frame {}.png".format(time.strftime("%H-%M"), self.frameCounter)
-        cv2.imwrite(self.capturePath + filename, self.frame)
+        cv2.imwrite(self.capturePath + filename, frame)
 
     def stop(self):
         if self.isRunning is False:
@@ -321,5 +485,8 @@ when reading from files.
         # Stop update thread
         self.isRunning = False
 
+        # Wake up consumers blocked waiting for new frames
+        self.frameBuffer.close()
+
         # Stop source
         self.stream.release()
@@ -4,17 +4,18 @@
 ############################################
 # CentroidTracker.py                       #
 ############################################
-from scipy.spatial import distance as dist
-from collections import OrderedDict
+from progaf.AssociationEngine import GreedyAssociation
+from progaf.TrackStore import TrackStore, TrackSnapshot
+from progaf.KalmanFilter import KalmanFilter
+from progaf.Drawing import fillCircles
 import numpy as np
-import copy
 import time
 import cv2
 
 
 class CentroidTracker:
 
-    def __init__(self, detector, application, maxMissCount=50):
+    def __init__(self, detector, application, maxMissCount=50, association=None, motionModel="velocity"):
 
         self.det = detector
         self.det.tracker = self
@@ -23,163 +24,137 @@ class CentroidTracker:
         self.nextObjectID = 0
         self.maxMissCount = maxMissCount
 
-        # Properties of the tracked objects
-        self.objectCentroids = OrderedDict()
-        self.objectDets = OrderedDict()
-        self.objectTrackStatus = OrderedDict()
-        self.objectMissCount = OrderedDict()
+        # Association engine used to match detections with tracked objects
+        # (see AssociationEngine). Greedy nearest centroid by default
+        if association is not None:
+            self.association = association
+        else:
+            self.association = GreedyAssociation()
+
+        # Motion estimate of every tracked object ("velocity" or
+        # "acceleration" Kalman filter, see KalmanFilter). Detections are
+        # associated with the positions predicted for their frame time
+        self.kalman = KalmanFilter(motionModel)
+
+        # Properties of the tracked objects, as a struct of arrays (see
+        # TrackStore)
+        self.tracks = TrackStore(order=self.kalman.order)
+
+        # Changes since the last application update, and the snapshot used
+        # to hand them (and a copy of the tracks) to the application
+        self.added = set()
+        self.updated = set()
+        self.troubled = set()
+        self.removed = set()
+        self.snapshot = TrackSnapshot(order=self.kalman.order)
 
         self.displayIDs = True
         self.displayCentroids = False
         self.displayObjects = False
 
+        # Display objects over projector frames at the position predicted
+        # for the time they will actually be projected (see
+        # Application.getLatency)
+        self.displayPredicted = False
+
         self.displayOnCamera = False
         self.displayOnProjector = False
 
-        self.perfMon = None
+        self.profiler = None
+        self.tracer = None
 
     def registerDetection(self, centroid, det):
         # when registering an object we use the next available object
-        # ID to store the centroid
-        self.objectCentroids[self.nextObjectID] = centroid
-        self.objectDets[self.nextObjectID] = copy.copy(det)
-        self.objectTrackStatus[self.nextObjectID] = "New"
-        self.objectMissCount[self.nextObjectID] = 0
+        # ID to store the centroid. The motion estimate starts at the
+        # centroid, at rest
+        row = self.tracks.add(self.nextObjectID, centroid[0], centroid[1], det, TrackStore.NEW)
+        self.kalman.initialize(self.tracks, row, centroid[0], centroid[1], self.tracks.timestamp)
+        self.added.add(self.nextObjectID)
         self.nextObjectID += 1
 
     def deregisterDetection(self, objectID):
-        # to de-register an object ID we delete the object ID from
-        # both of our respective dictionaries and remove it from the
-        # main application
-        del self.objectCentroids[objectID]
-        del self.objectDets[objectID]
-        del self.objectTrackStatus[objectID]
-        del self.objectMissCount[objectID]
+        # to de-register an object ID we remove its row from the track
+        # store, and report it as removed to the main application
+        self.tracks.remove(self.tracks.rowOf[objectID])
+        self.added.discard(objectID)
+        self.updated.discard(objectID)
+        self.troubled.discard(objectID)
+        self.removed.add(objectID)
+
+    def update(self, detections, timestamp=None, frameSeq=-1):
+        """
+        Update tracked objects with the detections of a new frame. timestamp
+        is the frame capture time (time.perf_counter clock), now if None, and
+        frameSeq the frame sequence number (-1 if unknown).
+        """
+        # Get update starting time for performance monitoring
+        start = time.perf_counter_ns()
 
-    def update(self, detections):
+        if timestamp is None:
+            timestamp = time.perf_counter()
 
-        # Get update starting time for performance monitoring
-        start = time.time()
-
-        # Check to see if the list of input detections is empty.
-        if len(detections) == 0:
-            # loop over any existing tracked objects and increment their
-            # miss count
-            for objectID in list(self.objectMissCount.keys()):
-                self.objectMissCount[objectID] += 1
-                self.objectTrackStatus[objectID] = "Trouble"
-                # if we have reached a maximum number of consecutive
-                # frames where a given object has been marked as
-                # missing (troubled), de-register it
-                if self.objectMissCount[objectID] > self.maxMissCount:
-                    self.deregisterDetection(objectID)
-
-            # Update application with tracking information.
-            self.updateApplication()
-
-            # Display update is required.
-            self.display()
-
-            # Get end time and update performance monitor
-            if self.perfMon is not None:
-                end = time.time()
-                self.perfMon.collectOTTSample(end - start)
-
-            # Early return, there are no objects to update.
-            return
+        # Move the motion estimate of all tracked objects to the frame time
+        tracks = self.tracks
+        tracks.timestamp = timestamp
+        tracks.frameSeq = frameSeq
+        self.kalman.predict(tracks, timestamp)
+        n = tracks.count
 
         ##########################
         # Try to assign detection centroids to tracked objects
         ########################################################################
-        # If we are currently not tracking any objects, we need to register all
-        # detections as new objects
-        if len(self.objectCentroids) == 0:
-            for detection in detections:
-                self.registerDetection((detection.xpos, detection.ypos),
-                                       detection)
-
-        # Otherwise, we are currently tracking objects so we need to
-        # try to match the input detection centroids to existing
-        # tracked object centroids
-        else:
-            # Grab the set of tracked object IDs and corresponding centroids
-            objectIDs = list(self.objectCentroids.keys())
-            objectCentroids = list(self.objectCentroids.values())
+        # Rows (tracked objects) and columns (detections) matched
+        rows = np.zeros(0, np.intp)
+        cols = np.zeros(0, np.intp)
 
+        # If we are currently tracking objects and there are detections, we
+        # need to try to match the input detection centroids to existing
+        # tracked object centroids
+        if n > 0 and len(detections) > 0:
             # Grab the set of input centroids and associated detections
-            inputCentroid = np.zeros((len(detections), 2), dtype="int")
-            inputObjectDet = OrderedDict()
-            for (i, detection) in enumerate(detections):
-                inputCentroid[i] = (detection.xpos, detection.ypos)
-                inputObjectDet[i] = detection
-
-            # Compute the distance between each pair of object
-            # centroids and detection (input) centroids, respectively -- our
-            # goal will be to match an input centroid to an existing
-            # object centroid
-            D = dist.cdist(np.array(objectCentroids), inputCentroid)
-            # in order to perform this matching we must (1) find the
-            # smallest value in each row and then (2) sort the row
-            # indexes based on their minimum values so that the row
-            # with the smallest value is at the *front* of the index
-            # list
-            rows = D.min(axis=1).argsort()
-            # next, we perform a similar process on the columns by
-            # finding the smallest value in each column and then
-            # sorting using the previously computed row index list
-            cols = D.argmin(axis=1)[rows]
-            # in order to determine if we need to update, register,
-            # or de-register an object we need to keep track of which
-            # of the rows and column indexes we have already examined
-            usedRows = set()
-            usedCols = set()
-            # loop over the combination of the (row, column) index
-            # tuples
-            for (row, col) in zip(rows, cols):
-                # if we have already examined either the row or
-                # column value before, ignore it
-                if row in usedRows or col in usedCols:
-                    continue
-                # otherwise, grab the object ID for the current row,
-                # set its new centroid, and reset the missed detection
-                # counter
-                objectID = objectIDs[row]
-                self.objectCentroids[objectID] = inputCentroid[col]
-                self.objectDets[objectID] = copy.copy(inputObjectDet[col])
-                self.objectTrackStatus[objectID] = "Updated"
-                self.objectMissCount[objectID] = 0
-
-                # indicate that we have examined each of the row and
-                # column indexes, respectively
-                usedRows.add(row)
-                usedCols.add(col)
-            # compute both the row and column index we have NOT yet
-            # examined
-            unusedRows = set(range(0, D.shape[0])).difference(usedRows)
-            unusedCols = set(range(0, D.shape[1])).difference(usedCols)
-            # in the event that the number of object centroids is
-            # equal or greater than the number of input centroids
-            # we need to check and see if some of these objects have
-            # potentially disappeared
-            if D.shape[0] >= D.shape[1]:
-                # loop over the unused row indexes
-                for row in unusedRows:
-                    # grab the object ID for the corresponding row
-                    # index and increment the missed detection counter
-                    objectID = objectIDs[row]
-                    self.objectMissCount[objectID] += 1
-                    self.objectTrackStatus[objectID] = "Trouble"
-                    # check to see if the number of consecutive
-                    # frames the object detection has been missed
-                    # requires de-registering the object
-                    if self.objectMissCount[objectID] > self.maxMissCount:
-                        self.deregisterDetection(objectID)
-            # otherwise, if the number of input centroids is greater
-            # than the number of existing object centroids we need to
-            # register each new input centroid as a trackable object
-            else:
-                for col in unusedCols:
-                    self.registerDetection(inputCentroid[col], inputObjectDet[col])
+            inputCentroid = np.array([(detection.xpos, detection.ypos) for detection in detections], np.float64)
+            inputObjectDet = np.empty(len(detections), object)
+            inputObjectDet[:] = detections
+
+            # Match input centroids with the predicted object centroids. The
+            # association engine returns the (row, column) indexes of every
+            # matched pair: rows are tracked objects, columns are detections
+            rows, cols = self.association.match(self.kalman.positions(tracks), inputCentroid)
+
+            # set the new centroid of every matched object, and reset its
+            # missed detection counter
+            tracks.x[rows] = inputCentroid[cols, 0]
+            tracks.y[rows] = inputCentroid[cols, 1]
+            tracks.dets[rows] = inputObjectDet[cols]
+            tracks.status[rows] = TrackStore.UPDATED
+            tracks.missCount[rows] = 0
+            self.updated.update(tracks.ids[rows].tolist())
+            self.kalman.correct(tracks, rows, inputCentroid[cols, 0], inputCentroid[cols, 1])
+
+        # objects not matched have potentially disappeared. Increment their
+        # missed detection counter
+        missed = np.ones(n, bool)
+        missed[rows] = False
+        missedRows = np.flatnonzero(missed)
+        if len(missedRows) > 0:
+            newTrouble = missedRows[tracks.status[missedRows] != TrackStore.TROUBLE]
+            self.troubled.update(tracks.ids[newTrouble].tolist())
+            tracks.status[missedRows] = TrackStore.TROUBLE
+            tracks.missCount[missedRows] += 1
+
+            # check to see if the number of consecutive frames the object
+            # detection has been missed requires de-registering the object.
+            # Rows are removed from the last one, so pending rows do not move
+            expired = missedRows[tracks.missCount[missedRows] > self.maxMissCount]
+            for row in expired[::-1]:
+                self.deregisterDetection(int(tracks.ids[row]))
+
+        # detections not matched are registered as new trackable objects
+        unusedCols = np.ones(len(detections), bool)
+        unusedCols[cols] = False
+        for col in np.flatnonzero(unusedCols):
+            detection = detections[col]
+            self.registerDetection((detection.xpos, detection.ypos), detection)
 
         # Update application with tracking information
         self.updateApplication()
@@ -188,49 +163,124 @@ class CentroidTracker:
         self.display()
 
         # Get end time and update performance monitor
-        if self.perfMon is not None:
-            end = time.time()
-            self.perfMon.collectOTTSample(end - start)
-
-        # "Late" return (see "early" return above)
-        return
+        if self.profiler is not None:
+            self.profiler.OTThistogram.record(time.perf_counter_ns() - start)
+        if self.tracer is not None:
+            self.tracer.span("CentroidTracker.update", start, frameSeq)
+
+    def predictPositions(self, timestamp):
+        """
+        Return (ids, positions) for all tracked objects, with positions (a
+        float array, one (x, y) row per object) extrapolated to timestamp
+        (time.perf_counter clock). Must be invoked from the detector thread;
+        other threads use Application.predictTrackedPositions.
+        """
+        return self.tracks.ids[:self.tracks.count].copy(), self.kalman.extrapolate(self.tracks, timestamp)
+
+    def predictRegions(self, padding, defaultRadius, shape, timestamp=None):
+        """
+        Return the list of regions (x1, y1, x2, y2) of a frame with the given
+        shape where tracked objects are expected (at timestamp, if given),
+        padded by padding pixels. Overlapping regions are merged. Returns
+        None when a full frame scan is required: no objects are being
+        tracked, or some object was missed in the last frame.
+        """
+        tracks = self.tracks
+        if tracks.count == 0:
+            return None
+        if np.any(tracks.status[:tracks.count] == TrackStore.TROUBLE):
+            return None
+
+        if timestamp is not None:
+            positions = self.kalman.extrapolate(tracks, timestamp)
+        else:
+            positions = self.kalman.positions(tracks)
+
+        h, w = shape[:2]
+        regions = []
+        for row in range(tracks.count):
+            cx = int(positions[row, 0])
+            cy = int(positions[row, 1])
+            r = int(tracks.dets[row].getRadius(defaultRadius) + padding)
+            regions.append([max(cx - r, 0), max(cy - r, 0), min(cx + r, w), min(cy + r, h)])
+
+        # Merge overlapping regions, so objects are not detected twice
+        merged = True
+        while merged is True:
+            merged = False
+            for i in range(len(regions)):
+                for j in range(i + 1, len(regions)):
+                    a = regions[i]
+                    b = regions[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        regions[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del regions[j]
+                        merged = True
+                        break
+                if merged is True:
+                    break
+
+        return [tuple(region) for region in regions if region[2] > region[0] and region[3] > region[1]]
 
     def updateApplication(self):
         ################
-        # Copy tracked objects to game application
-        self.app.trackerObjects = copy.deepcopy(self.objectDets)
-        self.app.trackerObjectStatus = copy.deepcopy(self.objectTrackStatus)
-        self.app.trackerUpdateFlag = True
+        # Hand a snapshot of the tracked objects, and the changes since the
+        # last update, to the game application. Snapshots are swapped (not
+        # copied) by the application, so this only copies the track arrays
+        self.snapshot.copyFrom(self.tracks, self.added, self.updated, self.troubled, self.removed)
+        self.snapshot = self.app.publishTrackerSnapshot(self.snapshot)
+        if self.profiler is not None:
+            self.profiler.collectTLTSample(time.perf_counter() - self.tracks.timestamp)
+
+        self.added.clear()
+        self.updated.clear()
+        self.troubled.clear()
+        self.removed.clear()
 
     def display(self):
         ################
         # Display tracked objects
         # This method displays tracked objects, for debugging purposes, over:
-        # - Camera    frames when self.displayOnCamera    == True
+        # - Camera    frames when self.displayOnCamera    == True (drawn over
+        #             the detector display frame, see Detector.readDisplay)
         # - Projector frames when self.displayOnProjector == True
         ########################################################################
+        if self.displayOnCamera is False and self.displayOnProjector is False:
+            return
 
-        for (objectID, centroid) in self.objectCentroids.items():
-            text = "ID:{}".format(objectID)
-
-            green = (0, 255, 0)
-            yellow = (0, 255, 255)
-            red = (0, 0, 255)
+        tracks = self.tracks
+        n = tracks.count
+        if n == 0:
+            return
 
-            colour = green
-            if self.objectMissCount[objectID] > 30:
-                colour = red
-            elif self.objectMissCount[objectID] > 10:
-                colour = yellow
+        centroids = tracks.centroids().astype(np.int32)
+        predicted = centroids
+        if self.displayPredicted is True:
+            predicted = self.kalman.extrapolate(tracks, tracks.timestamp + self.app.getLatency()).astype(np.int32)
+        texts = ["ID:{}".format(objectID) for objectID in tracks.ids[:n].tolist()]
+
+        # Colour by missed detections. Objects of every colour are drawn with
+        # one fillCircles call
+        green = (0, 255, 0)
+        yellow = (0, 255, 255)
+        red = (0, 0, 255)
+        missCount = tracks.missCount[:n]
+        groups = ((green, missCount <= 10),
+                  (yellow, (missCount > 10) & (missCount <= 30)),
+                  (red, missCount > 30))
+
+        for colour, selected in groups:
+            if not np.any(selected):
+                continue
+            groupTexts = [text for text, isSelected in zip(texts, selected) if isSelected]
 
             # Display over camera frames
-            if self.displayOnCamera is True:
-                cv2.circle(self.det.cam.frame, (centroid[0], centroid[1]), 5, colour, -1)
-                cv2.putText(self.det.cam.frame, text, (centroid[0] + 5, centroid[1] - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
-                            colour, 1)
+            if self.displayOnCamera is True and self.det.displayFrame is not None:
+                fillCircles(self.det.displayFrame, centroids[selected], 5, colour)
+                for text, (x, y) in zip(groupTexts, centroids[selected].tolist()):
+                    cv2.putText(self.det.displayFrame, text, (x + 5, y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, colour, 1)
 
             # Display over projector frames
             if self.displayOnProjector is True:
-                self.det.proj.drawCircle(centroid[0], centroid[1], colour)
-                self.det.proj.drawText(text, centroid[0] + 5, centroid[1] - 5, colour)
-
+                self.det.proj.drawCircles(predicted[selected], colour)
+                self.det.proj.drawTexts(groupTexts, predicted[selected] + (5, -5), colour)
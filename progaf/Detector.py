@@ -8,7 +8,11 @@
 # 2021/02/25 Initial Release (by Keko)
 #
 ############################################
-from threading import Thread
+from progaf.Drawing import fillCircles
+from threading import Thread, Event
+import numpy as np
+import numbers
+import math
 import time
 import cv2
 
@@ -19,6 +23,12 @@ class Detection:
         self.xpos = xpos
         self.ypos = ypos
 
+        # Provenance: sequence number (-1 if unknown) and capture time
+        # (time.perf_counter clock) of the camera frame the object was
+        # detected in. Set by the Detector
+        self.frameSeq = -1
+        self.frameTime = 0.0
+
         self.detection = obj
         # 'object' contains a tuple, with object attributes, depending on the
         # type of the detected object. Check different detectors for the actual
@@ -26,10 +36,52 @@ class Detection:
         # ("RotatedRect", width, height, angle)
         # ("Blob", size, class_id, response, angle)
 
+    def translate(self, dx, dy):
+        # Move the detection position (for instance, from ROI coordinates to
+        # frame coordinates)
+        self.xpos += dx
+        self.ypos += dy
+
+    def scale(self, fx, fy):
+        # Scale the detection position and size (for instance, from a
+        # downscaled frame to the full resolution frame). Positions (and
+        # blob sizes) stay integers
+        self.xpos = int(round(self.xpos * fx))
+        self.ypos = int(round(self.ypos * fy))
+        obj = self.detection
+        if isinstance(obj, tuple) and len(obj) >= 2:
+            if obj[0] == "Blob":
+                self.detection = (obj[0], int(round(obj[1] * (fx + fy) / 2))) + obj[2:]
+            elif len(obj) >= 3 and isinstance(obj[1], numbers.Number) and isinstance(obj[2], numbers.Number):
+                # (type, width, height, ...)
+                self.detection = (obj[0], obj[1] * fx, obj[2] * fy) + obj[3:]
+
+    def getRadius(self, default):
+        # Radius of a circle containing the detected object, for detections
+        # including size information. default is returned otherwise
+        obj = self.detection
+        if isinstance(obj, tuple) and len(obj) >= 2:
+            if obj[0] == "Blob":
+                return obj[1] / 2
+            if len(obj) >= 3 and isinstance(obj[1], numbers.Number) and isinstance(obj[2], numbers.Number):
+                # (type, width, height, ...)
+                return math.hypot(obj[1], obj[2]) / 2
+        return default
+
 
 class Detector:
     """ Base class for all Detectors."""
 
+    # Detectors reporting detections in frame pixel coordinates (as opposed
+    # to detectors scaling normalized coordinates to the camera frame size,
+    # like the MediaPipe based ones). Only these support ROI mode, and get
+    # their detections rescaled when detecting on downscaled frames
+    pixelCoordinates = True
+
+    # Detectors processing frames in another process (see ProcessDetector).
+    # roiMode does not reach the detector actually processing frames
+    isRemote = False
+
     def __init__(self, cam, proj):
         # Initialize the detector
         self.cam = cam
@@ -42,19 +94,75 @@ class Detector:
         self.frame = None
         self.frameIsValid = False
 
+        # Camera frame buffer reader. Sequence number and capture time of the
+        # last camera frame processed
+        self.reader = None
+        self.frameSeq = 0
+        self.frameTime = 0.0
+
         self.displayDetections = False
         self.displayOnCamera = True
         self.displayOnProjector = False
 
-        self.perfMon = None
+        # Debug overlays over camera frames (detections, and tracked objects,
+        # see CentroidTracker.display) are drawn over a private copy of the
+        # last camera frame processed, so frames published in the camera
+        # frame buffer (shared with other readers) are never modified. See
+        # readDisplay
+        self.displayFrame = None
+
+        self.profiler = None
+        self.tracer = None
+
+        # Maximum time (seconds) the update thread blocks waiting for a new
+        # camera frame before checking if it has been stopped
+        self.waitTimeout = 0.1
+        self.stopEvent = Event()
+
+        # Tracker-guided ROI detection. When enabled, objects are detected
+        # only inside the regions (padded by roiPadding pixels) where the
+        # tracker expects them. A full frame scan is performed every
+        # roiFullScanInterval frames, and whenever the tracker has no objects
+        # or loses one. Only detectors reporting pixel coordinates (like
+        # RectDetector, BlobDetector or ShapeDetector, see pixelCoordinates)
+        # support this mode; others always scan full frames.
+        self.roiMode = False
+        self.roiPadding = 40
+        self.roiDefaultRadius = 50
+        self.roiFullScanInterval = 30
+        self.framesSinceFullScan = 0
+
+        # Debug frame in ROI mode: the debug frame of every region processed
+        # is pasted into roiFrame, at the region position (see read)
+        self.roiFrame = None
+
+        # Downscaled detection. Full frame scans run processFrame over a copy
+        # of the camera frame downscaled by detectionScale (into a reused
+        # buffer, scaledFrame), and detections are scaled back to full
+        # resolution. When refineDetections is True, every detection is then
+        # refined over the full resolution frame (see refineDetection)
+        self.detectionScale = 1.0
+        self.refineDetections = False
+        self.scaledFrame = None
+
+        # Detect objects only on one of every detectionInterval camera frames
+        # read (frames in between are skipped, see skipFrame)
+        self.detectionInterval = 1
+        self.framesRead = 0
 
         # Initialize the Tracker
         self.tracker = None
 
     def start(self):
+        # Create a reader over the camera frame buffer. Every detector gets
+        # its own reader, so several detectors can share one camera
+        if self.reader is None:
+            self.reader = self.cam.frameBuffer.reader()
+
         # Start the thread to read frames
         self.isRunning = True
-        Thread(target=self.update, args=()).start()
+        self.stopEvent.clear()
+        Thread(target=self.update, args=(), name=type(self).__name__).start()
         return self
 
     def update(self):
@@ -62,36 +170,163 @@ class Detector:
         # Keep looping infinitely until the thread is stopped
         while True:
 
-            # If the thread stop indicator variable is set, stop the thread
+            # If the thread stop indicator variable is set, release the last
+            # camera frame and stop the thread
             if self.isRunning is False:
+                self.reader.release()
                 return
 
-            # Check if a new frame is available
-            if self.cam.frameIsNew is True:
+            # Wait for a new frame. Detectors always process the latest frame
+            # (frames skipped are counted by the reader). The thread sleeps
+            # until the camera publishes a frame, so no CPU is used while
+            # idle. The frame is pinned in the camera frame buffer until the
+            # next one is requested, so the camera cannot overwrite it while
+            # it is being processed
+            ok, seq, timestamp, local_frame = self.reader.readLatest(self.waitTimeout)
+            if ok is False and self.waitWhileClosed() is True:
+                continue
+            if ok is True and self.skipFrame() is False:
 
                 # Get starting time for performance monitoring
-                start = time.time()
+                start = time.perf_counter_ns()
 
                 # Grab Frame
-                local_frame = self.cam.frame
-                self.cam.frameIsNew = False
+                self.frameSeq = seq
+                self.frameTime = timestamp
 
                 # Process Frame and increase frame counter
-                self.processFrame(local_frame)
+                self.detectFrame(local_frame)
+                self.stampDetections()
+                if self.tracer is not None:
+                    self.tracer.span("Detector.processFrame", start, seq)
 
                 # Display Detected Contours when required
+                self.updateDisplayFrame(local_frame)
                 if self.displayDetections is True:
                     self.display()
 
                 # Track Detected contours when required
                 if self.tracker is not None:
-                    self.tracker.update(self.detections)
+                    self.tracker.update(self.detections, self.frameTime, self.frameSeq)
 
                 self.frameCounter += 1
                 # Get update loop end time and update performance monitor
-                if self.perfMon is not None:
-                    end = time.time()
-                    self.perfMon.collectCDTSample(end - start)
+                if self.profiler is not None:
+                    self.profiler.CDThistogram.record(time.perf_counter_ns() - start)
+                if self.tracer is not None:
+                    self.tracer.span("Detector.update", start, seq)
+
+    def waitWhileClosed(self):
+        # The camera closes its frame buffer when it is stopped (or a video
+        # file ends), and reads return immediately from then on. Sleep until
+        # the detector is stopped, instead of spinning over the reader (the
+        # buffer is checked again every waitTimeout seconds, as the camera
+        # can be restarted). Returns True if the buffer is closed
+        if self.reader.buffer.isClosed is False:
+            return False
+        self.stopEvent.wait(self.waitTimeout)
+        return True
+
+    def skipFrame(self):
+        # Invoked for every camera frame read. Returns True if the frame must
+        # be skipped (see self.detectionInterval)
+        self.framesRead += 1
+        return self.framesRead % self.detectionInterval != 0
+
+    def detectFrame(self, frame):
+        """
+        Detect objects in frame, storing them in self.detections. Runs
+        processFrame over the full frame or, in ROI mode, over the regions
+        predicted by the tracker.
+        """
+        regions = None
+        if self.roiMode is True and self.tracker is not None and self.pixelCoordinates is True and \
+                self.framesSinceFullScan < self.roiFullScanInterval:
+            regions = self.tracker.predictRegions(self.roiPadding, self.roiDefaultRadius, frame.shape,
+                                                  self.frameTime)
+
+        # Full frame scan
+        if regions is None:
+            self.processScaledFrame(frame)
+            self.framesSinceFullScan = 0
+            return
+
+        # Process every region and move detections to frame coordinates
+        detections = []
+        roiFrameIsCleared = False
+        for (x1, y1, x2, y2) in regions:
+            self.processFrame(frame[y1:y2, x1:x2])
+            if self.detections is not None:
+                for detection in self.detections:
+                    detection.translate(x1, y1)
+                    detections.append(detection)
+
+            # Paste the region debug frame into the ROI debug frame
+            debug = self.frame
+            if debug is None or debug.shape[:2] != (y2 - y1, x2 - x1):
+                continue
+            shape = frame.shape[:2] + debug.shape[2:]
+            if self.roiFrame is None or self.roiFrame.shape != shape or self.roiFrame.dtype != debug.dtype:
+                self.roiFrame = np.zeros(shape, debug.dtype)
+            elif roiFrameIsCleared is False:
+                self.roiFrame.fill(0)
+            roiFrameIsCleared = True
+            self.roiFrame[y1:y2, x1:x2] = debug
+        if roiFrameIsCleared is True:
+            self.frame = self.roiFrame
+        self.detections = detections
+        self.framesSinceFullScan += 1
+
+    def stampDetections(self):
+        # Record the frame every detection comes from (see Detection), and
+        # the time from frame capture to detection
+        if self.detections is not None:
+            for detection in self.detections:
+                detection.frameSeq = self.frameSeq
+                detection.frameTime = self.frameTime
+        if self.profiler is not None:
+            self.profiler.collectDLTSample(time.perf_counter() - self.frameTime)
+
+    def processScaledFrame(self, frame):
+        """
+        Run processFrame over frame downscaled by self.detectionScale, and
+        scale detections back to frame coordinates (refining them when
+        required). Frames are never upscaled.
+        """
+        if self.detectionScale >= 1:
+            self.processFrame(frame)
+            return
+
+        height, width = frame.shape[:2]
+        size = (max(int(width * self.detectionScale), 1), max(int(height * self.detectionScale), 1))
+        shape = (size[1], size[0]) + frame.shape[2:]
+        if self.scaledFrame is None or self.scaledFrame.shape != shape or self.scaledFrame.dtype != frame.dtype:
+            self.scaledFrame = np.empty(shape, frame.dtype)
+        cv2.resize(frame, size, dst=self.scaledFrame, interpolation=cv2.INTER_AREA)
+        self.processFrame(self.scaledFrame)
+
+        if self.detections is None or self.pixelCoordinates is False:
+            return
+        fx = width / size[0]
+        fy = height / size[1]
+        for detection in self.detections:
+            detection.scale(fx, fy)
+            if self.refineDetections is True:
+                try:
+                    self.refineDetection(frame, detection)
+                except cv2.error as error:
+                    # Keep the unrefined detection
+                    print("Warning: Detector.refineDetection failed ({})".format(error.msg))
+
+    def refineDetection(self, frame, detection):
+        # This is an abstract method to be implemented in sub-classes when
+        # required. The method will be invoked by Detector for every
+        # detection found over a downscaled frame (see self.detectionScale)
+        # when self.refineDetections is True, passing the full resolution
+        # camera frame, to refine the detection position and size. The
+        # detection must only be modified once refinement succeeds, and
+        # positions must stay integer pixel coordinates
+        return None
 
     def processFrame(self, frame):
         # This is an abstract method to be implemented in sub-classes when
@@ -99,38 +334,64 @@ class Detector:
         # the actual camera frames as a parameter.
         return None
 
+    def updateDisplayFrame(self, frame):
+        # Copy the camera frame processed into self.displayFrame (a reused
+        # buffer), only when some debug overlay is drawn over camera frames
+        tracker = self.tracker
+        if (self.displayDetections is False or self.displayOnCamera is False) and \
+                (tracker is None or tracker.displayOnCamera is False):
+            return
+        if self.displayFrame is None or self.displayFrame.shape != frame.shape or \
+                self.displayFrame.dtype != frame.dtype:
+            self.displayFrame = np.empty_like(frame)
+        np.copyto(self.displayFrame, frame)
+
     def display(self):
         ################################
         # Display detections
         # This method displays detections, for debugging purposes, over:
-        # - Camera    frames when self.displayOnCamera    == True
+        # - Camera    frames when self.displayOnCamera    == True (drawn over
+        #             self.displayFrame, see readDisplay)
         # - Projector frames when self.displayOnProjector == True
         ########################################################################
 
-        # Display detected contours
-        for detection in self.detections:
-            # in this loop:
-            # box  is a rotatedBox for the detected contour (type is float numpy array of four points)
-            # rect ia a rotatedRect for the detected contour (type is tuple, see above)
+        # Display detected contours. All detections are drawn with one
+        # fillCircles call (see Projector.drawCircles)
+        if len(self.detections) == 0:
+            return
+        centers = np.array([(detection.xpos, detection.ypos) for detection in self.detections])
 
-            # Display over camera frames
-            blue = (255, 0, 0)
-            if self.displayOnCamera is True:
-                cv2.circle(self.cam.frame, (detection.xpos, detection.ypos), 5, blue, -1)
+        # Display over camera frames
+        blue = (255, 0, 0)
+        if self.displayOnCamera is True:
+            fillCircles(self.displayFrame, centers, 5, blue)
 
-            # Display over projector frames
-            white = (255, 255, 255)
-            if self.displayOnProjector is True:
-                # self.proj.drawContours(np.int0(box), white)
-                self.proj.drawCircle(detection.xpos, detection.ypos, white)
+        # Display over projector frames
+        white = (255, 255, 255)
+        if self.displayOnProjector is True:
+            self.proj.drawCircles(centers, white)
 
     def read(self):
         ################################
         # This method returns the last processed frame. The frame is actually
-        # stored inside processFrame method.
+        # stored inside processFrame method. It is owned by the detector:
+        # processFrame never stores camera frames (frame buffer slots, which
+        # the camera overwrites), but a copy or a frame of its own.
         ########################################################################
         return self.frameIsValid, self.frame
 
+    def readDisplay(self):
+        ################################
+        # This method returns the last camera frame processed, with debug
+        # overlays (detections and tracked objects) drawn over it, when
+        # debug overlays over camera frames are enabled.
+        ########################################################################
+        return self.displayFrame is not None, self.displayFrame
+
     def stop(self):
         # indicate that the thread should be stopped
         self.isRunning = False
+        self.stopEvent.set()
+
+        # Wake up the update thread if it is waiting for a frame
+        self.cam.frameBuffer.notify()
@@ -0,0 +1,24 @@
+############################################
+# PROGAF                                   #
+# Projection Games Framework               #
+############################################
+# Drawing.py                               #
+############################################
+#
+# 2026/10/18 Initial Release
+#
+############################################
+import numpy as np
+import cv2
+
+
+def fillCircles(frame, centers, radius, colour):
+    """
+    Draw filled circles at centers ((N, 2) array) over frame. Used by
+    Detector, CentroidTracker and Projector to draw debug overlays. Every
+    circle is drawn in its own cv2.circle call: one cv2.fillPoly call over
+    several polygons would fill them with the even-odd rule, leaving holes
+    where circles overlap.
+    """
+    for center in np.asarray(centers, np.int32).tolist():
+        cv2.circle(frame, tuple(center), radius, colour, -1)
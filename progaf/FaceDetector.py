@@ -15,6 +15,9 @@ import cv2
 
 class FaceDetector(Detector):
 
+    # Detections are normalized coordinates scaled to the camera frame size
+    pixelCoordinates = False
+
     def __init__(self, cam, proj):
         # Call the parent class (Detector) constructor
         super().__init__(cam, proj)
@@ -42,8 +45,10 @@ class FaceDetector(Detector):
         # Each key point is composed of x and y, which are normalized to [0.0, 1.0] by the image width and height
 
         # Extract Face Mesh. Store on detector frame for debugging
+        # (a copy, as frame may be a camera frame buffer slot shared with
+        # other readers, and overwritten by the camera, see Detector.read)
         self.detections = []  # empty list
-        self.frame = frame
+        self.frame = frame.copy()
         drawing_spec = self.mpDraw.DrawingSpec(thickness=1, circle_radius=1)
         if result.detections is not None:
             for face in result.detections:
@@ -15,6 +15,9 @@ import cv2
 
 class FaceMeshDetector(Detector):
 
+    # Detections are normalized coordinates scaled to the camera frame size
+    pixelCoordinates = False
+
     def __init__(self, cam, proj):
         # Call the parent class (Detector) constructor
         super().__init__(cam, proj)
@@ -36,7 +39,9 @@ class FaceMeshDetector(Detector):
 
         # Extract Face Mesh. Store on detector frame for debugging
         self.detections = []  # empty list
-        self.frame = frame
+        # (a copy, as frame may be a camera frame buffer slot shared with
+        # other readers, and overwritten by the camera, see Detector.read)
+        self.frame = frame.copy()
         drawing_spec = self.mpDraw.DrawingSpec(thickness=1, circle_radius=1)
         if result.multi_face_landmarks is not None:
             for landmark in result.multi_face_landmarks:
@@ -0,0 +1,417 @@
+############################################
+# PROGAF                                   #
+# Projection Games Framework               #
+############################################
+# FrameBuffer.py                           #
+############################################
+#
+# 2026/10/18 Initial Release
+#
+############################################
+from threading import Condition
+import numpy as np
+import time
+
+
+class FrameBuffer:
+    """
+    FrameBuffer is a fixed capacity ring of preallocated frame slots shared
+    between one writer (usually a Camera) and any number of readers
+    (Detectors, recorders, game backgrounds, ...). Every published frame gets
+    a monotonically increasing sequence number (starting at 1) and a capture
+    timestamp (time.perf_counter() seconds).
+
+    Readers never receive copies: they get a view over the slot memory
+    (copySeq and copyLatest return copies instead). To avoid torn frames, a
+    reader can pin a slot (see FrameReader). The writer
+    never writes into a pinned slot; it skips to the next free one instead.
+    If every slot is pinned, the incoming frame is dropped.
+
+    The buffer is lock free. Sequence numbers are published only after the
+    slot content is complete, and pins are kept in python sets (atomic
+    add/discard under the GIL), so no reader can ever observe a slot that is
+    being written.
+
+    Readers that have nothing to do can block until a new frame is published
+    (timeout parameter in the FrameReader read methods), instead of polling.
+    close() wakes up every blocked reader, for instance when the camera is
+    stopped. Reads do not block on a closed buffer (check isClosed to tell
+    a closed buffer from a timeout).
+
+    Slots can be allocated in shared memory (see share), so processes other
+    than the writer can read published frames without copies (see
+    ProcessDetector).
+    """
+
+    def __init__(self, capacity=4):
+        # Class attributes
+        self.capacity = capacity
+        self.shape = None
+        self.dtype = None
+        self.frames = None
+
+        # Slot bookkeeping. slotSeq[i] is the sequence number stored in slot
+        # i (0 when empty, -1 while being written)
+        self.slotSeq = [0] * capacity
+        self.slotTime = [0.0] * capacity
+        self.slotPins = [set() for _ in range(capacity)]
+
+        # Writer state
+        self.writeIndex = 0
+        self.latestSeq = 0
+        self.latestIndex = -1
+        self.nextSeq = 1
+
+        # Frames that could not be written because all slots were pinned
+        self.droppedFrames = 0
+
+        # Frames missed by readers (sum over all readers)
+        self.readerDroppedFrames = 0
+
+        # Notification of new frames to blocked readers
+        self.condition = Condition()
+        self.isClosed = False
+
+        # Shared memory slots (see share): bus holding the slots, lock
+        # shared with reader processes, bus reader indexes in use, and buses
+        # replaced while views over their frames were still in use
+        self.bus = None
+        self.busLock = None
+        self.busMaxReaders = 4
+        self.busReaders = set()
+        self.retiredBuses = []
+
+    ##############################
+    # Writer side
+    ############################################################################
+    def allocate(self, shape, dtype=np.uint8):
+        """
+        Preallocate slot memory for frames with the given shape. Called
+        automatically by acquire() whenever the frame shape changes (for
+        instance, when cropping is enabled in Camera).
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.frames = None
+        self.retireBus()
+        if len(self.busReaders) > 0:
+            from progaf.SharedFrameBus import SharedFrameBus
+            self.bus = SharedFrameBus(self.shape, self.dtype, self.capacity, self.busMaxReaders, lock=self.busLock)
+            self.frames = self.bus.frames
+        else:
+            self.frames = np.zeros((self.capacity,) + self.shape, self.dtype)
+
+        # Previous content is not valid anymore
+        self.slotSeq = [0] * self.capacity
+        self.slotTime = [0.0] * self.capacity
+        self.latestIndex = -1
+
+    def acquire(self, shape, dtype=np.uint8):
+        """
+        Return (index, frame) for the next writable slot, so the writer can
+        render directly into it (using dst= parameters in OpenCV calls). The
+        frame is published calling publish(index). Returns (-1, None) if all
+        slots are pinned by readers.
+        """
+        if self.frames is None or self.shape != tuple(shape) or self.dtype != np.dtype(dtype) or \
+                (len(self.busReaders) > 0) != (self.bus is not None) or \
+                (self.bus is not None and self.bus.isUnlinked is True):
+            self.allocate(shape, dtype)
+
+        for n in range(self.capacity):
+            index = (self.writeIndex + n) % self.capacity
+
+            # Never write over the latest published frame
+            if index == self.latestIndex:
+                continue
+
+            # Invalidate the slot first, then check pins (see FrameReader.pin)
+            # and, for shared slots, pins of reader processes
+            previousSeq = self.slotSeq[index]
+            self.slotSeq[index] = -1
+            if len(self.slotPins[index]) == 0 and (self.bus is None or self.bus.claim(index) is True):
+                self.writeIndex = (index + 1) % self.capacity
+                return index, self.frames[index]
+
+            # Slot pinned by a reader. Restore it and try the next one
+            self.slotSeq[index] = previousSeq
+
+        # Every slot is in use
+        self.droppedFrames += 1
+        return -1, None
+
+    def publish(self, index, timestamp=None):
+        """
+        Publish the frame previously written into slot index. Returns the
+        sequence number assigned to the frame.
+        """
+        if timestamp is None:
+            timestamp = time.perf_counter()
+
+        seq = self.nextSeq
+        self.nextSeq += 1
+
+        self.slotTime[index] = timestamp
+        self.slotSeq[index] = seq
+        self.latestIndex = index
+        self.latestSeq = seq
+        if self.bus is not None:
+            self.bus.publishSlot(index, seq, timestamp)
+
+        # Wake up blocked readers
+        with self.condition:
+            self.condition.notify_all()
+        return seq
+
+    def write(self, frame, timestamp=None):
+        """
+        Copy frame into the next free slot and publish it. Returns the
+        sequence number of the frame (0 if the frame was dropped).
+        """
+        index, slot = self.acquire(frame.shape, frame.dtype)
+        if index < 0:
+            return 0
+        np.copyto(slot, frame)
+        return self.publish(index, timestamp)
+
+    def share(self, context):
+        """
+        Allocate slots in shared memory (a SharedFrameBus), so reader
+        processes can read published frames without copies. context is the
+        multiprocessing context reader processes are started with (used to
+        create the lock shared with them, busLock). Returns the bus reader
+        index assigned to the caller (-1 if all busMaxReaders are in use).
+        Slots are moved to shared memory when the next frame is acquired
+        (bus is None until then).
+        """
+        if self.busLock is None:
+            self.busLock = context.Lock()
+        for reader in range(self.busMaxReaders):
+            if reader not in self.busReaders:
+                self.busReaders.add(reader)
+                return reader
+        return -1
+
+    def unshare(self, reader):
+        # Release a bus reader index (see share). When the last reader is
+        # released the bus is unlinked (the writer may be stopped already),
+        # and slots are moved back to private memory when the next frame is
+        # acquired. A frame still pinned by the reader (a reader process
+        # that exited unexpectedly) is released
+        self.busReaders.discard(reader)
+        bus = self.bus
+        if bus is not None and bus.header is not None:
+            bus.release(reader)
+        if len(self.busReaders) == 0 and bus is not None:
+            bus.unlink()
+
+    def retireBus(self):
+        # Destroy the bus holding the slots (if any). Buses with views over
+        # their frames still in use are kept, and closed later
+        if self.bus is not None:
+            self.retiredBuses.append(self.bus)
+            self.bus = None
+        self.retiredBuses = [bus for bus in self.retiredBuses if bus.close() is False]
+
+    def open(self):
+        # (Re)open the buffer, so readers can block waiting for frames
+        self.isClosed = False
+
+    def close(self):
+        # Close the buffer and wake up every blocked reader
+        with self.condition:
+            self.isClosed = True
+            self.condition.notify_all()
+
+    def notify(self):
+        # Wake up every blocked reader (to check their own stop conditions)
+        with self.condition:
+            self.condition.notify_all()
+
+    ##############################
+    # Reader side
+    ############################################################################
+    def waitForFrame(self, seq, timeout=None):
+        """
+        Block until a frame newer than seq is published, the buffer is
+        closed, notify() is called or timeout seconds elapse. Returns True if
+        a newer frame is available.
+        """
+        with self.condition:
+            if self.latestSeq <= seq and self.isClosed is False:
+                self.condition.wait(timeout)
+        return self.latestSeq > seq
+
+    def findSlot(self, seq):
+        # Return the slot index holding frame seq, or -1 if not available
+        if seq <= 0:
+            return -1
+        try:
+            return self.slotSeq.index(seq)
+        except ValueError:
+            return -1
+
+    def readLatest(self):
+        """
+        Return (ok, seq, timestamp, frame) for the latest published frame.
+        The returned frame is a view over the slot memory.
+        """
+        return self.readSeq(self.latestSeq)
+
+    def readSeq(self, seq):
+        """
+        Return (ok, seq, timestamp, frame) for exactly the frame seq. ok is
+        False if that frame was never published or has been overwritten.
+        """
+        index = self.findSlot(seq)
+        if index < 0:
+            return False, seq, 0.0, None
+
+        timestamp = self.slotTime[index]
+        frame = self.frames[index]
+
+        # Check the slot was not reused while we were reading it
+        if self.slotSeq[index] != seq:
+            return False, seq, 0.0, None
+        return True, seq, timestamp, frame
+
+    def copySeq(self, seq):
+        """
+        Return (ok, seq, timestamp, frame) for a copy of exactly the frame
+        seq, owned by the caller (it is never overwritten). ok is False if
+        that frame was never published or has been overwritten (even while
+        being copied).
+        """
+        index = self.findSlot(seq)
+        if index < 0:
+            return False, seq, 0.0, None
+
+        timestamp = self.slotTime[index]
+        frame = self.frames[index].copy()
+
+        # Check the slot was not reused while we were copying it
+        if self.slotSeq[index] != seq:
+            return False, seq, 0.0, None
+        return True, seq, timestamp, frame
+
+    def copyLatest(self):
+        """
+        Return (ok, seq, timestamp, frame) for a copy of the latest published
+        frame, owned by the caller (see copySeq).
+        """
+        for n in range(self.capacity):
+            ok, seq, timestamp, frame = self.copySeq(self.latestSeq)
+            if ok is True:
+                return ok, seq, timestamp, frame
+        return False, self.latestSeq, 0.0, None
+
+    def readNext(self, seq):
+        """
+        Return (ok, seq, timestamp, frame) for the oldest available frame
+        published after seq. Frames after seq that were already overwritten
+        are skipped (see FrameReader for dropped frames accounting).
+        """
+        latestSeq = self.latestSeq
+        if latestSeq <= seq:
+            return False, seq, 0.0, None
+
+        # Oldest sequence still stored in the ring and newer than seq
+        candidates = [s for s in self.slotSeq if s > seq]
+        if len(candidates) == 0:
+            return self.readLatest()
+        return self.readSeq(min(candidates))
+
+    def isValid(self, seq):
+        # Check if frame seq is still stored in the ring
+        return self.findSlot(seq) >= 0
+
+    def reader(self):
+        # Create a new reader cursor over this buffer
+        return FrameReader(self)
+
+
+class FrameReader:
+    """
+    FrameReader is a cursor over a FrameBuffer. It remembers the last frame
+    returned, pins it so the writer cannot overwrite it until the next
+    frame is requested (or release() is called), and counts frames that were
+    published but never seen by this reader.
+    """
+
+    def __init__(self, frameBuffer):
+        self.buffer = frameBuffer
+        self.lastSeq = 0
+        self.timestamp = 0.0
+        self.droppedFrames = 0
+        self.pinnedIndex = -1
+
+    def pin(self, seq):
+        # Pin the slot holding seq. Returns the slot index or -1.
+        index = self.buffer.findSlot(seq)
+        if index < 0:
+            return -1
+        self.buffer.slotPins[index].add(id(self))
+
+        # The writer invalidates a slot before checking its pins, so if the
+        # slot still holds seq after pinning it, it is safe to use it.
+        if self.buffer.slotSeq[index] != seq:
+            self.buffer.slotPins[index].discard(id(self))
+            return -1
+        return index
+
+    def release(self):
+        # Release the slot pinned by the last read
+        if self.pinnedIndex >= 0:
+            self.buffer.slotPins[self.pinnedIndex].discard(id(self))
+            self.pinnedIndex = -1
+
+    def read(self, seq):
+        # Read and pin exactly frame seq
+        self.release()
+        index = self.pin(seq)
+        if index < 0:
+            return False, seq, 0.0, None
+
+        self.pinnedIndex = index
+        if seq > self.lastSeq:
+            if self.lastSeq > 0:
+                missed = seq - self.lastSeq - 1
+                self.droppedFrames += missed
+                self.buffer.readerDroppedFrames += missed
+            self.lastSeq = seq
+        self.timestamp = self.buffer.slotTime[index]
+        return True, seq, self.timestamp, self.buffer.frames[index]
+
+    def readLatest(self, timeout=0):
+        """
+        Return (ok, seq, timestamp, frame) for the latest frame, if it is
+        newer than the last one returned by this reader. When timeout is not
+        zero, block up to timeout seconds (forever if None) waiting for it.
+        """
+        if timeout != 0 and self.buffer.latestSeq <= self.lastSeq:
+            self.buffer.waitForFrame(self.lastSeq, timeout)
+
+        seq = self.buffer.latestSeq
+        if seq <= self.lastSeq:
+            return False, self.lastSeq, self.timestamp, None
+        return self.read(seq)
+
+    def readNext(self, timeout=0):
+        """
+        Return (ok, seq, timestamp, frame) for the oldest available frame
+        published after the last one returned by this reader. When timeout
+        is not zero, block up to timeout seconds (forever if None) waiting
+        for it.
+        """
+        if timeout != 0 and self.buffer.latestSeq <= self.lastSeq:
+            self.buffer.waitForFrame(self.lastSeq, timeout)
+
+        # Retry if the candidate frame gets overwritten before being pinned
+        while self.buffer.latestSeq > self.lastSeq:
+            ok, seq, timestamp, frame = self.buffer.readNext(self.lastSeq)
+            if ok is False:
+                return False, self.lastSeq, self.timestamp, None
+            ok, seq, timestamp, frame = self.read(seq)
+            if ok is True:
+                return ok, seq, timestamp, frame
+        return False, self.lastSeq, self.timestamp, None
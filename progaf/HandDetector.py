@@ -15,6 +15,9 @@ import cv2
 
 class HandDetector(Detector):
 
+    # Detections are normalized coordinates scaled to the camera frame size
+    pixelCoordinates = False
+
     def __init__(self, cam, proj):
         # Call the parent class (Detector) constructor
         super().__init__(cam, proj)
@@ -34,7 +37,9 @@ class HandDetector(Detector):
 
         # Extract hands. Store on detector frame for debugging
         self.detections = []  # empty list
-        self.frame = frame
+        # (a copy, as frame may be a camera frame buffer slot shared with
+        # other readers, and overwritten by the camera, see Detector.read)
+        self.frame = frame = frame.copy()
         if result.multi_hand_landmarks is not None:
             for hand in result.multi_hand_landmarks:
                 self.mpDraw.draw_landmarks(frame, hand, self.mpHands.HAND_CONNECTIONS)
@@ -0,0 +1,127 @@
+############################################
+# PROGAF                                   #
+# Projection Games Framework               #
+############################################
+# KalmanFilter.py                          #
+############################################
+#
+# 2026/10/18 Initial Release
+#
+############################################
+from math import factorial
+import numpy as np
+
+
+class KalmanFilter:
+    """
+    KalmanFilter estimates the motion of all tracked objects of a TrackStore
+    (see CentroidTracker), vectorized across tracks. Available motion models
+    are:
+        - "velocity": constant velocity (state x, vx per axis)
+        - "acceleration": constant acceleration (state x, vx, ax per axis)
+
+    Both axes are estimated independently, so every track holds a state of
+    shape (2, order) and a covariance of shape (2, order, order), stored in
+    the TrackStore arrays state, covariance and stateTime (timestamp of the
+    estimate, seconds, time.perf_counter clock).
+
+    Units are pixels and seconds. processNoise is the spectral density of the
+    white noise driving the highest derivative (acceleration for "velocity",
+    jerk for "acceleration"), and measurementNoise the standard deviation of
+    detected centroids (pixels).
+    """
+
+    models = {"velocity": 2, "acceleration": 3}
+
+    def __init__(self, model="velocity", processNoise=None, measurementNoise=2.0):
+        if model not in self.models:
+            print("KalmanFilter: Unknown motion model '{}'. Using 'velocity'".format(model))
+            model = "velocity"
+
+        self.model = model
+        self.order = self.models[model]
+        if processNoise is None:
+            processNoise = 1e5 if self.order == 2 else 1e7
+        self.processNoise = processNoise
+        self.measurementNoise = measurementNoise
+
+        # Initial uncertainty of the derivatives of new tracks (standard
+        # deviation of velocity, pixels/s, and acceleration, pixels/s^2)
+        self.initialStd = (measurementNoise, 500.0, 2000.0)
+
+        # Extrapolation never goes further than maxPredictionTime seconds
+        # after the last estimate (objects lost for long do not fly away)
+        self.maxPredictionTime = 0.25
+
+        # Exponents and factorials used to build transition matrices
+        i = np.arange(self.order)
+        self.power = np.maximum(i[None, :] - i[:, None], 0)
+        self.scale = np.array([[1 / factorial(p) if j >= k else 0 for j, p in enumerate(row)]
+                               for k, row in enumerate(self.power)])
+        qPower = 2 * self.order - 1 - i[:, None] - i[None, :]
+        self.qPower = qPower
+        self.qScale = np.array([[1 / (factorial(self.order - 1 - j) * factorial(self.order - 1 - k) * qPower[j, k])
+                                 for k in range(self.order)] for j in range(self.order)])
+
+    def transition(self, dt):
+        # State transition matrices (n, order, order) for time steps dt (n)
+        return dt[:, None, None] ** self.power * self.scale
+
+    def noise(self, dt):
+        # Process noise matrices (n, order, order) for time steps dt (n)
+        return self.processNoise * dt[:, None, None] ** self.qPower * self.qScale
+
+    def initialize(self, store, rows, x, y, timestamp):
+        # Initialize the state of new tracks (rows) at the measured position
+        store.state[rows] = 0
+        store.state[rows, 0, 0] = x
+        store.state[rows, 1, 0] = y
+        store.covariance[rows] = np.diag(np.square(self.initialStd[:self.order]))
+        store.stateTime[rows] = timestamp
+
+    def predict(self, store, timestamp):
+        # Move the estimate of all tracks forward to timestamp
+        n = store.count
+        if n == 0:
+            return
+        dt = np.maximum(timestamp - store.stateTime[:n], 0)
+        F = self.transition(dt)
+        Q = self.noise(dt)
+
+        state = store.state[:n]
+        covariance = store.covariance[:n]
+        state[:] = np.einsum("nij,naj->nai", F, state)
+        covariance[:] = np.einsum("nij,najk,nlk->nail", F, covariance, F) + Q[:, None]
+        store.stateTime[:n] = timestamp
+
+    def correct(self, store, rows, x, y):
+        # Update the estimate of tracks (rows) with measured positions (x, y)
+        if len(rows) == 0:
+            return
+        state = store.state[rows]
+        covariance = store.covariance[rows]
+
+        # The measurement is the position (first state component)
+        innovation = np.stack((x, y), axis=1) - state[:, :, 0]
+        S = covariance[:, :, 0, 0] + self.measurementNoise ** 2
+        K = covariance[:, :, :, 0] / S[:, :, None]
+
+        state += K * innovation[:, :, None]
+        covariance -= K[:, :, :, None] * covariance[:, :, None, 0, :]
+        store.state[rows] = state
+        store.covariance[rows] = covariance
+
+    def positions(self, store):
+        # Current estimate of the position of all tracks (n, 2)
+        return store.state[:store.count, :, 0]
+
+    def extrapolate(self, store, timestamp):
+        """
+        Positions (n, 2) of all tracks of store (a TrackStore or a
+        TrackSnapshot) extrapolated to timestamp, without changing the
+        estimate.
+        """
+        n = store.count
+        dt = np.clip(timestamp - store.stateTime[:n], 0, self.maxPredictionTime)
+        coefficients = dt[:, None] ** self.power[0] * self.scale[0]
+        return np.einsum("nk,nak->na", coefficients, store.state[:n])
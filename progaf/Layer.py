@@ -0,0 +1,164 @@
+############################################
+# PROGAF                                   #
+# Projection Games Framework               #
+############################################
+# Layer.py                                 #
+############################################
+#
+# 2026/10/18 Initial Release
+#
+############################################
+from threading import Lock
+import numpy as np
+
+
+class Layer:
+    """
+    Layer is a preallocated frame composited by the Projector. Layers are
+    combined in z order (lowest first), with an opacity (0 to 1) and a blend
+    mode:
+        - "add": saturated addition (the original Projector behaviour)
+        - "alpha": non-black pixels of the layer are blended over lower
+          layers with the layer opacity (black pixels are transparent)
+        - "max": per channel maximum
+
+    Every change must be reported with invalidate(rect), so the Projector
+    only composites the areas (dirty rectangles) that changed. Unchanged
+    layers cost nothing. Static layers (like the calibration grid) are
+    rendered once and never invalidated.
+
+    When warpTransform is set (see Transform.warp), the layer frame is in
+    source (camera) coordinates, of sourceSize pixels, and is warped into
+    projector space (warpedFrame) by the Projector, dirty areas only.
+    """
+
+    blendModes = ("add", "alpha", "max")
+
+    def __init__(self, name, width, height, z=0, opacity=1.0, blendMode="add"):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.z = z
+        self.frame = np.zeros((height, width, 3), np.uint8)
+
+        # Warping (see class description)
+        self.warpTransform = None
+        self.sourceSize = (width, height)
+        self.warpedFrame = None
+
+        # Changes since the last composition: dirty area (x1, y1, x2, y2) in
+        # layer frame coordinates, or None
+        self.dirtyLock = Lock()
+        self.dirtyRect = None
+
+        self._isActive = True
+        self._opacity = opacity
+        self._blendMode = "add"
+        self.blendMode = blendMode
+
+    #
+    # Layer properties. Changing them invalidates the whole layer
+    #
+    @property
+    def isActive(self):
+        return self._isActive
+
+    @isActive.setter
+    def isActive(self, value):
+        if value != self._isActive:
+            self._isActive = value
+            self.invalidate()
+
+    @property
+    def opacity(self):
+        return self._opacity
+
+    @opacity.setter
+    def opacity(self, value):
+        if value != self._opacity:
+            self._opacity = value
+            self.invalidate()
+
+    @property
+    def blendMode(self):
+        return self._blendMode
+
+    @blendMode.setter
+    def blendMode(self, value):
+        if value not in self.blendModes:
+            print("Layer: Unknown blend mode '{}'. Using 'add'".format(value))
+            value = "add"
+        if value != self._blendMode:
+            self._blendMode = value
+            self.invalidate()
+
+    def getFrame(self):
+        # Frame to be composited (projector coordinates)
+        if self.warpTransform is not None:
+            return self.warpedFrame
+        return self.frame
+
+    def setFrame(self, frame):
+        # Replace the layer frame (no copy) and invalidate the whole layer
+        self.frame = frame
+        self.invalidate()
+
+    def setWarp(self, transform, sourceSize=None):
+        """
+        Warp the layer with transform (None to disable warping). sourceSize
+        (width, height) is the size of the layer frame in source coordinates
+        (the layer size if None). The layer is cleared.
+        """
+        if sourceSize is None:
+            sourceSize = (self.width, self.height)
+        self.warpTransform = transform
+        if transform is not None:
+            self.sourceSize = sourceSize
+            self.warpedFrame = np.zeros((self.height, self.width, 3), np.uint8)
+        else:
+            self.sourceSize = (self.width, self.height)
+            self.warpedFrame = None
+        self.frame = np.zeros((self.sourceSize[1], self.sourceSize[0], 3), np.uint8)
+        self.invalidate()
+
+    def clear(self):
+        # Clear the layer, in place
+        self.frame.fill(0)
+        self.invalidate()
+
+    def invalidate(self, rect=None):
+        # Add rect (x1, y1, x2, y2, in layer frame coordinates) to the dirty
+        # area of the layer. The whole layer if rect is None
+        if rect is None:
+            rect = (0, 0, self.frame.shape[1], self.frame.shape[0])
+        with self.dirtyLock:
+            if self.dirtyRect is not None:
+                dirty = self.dirtyRect
+                rect = (min(dirty[0], rect[0]), min(dirty[1], rect[1]),
+                        max(dirty[2], rect[2]), max(dirty[3], rect[3]))
+            self.dirtyRect = rect
+
+    def takeDirtyRect(self):
+        """
+        Return the dirty area of the layer in projector coordinates (warping
+        it first, when required), or None if the layer did not change, and
+        reset it.
+        """
+        with self.dirtyLock:
+            rect = self.dirtyRect
+            self.dirtyRect = None
+        if rect is None:
+            return None
+
+        if self.warpTransform is not None:
+            size = (self.width, self.height)
+            rect = self.warpTransform.warpRect(rect, self.frame.shape, size)
+            if rect is not None:
+                self.warpTransform.warp(self.frame, self.warpedFrame, rect, size, True)
+            return rect
+
+        x1, y1 = max(int(rect[0]), 0), max(int(rect[1]), 0)
+        x2, y2 = min(int(rect[2]), self.width), min(int(rect[3]), self.height)
+        if x2 <= x1 or y2 <= y1:
+            return None
+        return x1, y1, x2, y2
@@ -11,35 +11,89 @@
 from direct.showbase.ShowBase import ShowBase
 from direct.showbase import DirectObject
 from progaf.Application import Application
-from panda3d.core import LVecBase4f
-from collections import OrderedDict
+from progaf.VideoSource import VideoSource
+from panda3d.core import LVecBase4f, Texture, CardMaker, Filename
 import time
 
 
 class panda3DApp(Application, DirectObject.DirectObject):
     """Application encapsulates the Application logic"""
 
-    def __init__(self):
-        Application.__init__(self)
+    def __init__(self, headless=False, headlessRendering=True):
+        Application.__init__(self, headless, headlessRendering)
 
-        # Create ShowBase Object for Panda3D Rendering and event handling
-        self.base = ShowBase()
+        # Create ShowBase Object for Panda3D Rendering and event handling.
+        # Headless applications render into an offscreen buffer, or do not
+        # render at all (no graphics window)
+        if headless is False:
+            self.base = ShowBase()
+        elif headlessRendering is True:
+            self.base = ShowBase(windowType="offscreen")
+        else:
+            self.base = ShowBase(windowType="none")
 
         # Set Some defaults
         white = LVecBase4f(1, 1, 1, 1)
         self.base.setBackgroundColor(white)
-        self.base.setFrameRateMeter(True)
+        self.base.setFrameRateMeter(headless is False)
 
         # Set Some Common KeyBindings. (Un)Comment as required! ;)
         self.accept("w", self.toogleWireFrame)
 
-        # Collections for all objects and sprites used in the game.
-        self.gameObjects = OrderedDict()
+        # Collections for all sprites used in the game (game objects are
+        # kept in self.gameObjects, see Application)
         # self.gameSprites = pygame.sprite.Group()
 
+        # Video background (see setVideoBackground)
+        self.videoBackground = None
+        self.videoTexture = None
+        self.videoCard = None
+
     def toogleWireFrame(self):
         self.base.toggleWireframe()
 
+    def setVideoBackground(self, source):
+        """
+        Display the frames of source (the Camera, or a Detector debug frame)
+        behind the scene, on a full window card. Use None to remove it.
+        Frames are handed to the texture without conversion (Panda3D stores
+        RGB textures in BGR order, like OpenCV), only when a new frame is
+        available.
+        """
+        if self.videoBackground is not None:
+            self.videoBackground.release()
+            self.videoBackground = None
+        if self.videoCard is not None:
+            self.videoCard.removeNode()
+            self.videoCard = None
+        if source is None:
+            return
+
+        self.videoBackground = VideoSource(source)
+        self.videoTexture = Texture("videoBackground")
+
+        # Full window card, drawn first. Panda3D images are stored bottom row
+        # first, so the card texture coordinates are flipped vertically
+        # instead of flipping frames
+        cardMaker = CardMaker("videoBackground")
+        cardMaker.setFrameFullscreenQuad()
+        cardMaker.setUvRange((0, 1), (1, 0))
+        self.videoCard = self.base.render2d.attachNewNode(cardMaker.generate())
+        self.videoCard.setTexture(self.videoTexture)
+        self.videoCard.setBin("background", 0)
+        self.videoCard.setDepthWrite(False)
+        self.videoCard.setDepthTest(False)
+
+    def updateVideoBackground(self):
+        # Hand the latest video frame to the background texture
+        if self.videoBackground is None or self.videoBackground.update() is False:
+            return
+        frame = self.videoBackground.frame
+        height, width = frame.shape[:2]
+        if self.videoTexture.getXSize() != width or self.videoTexture.getYSize() != height:
+            self.videoTexture.setup2dTexture(width, height, Texture.T_unsigned_byte, Texture.F_rgb)
+        self.videoTexture.setRamImage(memoryview(frame))
+
     def start(self):
 
         # Start framework classes
@@ -57,7 +111,7 @@ class panda3DApp(Application, DirectObject.DirectObject):
         # Keep looping infinitely
         while True:
             # Get loop starting time for performance monitoring
-            start = time.time()
+            start = time.perf_counter_ns()
 
             # If the stop indicator variable is set, exit the loop
             if self.isRunning is False:
@@ -75,8 +129,13 @@ class panda3DApp(Application, DirectObject.DirectObject):
             # Update tracked Objects (several user-space hooks inside)
             self.updateTrackedObjects()
 
+            # Move tracked objects to their predicted positions at display
+            # time, when latency compensation is enabled (user-space hook)
+            self.updatePredictedObjects()
+
             # Update non tracked objects
             # self.gameSprites.update()
+            phase = self.traceSpan("panda3DApp.updateTrackedObjects", start)
 
             ###############################
             # Game logic section (Userspace hook)
@@ -103,60 +162,27 @@ class panda3DApp(Application, DirectObject.DirectObject):
             ###################################################################
             # self.clock.tick(30)
 
-            # Callback to Panda3D for frame rendering
+            # Update the video background (if any) and callback to Panda3D for
+            # frame rendering
+            self.updateVideoBackground()
             base.pgCallBack()
+            self.traceSpan("panda3DApp.draw", phase)
+            self.collectLatencySample()
+            self.collectRenderedFrame(self.base.win is not None)
 
             # Get loop end time and update profiler
             if self.profiler is not None:
-                end = time.time()
-                self.profiler.collectAPTSample(end - start)
+                self.profiler.APThistogram.record(time.perf_counter_ns() - start)
 
-    def updateTrackedObjects(self):
-        if self.trackerUpdateFlag is not True:
-            # Nothing to do...
-            return
+    def getFrameBuffer(self):
+        # Pixels of the last rendered frame (see Application)
+        texture = self.base.win.getScreenshot()
+        if texture is None:
+            return b""
+        return memoryview(texture.getRamImage())
 
-        # Different situations have to be considered here.
-        # If self.gameObjects is empty... create all tracker objects with
-        # new or updated status and return
-        if len(self.gameObjects) == 0:
-            for (id_, obj) in self.trackerObjects.items():
-                if self.trackerObjectStatus[id_] == "New":
-                    self.gameObjects[id_] = self.objectAdd(id_, obj)
-                    # self.gameSprites.add(self.gameObjects[id_])
-                if self.trackerObjectStatus[id_] == "Updated":
-                    self.gameObjects[id_] = self.objectAdd(id_, obj)
-                    # self.gameSprites.add(self.gameObjects[id_])
-                return
-
-        # Beyond this point, gameObjects is not empty so we have to update it
-        # 1. Process new objects received from tracker
-        for (id_, obj) in self.trackerObjects.items():
-            if self.trackerObjectStatus[id_] == "New":
-                self.gameObjects[id_] = self.objectAdd(id_, obj)
-                # self.gameSprites.add(self.gameObjects[id_])
-
-        # 2. Process updated objects
-        gameExistingIds = list(self.gameObjects)
-        for (id_, obj) in self.trackerObjects.items():
-            if self.trackerObjectStatus[id_] == "Updated":
-                if id_ in gameExistingIds:
-                    self.objectUpdate(id_, obj)
-                else:
-                    # Create a new one
-                    self.gameObjects[id_] = self.objectAdd(id_, obj)
-                    # self.gameSprites.add(self.gameObjects[id_])
-
-        # 3. Delete "Lost" objects
-        trackerExistingIds = list(self.trackerObjects)
-        for id_ in list(self.gameObjects):
-            if id_ not in trackerExistingIds:
-                self.objectDelete(id_)
-                # self.gameSprites.remove(self.gameObjects[id_])
-                del self.gameObjects[id_]
-
-        # Reset Tracker Update Flag
-        self.trackerUpdateFlag = False
+    def saveFrame(self, path):
+        self.base.win.saveScreenshot(Filename.fromOsSpecific(path))
 
     def close(self):
         # Warning! Do not call self.close() inside main game loop or the
@@ -0,0 +1,340 @@
+############################################
+# PROGAF                                   #
+# Projection Games Framework               #
+############################################
+# ProcessDetector.py                       #
+############################################
+#
+# 2026/10/18 Initial Release
+#
+############################################
+from progaf.SharedFrameBus import SharedFrameBus
+from progaf.Detector import Detector, Detection
+from threading import Thread, Lock
+from multiprocessing import resource_tracker
+import multiprocessing
+import traceback
+import time
+import os
+
+
+class ProcessDetector(Detector):
+    """
+    ProcessDetector runs any Detector subclass in a separate process, so
+    detectors holding the GIL for long periods (like MediaPipe based
+    HandDetector, FaceDetector or FaceMeshDetector) do not starve the game
+    loop or the Camera thread.
+
+    The camera frame buffer slots are moved into shared memory (a
+    SharedFrameBus, see FrameBuffer.share), so the child process reads
+    camera frames straight from the slots the camera publishes them into,
+    without copies, and sends back, for every processed frame, a compact
+    tuple: (seq, timestamp, [(xpos, ypos, detection), ...], processTime).
+    Detections are then displayed and tracked in this process, exactly like
+    any other Detector, so the object can be passed to
+    Application.setDetector transparently:
+
+        det = ProcessDetector(app.camera, app.projector, HandDetector)
+        app.setDetector(det)
+
+    The detector class is instantiated in the child process as
+    detectorClass(cam, None, *args, **kwargs), where cam is a lightweight
+    camera proxy (frameWidth, frameHeight, frame). It must be importable from
+    the child process (defined at module level). The debug frame returned by
+    read() is a copy of the camera frame the detections come from (drawings
+    performed by the child detector are not transferred).
+
+    detectionScale and refineDetections set on this object are forwarded to
+    the child detector (frames are processed with Detector.detectFrame), as
+    well as any other child detector attribute set in detectorSettings:
+
+        det.detectorSettings["maxHands"] = 1
+
+    roiMode is not supported (the tracker runs in this process).
+    detectionInterval and display settings work as in any other Detector.
+
+    If the child detector raises an exception, the error is reported and
+    the ProcessDetector stops.
+    """
+
+    isRemote = True
+
+    def __init__(self, cam, proj, detectorClass, *args, **kwargs):
+        # Call the parent class (Detector) constructor
+        super().__init__(cam, proj)
+
+        # Detector running in the child process
+        self.detectorClass = detectorClass
+        self.detectorArgs = args
+        self.detectorKwargs = kwargs
+
+        # Process attributes. 'spawn' is the default start method because
+        # forking a process with running threads (Camera, Projector, ...) is
+        # not safe
+        self.startMethod = "spawn"
+        self.process = None
+        self.controlConn = None
+        self.resultConn = None
+
+        # Camera frame buffer bus reader index and bus name announced to the
+        # child process (see FrameBuffer.share)
+        self.busReader = -1
+        self.busName = None
+
+        # Control messages are sent from the feed thread and from stop()
+        self.controlLock = Lock()
+
+        # Child detector attributes (name: value) forwarded to the child
+        # process, and the settings last sent (see sendSettings)
+        self.detectorSettings = {}
+        self.sentSettings = None
+
+        # Time (seconds) used by the child process to process the last frame
+        self.processTime = 0.0
+
+    def start(self):
+        # Create a reader over the camera frame buffer
+        if self.reader is None:
+            self.reader = self.cam.frameBuffer.reader()
+
+        # Move the camera frame buffer slots into shared memory
+        ctx = multiprocessing.get_context(self.startMethod)
+        self.busReader = self.cam.frameBuffer.share(ctx)
+        if self.busReader < 0:
+            print("Error: ProcessDetector.start all camera frame buffer bus readers are in use")
+            return self
+        self.busName = None
+        self.sentSettings = None
+
+        # Start the child process. The resource tracker must be running
+        # before, so the child process shares it (see SharedFrameBus.attach)
+        if os.name == "posix":
+            resource_tracker.ensure_running()
+        self.controlConn, childControlConn = ctx.Pipe()
+        self.resultConn, childResultConn = ctx.Pipe(duplex=False)
+        self.process = ctx.Process(target=runDetectorProcess,
+                                   args=(self.detectorClass, self.detectorArgs, self.detectorKwargs,
+                                         childControlConn, childResultConn,
+                                         self.cam.frameBuffer.busLock, self.busReader),
+                                   daemon=True)
+        self.process.start()
+
+        # Start the threads feeding frames and receiving detections
+        self.isRunning = True
+        self.stopEvent.clear()
+        Thread(target=self.feed, args=(), name=type(self).__name__ + ".feed").start()
+        Thread(target=self.update, args=(), name=type(self).__name__).start()
+        return self
+
+    def feed(self):
+        # Notify the child process of new camera frames until the thread is
+        # stopped
+        while True:
+            if self.isRunning is False:
+                self.reader.release()
+                self.process.join(1)
+                self.cam.frameBuffer.unshare(self.busReader)
+                return
+
+            # Wait for a new camera frame. The child process reads frames
+            # straight from the camera frame buffer (pinning them in the
+            # bus), so the frame is not kept pinned here
+            ok, seq, timestamp, frame = self.reader.readLatest(self.waitTimeout)
+            if ok is False:
+                self.waitWhileClosed()
+                continue
+            self.reader.release()
+            if self.skipFrame() is True:
+                continue
+
+            # Announce the bus holding the camera frame buffer slots when it
+            # changes (it is created, once shared, when the next frame is
+            # acquired, and recreated when the frame shape changes)
+            bus = self.cam.frameBuffer.bus
+            if bus is None:
+                continue
+            if bus.name != self.busName:
+                self.busName = bus.name
+                self.sendControl(("attach", bus.name, bus.shape, bus.dtype.str, bus.capacity, bus.maxReaders))
+            self.sendSettings()
+
+            # Notify the child process. New frames are announced through the
+            # control pipe (not a multiprocessing Event), so a child process
+            # that exited unexpectedly cannot block this thread
+            self.sendControl(("frame",))
+
+    def update(self):
+        # Receive detections from the child process until the thread is
+        # stopped
+        while True:
+            if self.isRunning is False:
+                return
+
+            try:
+                if self.resultConn.poll(self.waitTimeout) is False:
+                    continue
+                message = self.resultConn.recv()
+            except (EOFError, OSError):
+                message = ("error", "the detector process exited unexpectedly")
+            if message[0] == "error":
+                if self.isRunning is True:
+                    print("Error: ProcessDetector {} failed: {}".format(self.detectorClass.__name__, message[1]))
+                    self.stop()
+                return
+            seq, timestamp, results, self.processTime = message
+
+            # Get starting time for performance monitoring
+            start = time.perf_counter_ns()
+
+            # Rebuild detections
+            self.frameSeq = seq
+            self.frameTime = timestamp
+            self.detections = [Detection(xpos, ypos, detection) for (xpos, ypos, detection) in results]
+            self.stampDetections()
+
+            # Debug frame: a copy of the camera frame detections come from (if
+            # still available in the camera frame buffer, see Detector.read)
+            ok, seq, timestamp, frame = self.cam.frameBuffer.copySeq(seq)
+            if ok is True:
+                self.frame = frame
+                self.frameIsValid = True
+
+            # Display Detected Contours when required
+            if ok is True:
+                self.updateDisplayFrame(frame)
+            if self.displayDetections is True:
+                self.display()
+
+            # Track Detected contours when required
+            if self.tracker is not None:
+                self.tracker.update(self.detections, self.frameTime, self.frameSeq)
+
+            self.frameCounter += 1
+            # Get update loop end time and update performance monitor
+            if self.profiler is not None:
+                end = time.perf_counter_ns()
+                self.profiler.CDThistogram.record(int(self.processTime * 1e9) + end - start)
+            if self.tracer is not None:
+                self.tracer.span("ProcessDetector.update", start, self.frameSeq)
+
+    def sendSettings(self):
+        # Forward detection settings to the child process when they change
+        settings = dict(self.detectorSettings)
+        settings["detectionScale"] = self.detectionScale
+        settings["refineDetections"] = self.refineDetections
+        if settings != self.sentSettings:
+            self.sentSettings = settings
+            self.sendControl(("settings", settings))
+
+    def sendControl(self, message):
+        # Send a control message to the child process (nothing is sent once
+        # it has been asked to stop, or once it has exited: the update thread
+        # reports the error and stops this object)
+        with self.controlLock:
+            if self.controlConn is not None:
+                try:
+                    self.controlConn.send(message)
+                except OSError:
+                    self.controlConn = None
+
+    def stop(self):
+        # indicate that the threads (and the child process) should be stopped
+        self.isRunning = False
+        self.stopEvent.set()
+        with self.controlLock:
+            if self.controlConn is not None:
+                try:
+                    self.controlConn.send(("stop",))
+                except OSError:
+                    pass
+                self.controlConn = None
+
+        # Wake up the feeding thread if it is waiting for a frame
+        self.cam.frameBuffer.notify()
+
+
+class SharedFrameCamera:
+    """
+    Camera proxy used by detectors running in a child process. It only
+    provides the attributes detectors use from Camera objects.
+    """
+
+    def __init__(self):
+        self.frame = None
+        self.frameWidth = None
+        self.frameHeight = None
+        self.frameSeq = 0
+        self.frameTime = 0.0
+
+
+def runDetectorProcess(detectorClass, args, kwargs, controlConn, resultConn, lock, reader):
+    """
+    Entry point of the child process started by ProcessDetector. Frames are
+    read (as bus reader index reader) from the shared frame bus announced by
+    the parent, processed by a detectorClass object and detections are sent
+    back through resultConn. lock is the bus lock (see SharedFrameBus).
+    """
+    bus = None
+    try:
+        cam = SharedFrameCamera()
+        detector = detectorClass(cam, None, *args, **kwargs)
+        lastSeq = 0
+
+        while True:
+            # Sleep until the parent process sends control messages, and
+            # process them (new frames are announced with "frame" messages)
+            if controlConn.poll(0.1) is False:
+                continue
+            newFrame = False
+            while controlConn.poll():
+                message = controlConn.recv()
+                if message[0] == "frame":
+                    newFrame = True
+                if message[0] == "stop":
+                    return
+                if message[0] == "attach":
+                    name, shape, dtype, capacity, maxReaders = message[1:]
+                    if bus is not None:
+                        bus.close()
+                    bus = SharedFrameBus(shape, dtype, capacity, maxReaders, name, lock)
+                    lastSeq = 0
+                    cam.frameWidth = shape[1]
+                    cam.frameHeight = shape[0]
+                if message[0] == "settings":
+                    for name, value in message[1].items():
+                        setattr(detector, name, value)
+
+            if newFrame is False or bus is None:
+                continue
+
+            ok, seq, timestamp, frame = bus.readLatest(reader, lastSeq)
+            if ok is False:
+                continue
+            lastSeq = seq
+
+            # Process the frame
+            start = time.perf_counter()
+            cam.frame = frame
+            cam.frameSeq = seq
+            cam.frameTime = timestamp
+            detector.frameSeq = seq
+            detector.frameTime = timestamp
+            detector.detectFrame(frame)
+            processTime = time.perf_counter() - start
+            bus.release(reader)
+
+            # Send detections back
+            detections = detector.detections if detector.detections is not None else []
+            resultConn.send((seq, timestamp, [(d.xpos, d.ypos, d.detection) for d in detections], processTime))
+
+    except Exception:
+        # Report the error to the parent process (see ProcessDetector.update)
+        try:
+            resultConn.send(("error", traceback.format_exc()))
+        except OSError:
+            pass
+
+    finally:
+        if bus is not None:
+            bus.release(reader)
+            bus.close()
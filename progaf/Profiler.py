@@ -8,8 +8,113 @@
 # 2021/02/25 Initial Release (by Keko)
 #
 ############################################
-from threading import Thread
-import time
+from threading import Thread, Event, Lock, local
+from collections import deque
+import numpy as np
+
+
+class LatencyHistogram:
+    """
+    LatencyHistogram records durations (integer nanoseconds, see
+    time.perf_counter_ns) into log bucketed (HDR style) counters: every
+    power of two is split into 2^(subBucketBits - 1) buckets, so values are
+    resolved within about 3%, from 1ns to maxValue, with a fixed number of
+    counters.
+
+    Recording is lock free: every thread records into its own counters
+    (cumulative, never reset), and counters are only merged when read by
+    advance(), invoked by the Profiler once per interval. Windowed
+    statistics (count, mean and percentiles over the last intervals) are the
+    difference between cumulative snapshots, so no sample is ever lost.
+    """
+
+    subBucketBits = 6
+
+    def __init__(self, windowLength=5, maxValue=1 << 36):
+        half = 1 << (self.subBucketBits - 1)
+        self.nBuckets = self.bucketOf(maxValue) + 1
+
+        # Highest value of every bucket (reported for percentiles)
+        index = np.arange(self.nBuckets)
+        exponent = np.maximum(index // half - 1, 0)
+        self.bucketValues = np.where(index < 2 * half, index,
+                                     ((index - exponent * half + 1) << exponent) - 1)
+
+        # Counters of every thread. The last counter holds the sum of values
+        self.local = local()
+        self.threadCounters = []
+        self.registerLock = Lock()
+
+        # Cumulative snapshots, one per interval (see advance)
+        self.snapshots = deque(maxlen=windowLength + 1)
+        self.snapshots.append(np.zeros(self.nBuckets + 1, np.int64))
+
+    def bucketOf(self, value):
+        # Bucket index of value (nanoseconds)
+        exponent = value.bit_length() - self.subBucketBits
+        if exponent <= 0:
+            return value
+        return (exponent << (self.subBucketBits - 1)) + (value >> exponent)
+
+    def register(self):
+        # Create the counters of the calling thread
+        counters = [0] * (self.nBuckets + 1)
+        with self.registerLock:
+            self.threadCounters.append(counters)
+        self.local.counters = counters
+        return counters
+
+    def record(self, value):
+        # Record a duration (integer nanoseconds). Lock free, thread safe
+        try:
+            counters = self.local.counters
+        except AttributeError:
+            counters = self.register()
+        # (subBucketBits inlined, for speed)
+        exponent = value.bit_length() - 6
+        if exponent > 0:
+            index = (exponent << 5) + (value >> exponent)
+            if index >= self.nBuckets:
+                index = self.nBuckets - 1
+        elif value >= 0:
+            index = value
+        else:
+            index = 0
+        counters[index] += 1
+        counters[-1] += value
+
+    def advance(self):
+        # Take a cumulative snapshot (merging the counters of all threads),
+        # ending the current interval
+        with self.registerLock:
+            threadCounters = list(self.threadCounters)
+        snapshot = np.zeros(self.nBuckets + 1, np.int64)
+        for counters in threadCounters:
+            snapshot += counters
+        self.snapshots.append(snapshot)
+
+    def stats(self, intervals=None):
+        """
+        Statistics of the values recorded during the last intervals (the
+        whole window if None), in seconds: a dict with count, mean, p50,
+        p95, p99 and max. Percentiles and max are bucket (3%) accurate.
+        """
+        if intervals is None or intervals >= len(self.snapshots):
+            intervals = len(self.snapshots) - 1
+        delta = self.snapshots[-1] - self.snapshots[-1 - intervals]
+        counts = delta[:-1]
+        count = int(counts.sum())
+        stats = {"count": count, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+        if count == 0:
+            return stats
+
+        cumulative = np.cumsum(counts)
+        for name, quantile in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            index = np.searchsorted(cumulative, quantile * count)
+            stats[name] = float(self.bucketValues[index]) / 1e9
+        stats["max"] = float(self.bucketValues[np.flatnonzero(counts)[-1]]) / 1e9
+        stats["mean"] = float(delta[-1]) / count / 1e9
+        return stats
 
 
 class Profiler:
@@ -21,21 +126,36 @@ class Profiler:
           actually processing frame information, like Camera or Detector.
         - Elapsed time (expressed in miliseconds) is an indication of the total
           amount of time that one function or method requires to be completed
+
+    Elapsed times of every stage are recorded into LatencyHistograms (see
+    self.histograms), from any thread. Averages (FATaverage, CDTaverage,
+    ...) are computed for every update interval, and percentiles (FATstats,
+    CDTstats, ...: p50, p95, p99 and max) over a sliding window of
+    windowLength intervals.
     """
 
-    def __init__(self, rate=1, cam=None, det=None, trk=None, proj=None, mon=None):
+    stages = ("FAT", "CDT", "OTT", "APT", "PRT", "DLT", "TLT", "GLT", "LAT")
+
+    def __init__(self, rate=1, cam=None, det=None, trk=None, proj=None, mon=None, windowLength=5):
 
         # Class attributes
         self.isRunning = False
         self.updateRate = rate
+        self.stopEvent = Event()
+
+        # Histograms and windowed statistics of every stage
+        self.windowLength = windowLength
+        self.histograms = {}
+        for stage in self.stages:
+            self.histograms[stage] = LatencyHistogram(windowLength)
+            setattr(self, stage + "stats", self.histograms[stage].stats())
 
         # Camera
         if cam is not None:
             self.cam = cam
             self.cam.profiler = self
         self.cameraFramesPerSecond = 0
-        self.FATsamples = 0
-        self.FATnSamples = 0
+        self.FAThistogram = self.histograms["FAT"]
         self.FATaverage = 0
 
         # Detector
@@ -43,30 +163,52 @@ class Profiler:
             self.det = det
             self.det.profiler = self
         self.detectorFramesPerSecond = 0
-        self.CDTsamples = 0
-        self.CDTnSamples = 0
+        self.CDThistogram = self.histograms["CDT"]
         self.CDTaverage = 0
 
         # Tracker
         if trk is not None:
             self.trk = trk
             self.trk.profiler = self
-        self.OTTsamples = 0
-        self.OTTnSamples = 0
+        self.OTThistogram = self.histograms["OTT"]
         self.OTTaverage = 0
 
         # Projector
+        self.prj = None
         if proj is not None:
             self.prj = proj
             self.prj.profiler = self
         self.projectorFramesPerSecond = 0
+        self.projectorMissedFrames = 0
+        self.projectorLateFrames = 0
+
+        # PRT: Projector Render Time
+        self.PRThistogram = self.histograms["PRT"]
+        self.PRTaverage = 0
 
         # Monitor
         self.monitor = mon
 
+        # End-to-end latency (LAT): time from frame capture to the display of
+        # the tracking information of the frame. The last measured average
+        # is kept, as it is used for latency compensation
+        self.LAThistogram = self.histograms["LAT"]
+        self.LATaverage = 0
+
+        # Age of the tracking information (time since frame capture) at
+        # every stage of the pipeline, up to its display (LAT):
+        #   - DLT: Detection Latency (detections ready)
+        #   - TLT: Tracking Latency (tracker snapshot published)
+        #   - GLT: Game Latency (snapshot consumed by the game loop)
+        self.DLThistogram = self.histograms["DLT"]
+        self.DLTaverage = 0
+        self.TLThistogram = self.histograms["TLT"]
+        self.TLTaverage = 0
+        self.GLThistogram = self.histograms["GLT"]
+        self.GLTaverage = 0
+
         # User space applications (APT)
-        self.APTsamples = 0
-        self.APTnSamples = 0
+        self.APThistogram = self.histograms["APT"]
         self.APTaverage = 0
 
         ########################
@@ -80,7 +222,8 @@ class Profiler:
     def start(self):
         # Start threads
         self.isRunning = True
-        Thread(target=self.update, args=()).start()
+        self.stopEvent.clear()
+        Thread(target=self.update, args=(), name="Profiler").start()
         return self
 
     def update(self):
@@ -93,66 +236,62 @@ class Profiler:
             # Get Frame Counters
             camStartFrame = self.cam.frameCounter
             detStartFrame = self.det.frameCounter
-            # prjStartFrame = self.prj.frameCounter
+            if self.prj is not None:
+                prjStartFrame = self.prj.frameCounter
+                prjStartMissed = self.prj.missedFrames
+                prjStartLate = self.prj.lateFrames
 
-            # We just need to Sleep !!!! to ...
-            time.sleep(1 / self.updateRate)
+            # We just need to Sleep !!!! to ... (stop() wakes us up earlier)
+            if self.stopEvent.wait(1 / self.updateRate) is True:
+                return
 
             # ... update Frame Counters
             camFinalFrame = self.cam.frameCounter
             detFinalFrame = self.det.frameCounter
-            # prjFinalFrame = self.prj.frameCounter
 
             # Obtain FPS values
             self.cameraFramesPerSecond = (camFinalFrame - camStartFrame) * self.updateRate
             self.detectorFramesPerSecond = (detFinalFrame - detStartFrame) * self.updateRate
-            # self.projectorFramesPerSecond = (prjFinalFrame - prjStartFrame) * self.updateRate
+
+            # Projector frames per second, and deadlines missed and frames
+            # rendered late per second
+            if self.prj is not None:
+                self.projectorFramesPerSecond = (self.prj.frameCounter - prjStartFrame) * self.updateRate
+                self.projectorMissedFrames = (self.prj.missedFrames - prjStartMissed) * self.updateRate
+                self.projectorLateFrames = (self.prj.lateFrames - prjStartLate) * self.updateRate
 
             ###############################
             # Obtain Processing Time values
             ###################################################################
-
-            # FAT: Frame acquisition Time
-            if self.FATnSamples > 0:
-                self.FATaverage = self.FATsamples / self.FATnSamples
-            else:
-                self.FATaverage = 0
-            self.FATsamples = 0
-            self.FATnSamples = 0
-
-            # CDT: Contour Detection Time
-            if self.CDTnSamples > 0:
-                self.CDTaverage = self.CDTsamples / self.CDTnSamples
-            else:
-                self.CDTaverage = 0
-            self.CDTsamples = 0
-            self.CDTnSamples = 0
-
-            # OTT: Object Tracking Time
-            if self.OTTnSamples > 0:
-                self.OTTaverage = self.OTTsamples / self.OTTnSamples
-            else:
-                self.OTTaverage = 0
-            self.OTTsamples = 0
-            self.OTTnSamples = 0
+            # Close the interval of every histogram, and obtain averages
+            # (last interval) and percentiles (sliding window). The last
+            # measured end-to-end latency (LAT) average is kept when there
+            # are no samples
+            for stage, histogram in self.histograms.items():
+                histogram.advance()
+                average = histogram.stats(1)["mean"]
+                if stage != "LAT" or average > 0:
+                    setattr(self, stage + "average", average)
+                setattr(self, stage + "stats", histogram.stats())
 
             # FPT: Frame Processing Time
             self.FPT = self.FATaverage + self.CDTaverage
 
             # APT: Application Processing Time
-            if self.APTnSamples > 0:
-                self.APT = self.APTsamples / self.APTnSamples
-            else:
-                self.APT = 0
-            self.APTsamples = 0
-            self.APTnSamples = 0
+            self.APT = self.APTaverage
 
             if self.FPT > 0:
-                print("APT: {:.2f}ms "
+                print("PRJ: {} fps ({} missed, {} late) "
+                      "LAT: {:.2f}ms "
+                      "APT: {:.2f}ms "
                       "FPT: {:.2f}ms ["
                       "FAT: {:0>2.0f}% ({:.2f}ms) "
                       "CDT: {:0>2.0f}% ({:.2f}ms) "
-                      "OTT: {:0>2.0f}% ({:.2f}ms)] ".format(self.APT * 1000,
+                      "OTT: {:0>2.0f}% ({:.2f}ms)] ".format(self.projectorFramesPerSecond,
+                                                            self.projectorMissedFrames,
+                                                            self.projectorLateFrames,
+                                                            self.LATaverage * 1000,
+                                                            self.APT * 1000,
                                                             self.FPT * 1000,
                                                             self.FATaverage / self.FPT * 100,
                                                             self.FATaverage * 1000,
@@ -161,6 +300,19 @@ class Profiler:
                                                             self.OTTaverage / self.FPT * 100,
                                                             self.OTTaverage * 1000))
 
+                # Percentiles of every stage with samples
+                percentiles = []
+                for stage in self.stages:
+                    stats = getattr(self, stage + "stats")
+                    if stats["count"] > 0:
+                        percentiles.append("{}: {:.2f}/{:.2f}/{:.2f}/{:.2f}ms".format(stage,
+                                                                                      stats["p50"] * 1000,
+                                                                                      stats["p95"] * 1000,
+                                                                                      stats["p99"] * 1000,
+                                                                                      stats["max"] * 1000))
+                print("     p50/p95/p99/max (last {:.0f}s) {}".format(self.windowLength / self.updateRate,
+                                                                      " ".join(percentiles)))
+
             # Monitor GUI Support. Update FPS indicators
             if self.monitor is not None:
                 self.monitor.window.qLabel_CameraFPS.setText("Cam FPS: {}".format(self.cameraFramesPerSecond))
@@ -170,23 +322,44 @@ class Profiler:
     def stop(self):
         # Stop update thread
         self.isRunning = False
+        self.stopEvent.set()
+
+    # Samples are elapsed times in seconds. Framework classes record integer
+    # nanoseconds (time.perf_counter_ns) directly into the stage histograms
+    # (self.FAThistogram.record(), ...)
 
     # FAT: Frame acquisition Time
     def collectFATSample(self, sample):
-        self.FATsamples += sample
-        self.FATnSamples += 1
+        self.FAThistogram.record(int(sample * 1e9))
 
     # CDT: Contour Detection Time
     def collectCDTSample(self, sample):
-        self.CDTsamples += sample
-        self.CDTnSamples += 1
+        self.CDThistogram.record(int(sample * 1e9))
 
     # OTT: Object Tracking Time
     def collectOTTSample(self, sample):
-        self.OTTsamples += sample
-        self.OTTnSamples += 1
+        self.OTThistogram.record(int(sample * 1e9))
+
+    # LAT: End-to-end latency
+    def collectLATSample(self, sample):
+        self.LAThistogram.record(int(sample * 1e9))
+
+    # DLT: Detection Latency
+    def collectDLTSample(self, sample):
+        self.DLThistogram.record(int(sample * 1e9))
+
+    # TLT: Tracking Latency
+    def collectTLTSample(self, sample):
+        self.TLThistogram.record(int(sample * 1e9))
+
+    # GLT: Game Latency
+    def collectGLTSample(self, sample):
+        self.GLThistogram.record(int(sample * 1e9))
 
     # APT: Application Processing Time
     def collectAPTSample(self, sample):
-        self.APTsamples += sample
-        self.APTnSamples += 1
+        self.APThistogram.record(int(sample * 1e9))
+
+    # PRT: Projector Render Time
+    def collectPRTSample(self, sample):
+        self.PRThistogram.record(int(sample * 1e9))
@@ -9,8 +9,11 @@
 #
 ############################################
 from progaf.ShapeFactory import ShapeFactory
-from threading import Thread
+from progaf.Layer import Layer
+from progaf.Drawing import fillCircles
+from threading import Thread, Event
 import numpy as np
+import time
 import cv2
 
 
@@ -19,12 +22,34 @@ class Projector:
     def __init__(self, width, height, affineMatrix=None, createShapeFactory=False):
         self.width = width
         self.height = height
-        self.frame = np.zeros((height, width, 3), np.uint8)
         self.frameCounter = 0
         self.isRunning = False
         self.shapeFactory = None
-        self.gridIsActive = True
-        self.gridBorderOffset = 15
+        self._gridBorderOffset = 15
+
+        # Frame pacing. Frames are rendered on a grid of deadlines, at most
+        # refreshRate frames per second, sleeping (not spinning) until the
+        # next deadline. By default (and always when a Shape Factory is
+        # active) a frame is rendered on every deadline. Applications can opt
+        # in to render on change mode (renderOnChange = True): the update
+        # thread then also sleeps until a layer changes (see invalidate()) or,
+        # at most, idleTimeout seconds, and only frames with changes are
+        # rendered (and counted)
+        self.updateEvent = Event()
+        self.stopEvent = Event()
+        self.idleTimeout = 0.1
+        self.refreshRate = 60
+        self.renderOnChange = False
+
+        # Pacing statistics: deadlines missed (no frame rendered in the
+        # period, because the loop was late) and frames rendered late
+        # (finished after the next deadline). renderTime is the time spent
+        # rendering the last frame (seconds)
+        self.missedFrames = 0
+        self.lateFrames = 0
+        self.renderTime = 0.0
+        self.profiler = None
+        self.tracer = None
 
         # Affine transformation matrix default value
         if affineMatrix is not None:
@@ -34,13 +59,31 @@ class Projector:
             affineMatrix = np.array([[1, 0, 0],
                                      [0, 1, 0]])
             self.transform = Transform(affineMatrix)
+        self.identityTransform = Transform(np.array([[1, 0, 0],
+                                                     [0, 1, 0]]))
 
         # Layers Support
-        self.layerAFrame = np.zeros((height, width, 3), np.uint8)
-        self.layerBFrame = np.zeros((height, width, 3), np.uint8)
-        self.layerAIsActive = True
-        self.layerBIsActive = True
+        # Layers (see Layer) are composited in z order into two preallocated
+        # output frames (double buffering: self.frame is the last frame
+        # composited, the other one is being composited). Only the areas of
+        # the layers that changed are composited again. Default layers are:
+        #   - "grid": calibration grid, rendered once (static)
+        #   - "A": Shape Factory objects
+        #   - "B": drawings performed by Detector and CentroidTracker
+        self.layers = []
+        self.outputFrames = [np.zeros((height, width, 3), np.uint8) for i in range(2)]
+        self.scratchFrame = np.zeros((height, width, 3), np.uint8)
+        self.scratchMask = np.zeros((height, width), np.uint8)
+        self.outputIndex = 0
+        self.frame = self.outputFrames[1]
+        self.previousRect = None
+        self.fullComposite = True
+
+        self.gridLayer = self.addLayer("grid", 0)
+        self.layerA = self.addLayer("A", 1)
+        self.layerB = self.addLayer("B", 2)
         self.layerCIsActive = False
+        self.renderGrid()
 
         # shapeFactory initialization
         if createShapeFactory is True:
@@ -49,71 +92,346 @@ class Projector:
         for i in range(0, 0):
             self.shapeFactory.createRandomObject()
 
+    #
+    # Layer compatibility properties (two layers design)
+    #
+    @property
+    def layerAFrame(self):
+        return self.layerA.frame
+
+    @layerAFrame.setter
+    def layerAFrame(self, frame):
+        self.layerA.setFrame(frame)
+        self.updateEvent.set()
+
+    @property
+    def layerBFrame(self):
+        return self.layerB.frame
+
+    @layerBFrame.setter
+    def layerBFrame(self, frame):
+        self.layerB.setFrame(frame)
+        self.updateEvent.set()
+
+    @property
+    def layerAIsActive(self):
+        return self.layerA.isActive
+
+    @layerAIsActive.setter
+    def layerAIsActive(self, value):
+        self.layerA.isActive = value
+        self.updateEvent.set()
+
+    @property
+    def layerBIsActive(self):
+        return self.layerB.isActive
+
+    @layerBIsActive.setter
+    def layerBIsActive(self, value):
+        self.layerB.isActive = value
+        self.updateEvent.set()
+
+    @property
+    def gridIsActive(self):
+        return self.gridLayer.isActive
+
+    @gridIsActive.setter
+    def gridIsActive(self, value):
+        self.gridLayer.isActive = value
+        self.updateEvent.set()
+
+    @property
+    def gridBorderOffset(self):
+        return self._gridBorderOffset
+
+    @gridBorderOffset.setter
+    def gridBorderOffset(self, value):
+        self._gridBorderOffset = value
+        self.renderGrid()
+
+    @property
+    def warpLayerB(self):
+        return self.layerB.warpTransform is not None
+
+    #
+    # Layer stack
+    #
+    def addLayer(self, name, z=None, opacity=1.0, blendMode="add"):
+        """
+        Create a new layer (see Layer) on top of existing layers (or at z
+        order z) and return it.
+        """
+        if z is None:
+            z = max([layer.z for layer in self.layers], default=-1) + 1
+        layer = Layer(name, self.width, self.height, z, opacity, blendMode)
+        self.layers.append(layer)
+        self.invalidate(layer=layer)
+        return layer
+
+    def getLayer(self, name):
+        for layer in self.layers:
+            if layer.name == name:
+                return layer
+        return None
+
+    def removeLayer(self, name):
+        layer = self.getLayer(name)
+        if layer is not None:
+            self.layers.remove(layer)
+            self.fullComposite = True
+            self.updateEvent.set()
+
     def start(self):
         self.isRunning = True
-        Thread(target=self.update, args=()).start()
+        self.stopEvent.clear()
+        Thread(target=self.update, args=(), name="Projector").start()
         return self
 
     def update(self):
 
+        # Deadline of the next frame
+        deadline = time.perf_counter()
+
         # Keep looping infinitely until the thread is stopped
         while True:
+            period = 1 / self.refreshRate
+            continuous = self.renderOnChange is False or self.shapeFactory is not None
+
+            # Render on change: sleep until there is something new to project
+            if continuous is False:
+                self.updateEvent.wait(self.idleTimeout)
+                self.updateEvent.clear()
+
             # If the thread stop indicator variable is set, stop the thread
             if self.isRunning is False:
                 return
 
+            # Sleep until the frame deadline (stop() wakes us up earlier)
+            now = time.perf_counter()
+            if now < deadline:
+                if self.stopEvent.wait(deadline - now) is True:
+                    return
+                now = time.perf_counter()
+            elif now - deadline >= period:
+                if continuous is True:
+                    # Running late: skip the deadlines missed
+                    missed = int((now - deadline) / period)
+                    self.missedFrames += missed
+                    deadline += missed * period
+                else:
+                    # Nothing was rendered while idle. Render right now
+                    deadline = now
+
             # Shape Factory integration
             # uses Layer A frame
             if self.shapeFactory is not None:
                 # Update Shape Factory objects on the frame
-                self.layerAFrame = self.shapeFactory.update()
-
-            # If Grid Is active, uses Layer A
-            if self.gridIsActive is True:
-                self.drawGrid(self.layerAFrame)
-
-            # Fuse Layers as required
-            # OpenCV addition is a saturated operation
-            # 250+10 = 260 => 255
-            if self.layerAIsActive is True and self.layerBIsActive is True:
-                self.frame = cv2.add(self.layerAFrame, self.layerBFrame)
-            elif self.layerAIsActive is True:
-                self.frame = self.layerAFrame
+                self.layerA.setFrame(self.shapeFactory.update())
+
+            # Composite layers (only the areas that changed) and increase
+            # Frame Counter. In render on change mode, frames are only counted
+            # when something changed; in continuous mode, the last frame is
+            # presented again (at no cost) when nothing changed
+            if self.composite() is True or continuous is True:
+                self.frameCounter += 1
+                end = time.perf_counter()
+                self.renderTime = end - now
+                if self.profiler is not None:
+                    self.profiler.collectPRTSample(self.renderTime)
+                if self.tracer is not None:
+                    self.tracer.span("Projector.update", int(now * 1e9), -1, {"projectorFrame": self.frameCounter})
+                if end > deadline + period:
+                    self.lateFrames += 1
+
+            deadline += period
+
+    def composite(self):
+        """
+        Composite the areas of all layers changed since the last call into
+        the output frame. Returns False if nothing changed.
+        """
+        # Changed area (union of the dirty areas of all layers)
+        rect = None
+        for layer in list(self.layers):
+            rect = unionRect(rect, layer.takeDirtyRect())
+        if self.fullComposite is True:
+            self.fullComposite = False
+            rect = (0, 0, self.width, self.height)
+        if rect is None:
+            return False
+
+        # The output frame being composited missed the changes of the
+        # previous frame (double buffering)
+        area = unionRect(rect, self.previousRect)
+        self.previousRect = rect
+        x1, y1, x2, y2 = area
+        output = self.outputFrames[self.outputIndex]
+        dst = output[y1:y2, x1:x2]
+        scratch = self.scratchFrame[y1:y2, x1:x2]
+        mask = self.scratchMask[y1:y2, x1:x2]
+
+        # Blend active layers, in z order, into the output frame
+        isFirst = True
+        for layer in sorted(self.layers, key=lambda layer: layer.z):
+            if layer.isActive is False:
+                continue
+            self.blend(dst, layer.getFrame()[y1:y2, x1:x2], scratch, mask, layer.opacity, layer.blendMode, isFirst)
+            isFirst = False
+        if isFirst is True:
+            dst.fill(0)
+
+        # Swap output frames
+        self.frame = output
+        self.outputIndex = 1 - self.outputIndex
+        return True
+
+    @staticmethod
+    def blend(dst, src, scratch, mask, opacity, blendMode, isFirst):
+        # Blend src into dst (in place), as described in Layer. OpenCV
+        # addition is a saturated operation: 250+10 = 260 => 255
+        if blendMode == "alpha":
+            if isFirst is True:
+                dst.fill(0)
+            # Mask of non-black pixels of the layer
+            cv2.inRange(src, (0, 0, 0), (0, 0, 0), dst=mask)
+            cv2.bitwise_not(mask, dst=mask)
+            if opacity < 1:
+                cv2.addWeighted(dst, 1 - opacity, src, opacity, 0, dst=scratch)
+                src = scratch
+            cv2.copyTo(src, mask, dst=dst)
+            return
+
+        if isFirst is True:
+            if opacity >= 1:
+                np.copyto(dst, src)
             else:
-                self.frame = self.layerBFrame
-
-            # Delay
-            # time.sleep(0.1)
-
-            # Increase Frame Counter
-            self.frameCounter += 1
+                cv2.addWeighted(src, opacity, src, 0, 0, dst=dst)
+            return
+
+        if opacity < 1:
+            cv2.addWeighted(src, opacity, src, 0, 0, dst=scratch)
+            src = scratch
+        if blendMode == "max":
+            cv2.max(dst, src, dst=dst)
+        else:
+            cv2.add(dst, src, dst=dst)
 
     def read(self):
         return True, self.frame
 
     def stop(self):
-        # indicate that the thread should be stopped
+        # indicate that the thread should be stopped and wake it up
         self.isRunning = False
+        self.updateEvent.set()
+        self.stopEvent.set()
+
+    def invalidate(self, rect=None, layer=None):
+        # Notify the update thread that layers have changed. Call it after
+        # drawing directly over layer frames. rect (x1, y1, x2, y2) is the
+        # area of layer changed (all of it if None). All layers if layer is
+        # None
+        if layer is not None:
+            layer.invalidate(rect)
+        else:
+            for layer in self.layers:
+                layer.invalidate()
+        self.updateEvent.set()
+
+    def invalidatePoints(self, points, marginX, marginY):
+        # Invalidate the area of layer B containing points (in layer
+        # coordinates), padded by a margin
+        points = np.asarray(points).reshape(-1, 2)
+        x1, y1 = points.min(axis=0)
+        x2, y2 = points.max(axis=0)
+        self.invalidate((int(x1) - marginX, int(y1) - marginY, int(x2) + marginX + 1, int(y2) + marginY + 1),
+                        self.layerB)
+
+    def getLayerTransform(self):
+        # Transformation from camera coordinates to layer B coordinates
+        if self.warpLayerB is True:
+            return self.identityTransform
+        return self.transform
+
+    def setWarpLayerB(self, warpLayerB, sourceSize=None):
+        """
+        Enable (or disable) layer B warping: drawing operations are performed
+        in camera coordinates over layer B (of sourceSize (width, height)
+        pixels, the projector size if None) and the layer is warped into
+        projector space (dirty areas only) using the cached remap tables of
+        the transform (see Transform.warp). Layer B is cleared.
+        """
+        if warpLayerB is True:
+            self.layerB.setWarp(self.transform, sourceSize)
+        else:
+            self.layerB.setWarp(None)
+        self.updateEvent.set()
 
     #
     # Drawing operations used by Detector and CentroidTracker use Layer B
     #
     def clear(self):
-        self.layerBFrame = np.zeros((self.height, self.width, 3), np.uint8)
+        self.layerB.clear()
+        self.updateEvent.set()
 
     def drawContours(self, box, colour):
-        tbox = self.transform.Box(box)
-        cv2.drawContours(self.layerBFrame, [tbox], 0, colour, 2)
+        tbox = self.getLayerTransform().Box(box)
+        cv2.drawContours(self.layerB.frame, [tbox], 0, colour, 2)
+        self.invalidatePoints(tbox, 2, 2)
 
     def drawCircle(self, x, y, colour):
-        cv2.circle(self.layerBFrame, (self.transform.Point(x, y)), 5, colour, -1)
+        point = self.getLayerTransform().Point(x, y)
+        cv2.circle(self.layerB.frame, point, 5, colour, -1)
+        self.invalidatePoints(point, 6, 6)
 
     def drawText(self, text, x, y, colour):
-        cv2.putText(self.layerBFrame, text, (self.transform.Point(x, y)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, colour, 1)
+        point = self.getLayerTransform().Point(x, y)
+        cv2.putText(self.layerB.frame, text, point, cv2.FONT_HERSHEY_SIMPLEX, 0.5, colour, 1)
+        self.invalidateTexts([text], point)
+
+    #
+    # Batched drawing operations: all primitives are transformed in one call
+    # (points in camera coordinates, as an (N, 2) array or list of (x, y))
+    #
+    def drawBoxes(self, boxes, colour):
+        # boxes is an (N, 4, 2) array (or list of boxes)
+        if len(boxes) == 0:
+            return
+        tboxes = self.getLayerTransform().Boxes(boxes)
+        cv2.polylines(self.layerB.frame, list(tboxes), True, colour, 2)
+        self.invalidatePoints(tboxes, 2, 2)
+
+    def drawCircles(self, points, colour, radius=5):
+        if len(points) == 0:
+            return
+        tpoints = self.getLayerTransform().Points(points)
+        fillCircles(self.layerB.frame, tpoints, radius, colour)
+        self.invalidatePoints(tpoints, radius + 1, radius + 1)
+
+    def drawTexts(self, texts, points, colour):
+        if len(points) == 0:
+            return
+        tpoints = self.getLayerTransform().Points(points)
+        for text, point in zip(texts, tpoints.tolist()):
+            cv2.putText(self.layerB.frame, text, tuple(point), cv2.FONT_HERSHEY_SIMPLEX, 0.5, colour, 1)
+        self.invalidateTexts(texts, tpoints)
+
+    def invalidateTexts(self, texts, points):
+        # Invalidate the area of layer B containing texts drawn at points
+        width = max(cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)[0][0] for text in texts)
+        points = np.asarray(points).reshape(-1, 2)
+        x1, y1 = points.min(axis=0)
+        x2, y2 = points.max(axis=0)
+        self.invalidate((int(x1) - 1, int(y1) - 16, int(x2) + width + 1, int(y2) + 6), self.layerB)
 
     #
     # Grid
     #
+    def renderGrid(self):
+        # The grid is rendered once, over its own (static) layer
+        self.gridLayer.frame.fill(0)
+        self.drawGrid(self.gridLayer.frame)
+        self.invalidate(layer=self.gridLayer)
+
     def drawGrid(self, frame):
 
         pixels = self.gridBorderOffset
@@ -153,23 +471,186 @@ class Projector:
 
         # Set the new affine transformation matrix
         self.transform.affineMatrix = affineMatrix
+        self.invalidate()
+
+    def setPerspectiveTransform(self, cameraPoints, projectorPoints=None):
+        """
+        Set a perspective transformation (homography) from four or more
+        camera/projector point correspondences, so keystone (tilted
+        projectors) is corrected. When projectorPoints is None, the four
+        cameraPoints (top-left, top-right, bottom-right, bottom-left) are
+        mapped to the corners of the projector grid. With more than four
+        correspondences, the homography is a least squares fit with RANSAC
+        outlier rejection.
+        """
+        cameraPoints = np.asarray(cameraPoints, np.float32).reshape(-1, 2)
+        if projectorPoints is None:
+            pixels = self.gridBorderOffset
+            projectorPoints = ((pixels, pixels),
+                               (self.width - pixels, pixels),
+                               (self.width - pixels, self.height - pixels),
+                               (pixels, self.height - pixels))
+        projectorPoints = np.asarray(projectorPoints, np.float32).reshape(-1, 2)
+
+        if len(cameraPoints) < 4 or len(cameraPoints) != len(projectorPoints):
+            print("Projector: Four or more point correspondences are required")
+            return False
+
+        if len(cameraPoints) == 4:
+            homography = cv2.getPerspectiveTransform(cameraPoints, projectorPoints)
+        else:
+            homography, mask = cv2.findHomography(cameraPoints, projectorPoints, cv2.RANSAC, 3.0)
+        if homography is None:
+            print("Projector: Unable to compute perspective transformation")
+            return False
+
+        # Set the new perspective transformation matrix
+        self.transform.affineMatrix = homography
+        self.invalidate()
+        return True
+
+    def warpFrame(self, frame, dst=None, rect=None):
+        """
+        Warp a frame in camera coordinates into projector space (one cached
+        cv2.remap, see Transform.warp). rect (x1, y1, x2, y2) limits the warp
+        to the destination area affected by that area of the frame.
+        """
+        return self.transform.warp(frame, dst, rect, (self.width, self.height))
 
 
 class Transform:
 
     def __init__(self, affineMatrix):
+        # Affine (2x3) or perspective (3x3) transformation matrix
         self.affineMatrix = affineMatrix
 
+        # Cached remap tables used by warp(), and the matrix and sizes they
+        # were computed for
+        self.warpKey = None
+        self.warpIsIdentity = False
+        self.warpMap1 = None
+        self.warpMap2 = None
+        self.warpInterpolation = cv2.INTER_LINEAR
+
     def Point(self, x, y):
         p = np.float32([x, y, 1])
         p_proy = self.affineMatrix.dot(p)
+        if len(p_proy) == 3:
+            p_proy = p_proy / p_proy[2]
         p_proy = p_proy[:2]
         return int(p_proy[0]), int(p_proy[1])
 
+    def getMatrix(self):
+        # The transformation as a 3x3 (perspective) matrix
+        matrix = np.asarray(self.affineMatrix, np.float64)
+        if matrix.shape[0] == 2:
+            matrix = np.vstack((matrix, (0, 0, 1)))
+        return matrix
+
+    def updateWarpMaps(self, srcSize, dstSize):
+        # (Re)compute remap tables only when the matrix or sizes change
+        matrix = self.getMatrix()
+        key = (matrix.tobytes(), srcSize, dstSize)
+        if key == self.warpKey:
+            return
+        self.warpKey = key
+
+        # Identity fast path (no remap required)
+        self.warpIsIdentity = srcSize == dstSize and np.allclose(matrix, np.eye(3))
+        if self.warpIsIdentity is True:
+            self.warpMap1 = None
+            self.warpMap2 = None
+            return
+
+        # Source position of every destination pixel (inverse mapping),
+        # stored as fixed-point maps (faster remap)
+        width, height = dstSize
+        u, v = np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32))
+        points = np.stack((u, v), axis=-1).reshape(-1, 1, 2)
+        source = cv2.perspectiveTransform(points, np.linalg.inv(matrix)).reshape(height, width, 2)
+        self.warpMap1, self.warpMap2 = cv2.convertMaps(source[..., 0], source[..., 1], cv2.CV_16SC2)
+
     def Box(self, box):
-        r = np.asarray(((self.Point(int(box[0][0]), int(box[0][1]))),
-                        (self.Point(int(box[1][0]), int(box[1][1]))),
-                        (self.Point(int(box[2][0]), int(box[2][1]))),
-                        (self.Point(int(box[3][0]), int(box[3][1])))
-                        ))
-        return r
+        # Box corners are truncated to integers before the transformation
+        return self.Boxes(np.asarray(box).astype(np.int32)[None])[0]
+
+    def Points(self, points):
+        """
+        Transform an (N, 2) array (or list) of points in one call. Returns
+        an (N, 2) int32 array. Affine (2x3) and perspective (3x3) matrices
+        are supported.
+        """
+        points = np.asarray(points, np.float32).reshape(-1, 1, 2)
+        matrix = np.asarray(self.affineMatrix, np.float64)
+        if matrix.shape[0] == 3:
+            result = cv2.perspectiveTransform(points, matrix)
+        else:
+            result = cv2.transform(points, matrix)
+        return result.reshape(-1, 2).astype(np.int32)
+
+    def Boxes(self, boxes):
+        # Transform an (N, 4, 2) array (or list) of boxes. Returns an
+        # (N, 4, 2) int32 array
+        return self.Points(np.asarray(boxes).reshape(-1, 2)).reshape(-1, 4, 2)
+
+    def warpRect(self, rect, srcShape, size):
+        """
+        Destination area (x1, y1, x2, y2), clipped to size (width, height),
+        affected by the area rect of a source frame of shape srcShape, or
+        None if empty.
+        """
+        self.updateWarpMaps((srcShape[1], srcShape[0]), size)
+        if self.warpIsIdentity is True:
+            x1, y1, x2, y2 = rect
+        else:
+            corners = self.Points(((rect[0], rect[1]), (rect[2], rect[1]), (rect[2], rect[3]), (rect[0], rect[3])))
+            x1, y1 = corners.min(axis=0) - 2
+            x2, y2 = corners.max(axis=0) + 2
+        x1, y1 = max(int(x1), 0), max(int(y1), 0)
+        x2, y2 = min(int(x2), size[0]), min(int(y2), size[1])
+        if x2 <= x1 or y2 <= y1:
+            return None
+        return x1, y1, x2, y2
+
+    def warp(self, src, dst=None, rect=None, size=None, isDestinationRect=False):
+        """
+        Warp src (in source coordinates) into dst (destination coordinates,
+        of size (width, height), the src size if None) with one cv2.remap.
+        Remap tables are cached until the matrix or the sizes change. When
+        rect (x1, y1, x2, y2) is given, only the destination area affected
+        by that area of src is updated (rect is already a destination area
+        when isDestinationRect is True). Returns dst.
+        """
+        srcSize = (src.shape[1], src.shape[0])
+        if size is None:
+            size = (dst.shape[1], dst.shape[0]) if dst is not None else srcSize
+        if dst is None:
+            dst = np.zeros((size[1], size[0]) + src.shape[2:], src.dtype)
+        self.updateWarpMaps(srcSize, size)
+
+        # Destination area to update
+        if rect is None:
+            rect = (0, 0, size[0], size[1])
+        elif isDestinationRect is False:
+            rect = self.warpRect(rect, src.shape, size)
+            if rect is None:
+                return dst
+        x1, y1, x2, y2 = rect
+
+        if self.warpIsIdentity is True:
+            dst[y1:y2, x1:x2] = src[y1:y2, x1:x2]
+        else:
+            cv2.remap(src, self.warpMap1[y1:y2, x1:x2], self.warpMap2[y1:y2, x1:x2], self.warpInterpolation,
+                      dst=dst[y1:y2, x1:x2], borderMode=cv2.BORDER_CONSTANT)
+        return dst
+
+
+def unionRect(a, b):
+    # Smallest rectangle (x1, y1, x2, y2) containing a and b (either of them
+    # can be None)
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
@@ -9,29 +9,62 @@
 #
 ############################################
 from progaf.Application import Application
-from collections import OrderedDict
+from progaf.VideoSource import VideoSource
 import pygame
 import time
+import os
 
 
 class PyGameApp(Application):
     """Application encapsulates the Application logic"""
 
-    def __init__(self, width, height):
-        super().__init__()
+    def __init__(self, width, height, headless=False, headlessRendering=True):
+        super().__init__(headless, headlessRendering)
 
         # Class Attributes
         self.screenWidth = width
         self.screenHeight = height
 
-        # Collections for all PyGame objects and sprites used in the game.
-        self.gameObjects = OrderedDict()
-        self.gameSprites = pygame.sprite.Group()
+        # Collection of all PyGame sprites used in the game (game objects are
+        # kept in self.gameObjects, see Application). RenderUpdates is a
+        # sprite Group that also reports the screen areas changed when drawn
+        self.gameSprites = pygame.sprite.RenderUpdates()
 
-        # PyGame initialization
+        # Dirty rectangles rendering mode. When enabled, clearScreen() is
+        # only invoked to render a background (cached until
+        # invalidateBackground() is invoked), sprites are erased and redrawn
+        # over the background, and only the changed screen areas are updated.
+        # Areas changed by custom drawing (drawPreFlip) must be reported with
+        # addDirtyRect(). The whole screen is updated (flip) when the changed
+        # area is over fullUpdateRatio of the screen
+        self.dirtyRendering = False
+        self.fullUpdateRatio = 0.5
+        self.background = None
+        self.dirtyRects = []
+        self.previousDirtyRects = []
+
+        # Video background (see setVideoBackground). One surface is cached
+        # per frame buffer slot (surfaces wrap the slot memory)
+        self.videoBackground = None
+        self.videoSurfaces = {}
+        self.videoScaledSurface = None
+        self.videoSurface = None
+
+        # Game loop frame rate limit (frames per second, None for no limit).
+        # Headless applications run as fast as possible by default
+        self.frameRate = 30 if headless is False else None
+
+        # PyGame initialization. Headless applications use SDL dummy drivers
+        # (no window, no audio device) and draw on an offscreen surface
+        if headless is True:
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+            os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
         pygame.init()
         pygame.mixer.init()
-        self.screen = pygame.display.set_mode((width, height))
+        if headless is True:
+            self.screen = pygame.Surface((width, height))
+        else:
+            self.screen = pygame.display.set_mode((width, height))
         self.clock = pygame.time.Clock()
 
     def start(self):
@@ -51,7 +84,7 @@ class PyGameApp(Application):
         # Keep looping infinitely until the thread is stopped
         while True:
             # Get loop starting time for performance monitoring
-            start = time.time()
+            start = time.perf_counter_ns()
 
             # If the thread stop indicator variable is set, stop the thread
             if self.isRunning is False:
@@ -62,6 +95,7 @@ class PyGameApp(Application):
             # User Input Events section (UserSpace hook)
             ####################################################################
             self.gameEvents(pygame.event.get())
+            phase = self.traceSpan("PyGameApp.events", start)
 
             #################################
             # Object update section
@@ -69,90 +103,185 @@ class PyGameApp(Application):
             # Update tracked Objects (several user-space hooks inside)
             self.updateTrackedObjects()
 
+            # Move tracked objects to their predicted positions at display
+            # time, when latency compensation is enabled (user-space hook)
+            self.updatePredictedObjects()
+
             # Update non tracked objects
             self.gameSprites.update()
+            phase = self.traceSpan("PyGameApp.updateTrackedObjects", phase)
 
             ###############################
             # Game logic section (Userspace hook)
             ###################################################################
             self.gameLogic()
+            phase = self.traceSpan("PyGameApp.gameLogic", phase)
 
             #################################
             # Drawing section
             ####################################################################
-            # Clear screen to redraw everything for each frame
-            # self.screen.fill((255, 255, 255))
-            self.clearScreen()
+            rendered = self.headless is False or self.headlessRendering is True
+            if rendered is False:
+                # Headless application, rendering disabled
+                pass
+            elif self.dirtyRendering is True:
+                self.drawDirtyRects()
+            else:
+                # Clear screen to redraw everything for each frame (or draw
+                # the video background)
+                # self.screen.fill((255, 255, 255))
+                if self.videoBackground is not None:
+                    self.updateVideoBackground()
+                    if self.videoSurface is not None:
+                        self.screen.blit(self.videoSurface, (0, 0))
+                else:
+                    self.clearScreen()
 
-            # Draw all the sprites in one go.
-            self.gameSprites.draw(self.screen)
+                # Draw all the sprites in one go.
+                self.gameSprites.draw(self.screen)
 
-            # Custom drawing before display flip (user-space hook).
-            self.drawPreFlip()
+                # Custom drawing before display flip (user-space hook).
+                self.drawPreFlip()
 
-            # Update the screen
-            pygame.display.flip()
+                # Update the screen
+                self.updateScreen()
+            self.traceSpan("PyGameApp.draw", phase)
+            self.collectLatencySample()
+            self.collectRenderedFrame(rendered)
 
             ###################################
-            # --- Limit to 30 frames per second
+            # --- Limit to 30 frames per second (see self.frameRate)
             ###################################################################
-            self.clock.tick(30)
+            if self.frameRate is not None:
+                self.clock.tick(self.frameRate)
 
             # Get loop end time and update profiler
             if self.profiler is not None:
-                end = time.time()
-                self.profiler.collectAPTSample(end - start)
+                self.profiler.APThistogram.record(time.perf_counter_ns() - start)
+
+    def drawDirtyRects(self):
+        # Dirty rectangles rendering mode (see self.dirtyRendering)
+        fullUpdate = False
+
+        # A new video frame is a new background
+        if self.videoBackground is not None:
+            if self.updateVideoBackground() is True:
+                self.background = None
+
+        # (Re)build the cached background when required
+        if self.background is None:
+            if self.videoBackground is not None:
+                self.background = self.videoSurface
+                if self.background is not None:
+                    self.screen.blit(self.background, (0, 0))
+            else:
+                self.clearScreen()
+                self.background = self.screen.copy()
+            fullUpdate = True
+        else:
+            # Erase sprites and custom drawings of the previous frame
+            self.gameSprites.clear(self.screen, self.background)
+            for rect in self.previousDirtyRects:
+                self.screen.blit(self.background, rect, rect)
+
+        # Draw all the sprites in one go (rects changed, old and new positions)
+        rects = self.gameSprites.draw(self.screen)
+
+        # Custom drawing before display flip (user-space hook).
+        self.dirtyRects = []
+        self.drawPreFlip()
+        rects.extend(self.previousDirtyRects)
+        rects.extend(self.dirtyRects)
+        self.previousDirtyRects = self.dirtyRects
+
+        # Update the screen: changed areas only, unless most of the screen
+        # changed
+        area = sum(rect.width * rect.height for rect in rects)
+        if fullUpdate is True or area > self.fullUpdateRatio * self.screenWidth * self.screenHeight:
+            self.updateScreen()
+        elif len(rects) > 0:
+            self.updateScreen(rects)
 
-    def updateTrackedObjects(self):
-        if self.trackerUpdateFlag is not True:
-            # Nothing to do...
+    def updateScreen(self, rects=None):
+        # Display the screen (or the rects areas of it). Nothing to do for
+        # headless applications (offscreen surface)
+        if self.headless is True:
             return
+        start = time.perf_counter_ns()
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+        self.traceSpan("PyGameApp.flip", start)
 
-        # Different situations have to be considered here.
-        # If self.gameObjects is empty... create all tracker objects with
-        # new or updated status and return
-        if len(self.gameObjects) == 0:
-            for (id_, obj) in self.trackerObjects.items():
-                if self.trackerObjectStatus[id_] == "New":
-                    self.gameObjects[id_] = self.objectAdd(id_, obj)
-                    if self.objectAdd(id_, obj) is not None:
-                        self.gameSprites.add(self.gameObjects[id_])
-                if self.trackerObjectStatus[id_] == "Updated":
-                    self.gameObjects[id_] = self.objectAdd(id_, obj)
-                    if self.objectAdd(id_, obj) is not None:
-                        self.gameSprites.add(self.gameObjects[id_])
-                return
+    def getFrameBuffer(self):
+        # Pixels of the screen surface, not copied (see Application)
+        return self.screen.get_view("2")
 
-        # Beyond this point, gameObjects is not empty so we have to update it
-        # 1. Process new objects received from tracker
-        for (id_, obj) in self.trackerObjects.items():
-            if self.trackerObjectStatus[id_] == "New":
-                self.gameObjects[id_] = self.objectAdd(id_, obj)
-                if self.objectAdd(id_, obj) is not None:
-                    self.gameSprites.add(self.gameObjects[id_])
-
-        # 2. Process updated objects
-        gameExistingIds = list(self.gameObjects)
-        for (id_, obj) in self.trackerObjects.items():
-            if self.trackerObjectStatus[id_] == "Updated":
-                if id_ in gameExistingIds:
-                    self.objectUpdate(id_, obj)
-                else:
-                    # Create a new one
-                    self.gameObjects[id_] = self.objectAdd(id_, obj)
-                    if self.objectAdd(id_, obj) is not None:
-                        self.gameSprites.add(self.gameObjects[id_])
-
-        # 3. Delete "Lost" objects
-        trackerExistingIds = list(self.trackerObjects)
-        for id_ in list(self.gameObjects):
-            if id_ not in trackerExistingIds:
-                self.objectDelete(id_)
-                self.gameSprites.remove(self.gameObjects[id_])
-                del self.gameObjects[id_]
-
-        # Reset Tracker Update Flag
-        self.trackerUpdateFlag = False
+    def saveFrame(self, path):
+        pygame.image.save(self.screen, path)
+
+    def setVideoBackground(self, source):
+        """
+        Draw the frames of source (the Camera, or a Detector debug frame)
+        as the screen background, instead of invoking clearScreen(). Use
+        None to remove it. Camera frames are wrapped (pygame.image.frombuffer
+        over the pinned frame buffer slot), not copied. Detector frames are
+        copied into a buffer owned by the VideoSource (see VideoSource).
+        Frames are only handled when a new frame is available. Frames of a different size than the screen are scaled
+        into a reused surface.
+        """
+        if self.videoBackground is not None:
+            self.videoBackground.release()
+        self.videoBackground = None
+        self.videoSurfaces = {}
+        self.videoSurface = None
+        self.background = None
+        if source is not None:
+            self.videoBackground = VideoSource(source)
+
+    def updateVideoBackground(self):
+        # Update self.videoSurface with the latest video frame. Returns True
+        # if it changed
+        if self.videoBackground.update() is False:
+            return False
+
+        frame = self.videoBackground.frame
+        key = self.videoBackground.key
+        surface = self.videoSurfaces.get(key)
+        if surface is None:
+            if len(self.videoSurfaces) > 16:
+                self.videoSurfaces = {}
+            surface = pygame.image.frombuffer(frame, (frame.shape[1], frame.shape[0]), "BGR")
+            self.videoSurfaces[key] = surface
+
+        size = (self.screenWidth, self.screenHeight)
+        if surface.get_size() != size:
+            # The scaled surface has the pixel format of frame surfaces
+            if self.videoScaledSurface is None:
+                self.videoScaledSurface = pygame.Surface(size, 0, surface)
+            surface = pygame.transform.scale(surface, size, self.videoScaledSurface)
+        self.videoSurface = surface
+        return True
+
+    def addDirtyRect(self, rect):
+        # Report a screen area (pygame.Rect or (x, y, w, h)) changed by custom
+        # drawing in dirty rectangles rendering mode
+        self.dirtyRects.append(pygame.Rect(rect))
+
+    def invalidateBackground(self):
+        # Render the background again (clearScreen) on the next frame, in
+        # dirty rectangles rendering mode
+        self.background = None
+
+    def gameObjectAdded(self, id_, gameObject):
+        # Sprites returned by objectAdd are drawn by the game loop
+        if gameObject is not None:
+            self.gameSprites.add(gameObject)
+
+    def gameObjectRemoved(self, id_, gameObject):
+        if gameObject is not None:
+            self.gameSprites.remove(gameObject)
 
     def close(self):
         # Warning! Do not call self.close() inside main game loop or the
@@ -0,0 +1,214 @@
+############################################
+# PROGAF                                   #
+# Projection Games Framework               #
+############################################
+# QualityController.py                     #
+############################################
+#
+# 2026/10/18 Initial Release
+#
+############################################
+from threading import Thread, Event
+from collections import deque
+import time
+
+
+class QualityController:
+    """
+    QualityController keeps the application within a latency budget
+    (seconds), degrading quality step by step when it is exceeded, and
+    restoring it when there is room again. Latency is read from the Profiler
+    (by default the end-to-end latency percentile p95, see Profiler.LATstats,
+    or the frame plus application processing time when there is no tracking
+    information).
+
+    Quality steps are the rungs of a ladder, applied in order (and restored
+    in reverse order). Every rung is a name and a list of (object,
+    attribute, value) settings: applying a rung sets the attributes (saving
+    the original values) and restoring it sets the original values back.
+    The default ladder (see defaultLadder) uses, when available (and when
+    they reach the detector processing frames, see Detector.isRemote):
+        - Detection at half resolution (Detector.detectionScale)
+        - Detection every second frame (Detector.detectionInterval)
+        - Tracker-guided ROI detection (Detector.roiMode)
+        - Debug overlays off (Camera, Detector and CentroidTracker)
+        - Game frame rate capped (PyGameApp.frameRate)
+
+    Hysteresis: the controller degrades one rung after degradeAfter
+    consecutive intervals over budget, and restores one rung after
+    restoreAfter consecutive intervals under restoreRatio * budget. After
+    every change it waits settleIntervals intervals, so the change shows in
+    the measurements before deciding again. A rung that did not reduce the
+    latency (by minimumGain at least) is reverted, and skipped until quality
+    is restored (some knobs, like capping the game frame rate, can increase
+    the latency in some scenarios). Every decision is printed and kept in
+    self.decisions.
+    """
+
+    def __init__(self, application, budget=0.033, rate=1, ladder=None, percentile="p95"):
+        self.app = application
+        self.budget = budget
+        self.updateRate = rate
+        self.percentile = percentile
+
+        self.degradeAfter = 2
+        self.restoreAfter = 5
+        self.restoreRatio = 0.7
+        self.settleIntervals = 2
+        self.minimumGain = 0.05
+
+        # Quality ladder, rungs applied (index, original values and latency
+        # before applying them, last applied last), and rungs skipped (see
+        # class description)
+        if ladder is None:
+            ladder = self.defaultLadder()
+        self.ladder = ladder
+        self.applied = []
+        self.skipped = set()
+        self.checkLastRung = False
+
+        # Decision state and log: (time, level, action, rung name, latency)
+        self.overBudget = 0
+        self.underBudget = 0
+        self.settling = 0
+        self.latency = 0
+        self.metric = "LAT " + percentile
+        self.decisions = deque(maxlen=1000)
+
+        self.isRunning = False
+        self.stopEvent = Event()
+
+    def defaultLadder(self):
+        # Build the default quality ladder with the knobs available in the
+        # application components (see class description)
+        app = self.app
+        detector = app.detector
+        ladder = []
+
+        # ROI mode only reaches detectors processing frames in this process
+        # (see Detector.isRemote)
+        local = detector is not None and getattr(detector, "isRemote", False) is False
+        if detector is not None and getattr(detector, "detectionScale", 0) > 0.5:
+            ladder.append(("detection scale 0.5", [(detector, "detectionScale", 0.5)]))
+        if detector is not None:
+            ladder.append(("detection every 2 frames", [(detector, "detectionInterval", 2)]))
+            if local is True and app.tracker is not None and getattr(detector, "pixelCoordinates", True) is True:
+                ladder.append(("ROI detection", [(detector, "roiMode", True)]))
+
+        overlays = []
+        if app.camera is not None:
+            overlays += [(app.camera, "displayFPS", False), (app.camera, "displayGrid", False),
+                         (app.camera, "displayCrop", False)]
+        if detector is not None:
+            overlays.append((detector, "displayDetections", False))
+        if app.tracker is not None:
+            overlays += [(app.tracker, "displayOnCamera", False), (app.tracker, "displayOnProjector", False)]
+        if len(overlays) > 0:
+            ladder.append(("debug overlays off", overlays))
+
+        if hasattr(app, "frameRate") and (app.frameRate is None or app.frameRate > 20):
+            ladder.append(("game frame rate 20", [(app, "frameRate", 20)]))
+        return ladder
+
+    def start(self):
+        # Start threads
+        self.isRunning = True
+        self.stopEvent.clear()
+        Thread(target=self.update, args=(), name="QualityController").start()
+        return self
+
+    def update(self):
+        # Keep looping until the thread is stopped (stop() wakes us up)
+        while self.stopEvent.wait(1 / self.updateRate) is False:
+            if self.isRunning is False:
+                return
+            self.control(self.measure())
+
+    def stop(self):
+        # Stop update thread
+        self.isRunning = False
+        self.stopEvent.set()
+
+    def measure(self):
+        # Latency (seconds) over the last interval, None without samples
+        profiler = self.app.profiler
+        if profiler is None:
+            return None
+        stats = profiler.histograms["LAT"].stats(1)
+        if stats["count"] > 0:
+            self.metric = "LAT " + self.percentile
+            return stats[self.percentile]
+        processing = profiler.FPT + profiler.APT
+        if processing > 0:
+            self.metric = "FPT+APT"
+            return processing
+        return None
+
+    def control(self, latency):
+        # Decide (with hysteresis) whether to degrade or restore quality
+        if latency is None:
+            return
+        self.latency = latency
+
+        if self.settling > 0:
+            self.settling -= 1
+            return
+
+        # Revert the last rung applied if it did not help
+        if self.checkLastRung is True:
+            self.checkLastRung = False
+            index, values, latencyBefore = self.applied[-1]
+            if latency > latencyBefore * (1 - self.minimumGain):
+                self.skipped.add(index)
+                self.restore("Reverting (no gain)")
+                return
+
+        if latency > self.budget:
+            self.overBudget += 1
+            self.underBudget = 0
+        elif latency < self.budget * self.restoreRatio:
+            self.underBudget += 1
+            self.overBudget = 0
+        else:
+            self.overBudget = 0
+            self.underBudget = 0
+
+        if self.overBudget >= self.degradeAfter:
+            self.degrade()
+        elif self.underBudget >= self.restoreAfter and len(self.applied) > 0:
+            self.skipped.clear()
+            self.restore("Restoring")
+
+    def degrade(self):
+        # Apply the next rung of the ladder (if any left)
+        first = self.applied[-1][0] + 1 if len(self.applied) > 0 else 0
+        for index in range(first, len(self.ladder)):
+            if index not in self.skipped:
+                break
+        else:
+            return
+        name, settings = self.ladder[index]
+        values = [(obj, attribute, getattr(obj, attribute)) for obj, attribute, value in settings]
+        self.applied.append((index, values, self.latency))
+        for obj, attribute, value in settings:
+            setattr(obj, attribute, value)
+        self.checkLastRung = True
+        self.log("Degrading", name)
+
+    def restore(self, action):
+        # Restore the last rung applied
+        index, values, latencyBefore = self.applied.pop()
+        for obj, attribute, value in values:
+            setattr(obj, attribute, value)
+        self.checkLastRung = False
+        self.log(action, self.ladder[index][0])
+
+    def log(self, action, name):
+        # Record and print a decision
+        self.overBudget = 0
+        self.underBudget = 0
+        self.settling = self.settleIntervals
+        self.decisions.append((time.time(), len(self.applied), action, name, self.latency))
+        print("QualityController: {} {:.2f}ms (budget {:.2f}ms). {} '{}' (level {}/{})".format(
+            self.metric, self.latency * 1000, self.budget * 1000, action, name, len(self.applied),
+            len(self.ladder)))
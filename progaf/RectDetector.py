@@ -9,6 +9,7 @@
 #
 ############################################
 from progaf.Detector import Detector, Detection
+import numpy as np
 import cv2
 
 
@@ -29,6 +30,10 @@ class RectDetector(Detector):
         self.aspectRatio = 1.0
         self.aspectRatioError = 0.1
 
+        # Sub-pixel corner refinement termination criteria (see
+        # refineDetection)
+        self.refineCriteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 20, 0.01)
+
     def processFrame(self, frame):
 
         # Basic Canny Edge Detection
@@ -61,3 +66,37 @@ class RectDetector(Detector):
                                  rotRect[1][1],  # object height
                                  rotRect[2])     # object rotation
                     self.detections.append(Detection(int(rotRect[0][0]), int(rotRect[0][1]), detection))
+
+    def refineDetection(self, frame, detection):
+        # Refine the corners of a rectangle detected over a downscaled frame
+        # (see Detector.detectionScale) with sub-pixel accuracy, over the
+        # full resolution frame, and rebuild the rectangle from them
+        kind, width, height, angle = detection.detection
+        corners = cv2.boxPoints(((detection.xpos, detection.ypos), (width, height), angle))
+
+        # Full resolution patch around the rectangle. The search window
+        # covers the error of the downscaled detection
+        window = max(int(round(1 / self.detectionScale)) + 1, 2)
+        x1, y1 = np.maximum(np.floor(corners.min(axis=0)).astype(int) - 2 * window, 0)
+        x2, y2 = np.ceil(corners.max(axis=0)).astype(int) + 2 * window
+        patch = frame[y1:y2, x1:x2]
+        if patch.shape[0] <= 2 * window or patch.shape[1] <= 2 * window:
+            return
+        if patch.ndim == 3:
+            patch = cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY)
+
+        # Only corners inside the frame can be refined (rectangles touching
+        # the frame borders keep their other corners)
+        corners = (corners - (x1, y1)).astype(np.float32)
+        inside = np.all((corners >= 0) & (corners <= (patch.shape[1] - 1, patch.shape[0] - 1)), axis=1)
+        if not np.any(inside):
+            return
+        refined = corners[inside].reshape(-1, 1, 2)
+        cv2.cornerSubPix(patch, refined, (window, window), (-1, -1), self.refineCriteria)
+        corners[inside] = refined.reshape(-1, 2)
+
+        # Positions are integer pixel coordinates (see Detection)
+        rotRect = cv2.minAreaRect(corners + np.float32((x1, y1)))
+        detection.xpos = int(round(rotRect[0][0]))
+        detection.ypos = int(round(rotRect[0][1]))
+        detection.detection = (kind, rotRect[1][0], rotRect[1][1], rotRect[2])
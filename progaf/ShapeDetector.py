@@ -10,7 +10,6 @@
 ############################################
 from progaf.Detector import Detector, Detection
 import numpy as np
-import math
 import cv2
 
 
@@ -39,6 +38,51 @@ class ShapeDetector(Detector):
         # Tolerance applied to detected hu-moment vs dictionary hu-moment
         self.humoment_tolerance = 0.001
 
+        # Draw detected shapes over the debug frame (self.frame)
+        self.displayShapes = True
+
+        # Shapes dictionary as a sorted look-up table (built from self.shapes
+        # when required, see updateShapeTable)
+        self.shapeTableKey = None
+        self.shapeNames = None
+        self.shapeValues = None
+
+    def updateShapeTable(self):
+        # Rebuild the sorted look-up table only when the dictionary (or the
+        # tolerance) changes
+        key = (tuple(self.shapes.items()), self.humoment_tolerance)
+        if key == self.shapeTableKey:
+            return
+
+        names = list(self.shapes.keys())
+        values = np.array(list(self.shapes.values()), np.float64)
+        order = np.argsort(values)
+        self.shapeNames = np.array(names + ["unknown"], object)[np.append(order, len(names))]
+        self.shapeValues = values[order]
+        self.shapeTableKey = key
+
+    def classify(self, huValues):
+        """
+        Classify all hu-moment values (first hu-moment, log scale) in one
+        vectorized step: every value takes the name of the nearest shape in
+        the dictionary, or "unknown" if it is out of tolerance.
+        """
+        self.updateShapeTable()
+        values = self.shapeValues
+        if len(values) == 0 or len(huValues) == 0:
+            return ["unknown"] * len(huValues)
+
+        # Nearest table entry (below or above each value)
+        upper = np.clip(np.searchsorted(values, huValues), 0, len(values) - 1)
+        lower = np.clip(upper - 1, 0, len(values) - 1)
+        nearest = np.where(np.abs(values[lower] - huValues) <= np.abs(values[upper] - huValues), lower, upper)
+
+        # Out of tolerance values (and invalid ones) are unknown. The last
+        # entry of self.shapeNames is "unknown"
+        valid = np.abs(values[nearest] - huValues) <= values[nearest] * self.humoment_tolerance
+        nearest = np.where(valid, nearest, len(values))
+        return self.shapeNames[nearest].tolist()
+
     def processFrame(self, frame):
 
         # Convert to grayscale and threshold
@@ -49,45 +93,56 @@ class ShapeDetector(Detector):
         output = cv2.connectedComponentsWithStats(thresh, 4, cv2.CV_32S)
         (numLabels, labels, stats, centroids) = output
 
+        # Loop over the number of unique connected component labels excluding
+        # background (index 0). Every component is processed inside its own
+        # bounding box, so processing time depends on component area, not on
+        # frame size
+        huValues = np.full(max(numLabels - 1, 0), np.nan)
+        rects = []
+        for i in range(1, numLabels):
+            x = stats[i, cv2.CC_STAT_LEFT]
+            y = stats[i, cv2.CC_STAT_TOP]
+            w = stats[i, cv2.CC_STAT_WIDTH]
+            h = stats[i, cv2.CC_STAT_HEIGHT]
+
+            # Construct a mask for the current connected component, limited
+            # to its bounding box
+            componentMask = (labels[y:y + h, x:x + w] == i).view(np.uint8)
+
+            # Calculate the first hu-moment (nu20 + nu02). Hu-moments are
+            # translation invariant, so the bounding box offset is irrelevant
+            moments = cv2.moments(componentMask, True)
+            huValues[i - 1] = moments["nu20"] + moments["nu02"]
+
+            # Extract shape angle (contour points in frame coordinates)
+            cnt, hierarchy = cv2.findContours(componentMask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                              offset=(int(x), int(y)))
+            rects.append(cv2.minAreaRect(cnt[0]))
+
+        # Hu-moment in log scale. The dictionary was built using 255-valued
+        # masks, which scales the first hu-moment by 1/255
+        with np.errstate(divide="ignore", invalid="ignore"):
+            huValues = -np.log10(huValues / 255)
+
+        # Look-up all the components in the dictionary at once
+        shapeTypes = self.classify(huValues)
+
         # Contour Selection
         # self.proj.clear()
         self.detections = []  # empty list
-
-        # Loop over the number of unique connected component labels excluding background (index 0)
         for i in range(1, numLabels):
-            w = stats[i, cv2.CC_STAT_WIDTH]
-            h = stats[i, cv2.CC_STAT_HEIGHT]
+            w = int(stats[i, cv2.CC_STAT_WIDTH])
+            h = int(stats[i, cv2.CC_STAT_HEIGHT])
             (cX, cY) = centroids[i]
-
-            # Construct a mask for the current connected component by finding
-            # pixels in the labels array that have the current connected
-            # component ID
-            componentMask = (labels == i).astype("uint8") * 255
-            # Calculate hu-moments and take the first one in log scale
-            moments = cv2.moments(componentMask)
-            huMoments = cv2.HuMoments(moments)
-            huMoments[0] = -1 * math.copysign(1.0, huMoments[0]) * np.log10(abs(huMoments[0]))
-
-            # Look-up in the dictionary
-            shapeType = None
-            for j in range(len(self.shapes)):
-                if (list(self.shapes.items())[j][1]) * int(1 + self.humoment_tolerance) >= huMoments[0] >= (
-                        list(self.shapes.items())[j][1]) * int(1 - self.humoment_tolerance):
-                    shapeType = str(list(self.shapes.items())[j][0])
-                    break
-                else:
-                    shapeType = "unknown"
-
-            # Extract shape angle
-            cnt, hierarchy = cv2.findContours(componentMask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            rect = cv2.minAreaRect(cnt[0])
+            shapeType = shapeTypes[i - 1]
+            rect = rects[i - 1]
             angle = rect[2]
 
             # Add shape info to debug frame
-            box = cv2.boxPoints(rect)
-            box = np.int0(box)
-            cv2.drawContours(thresh, [box], 0, (0, 0, 255), 1)
-            cv2.putText(thresh, shapeType, (int(cX + 10), int(cY)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+            if self.displayShapes is True:
+                box = cv2.boxPoints(rect).astype(np.int32)
+                cv2.drawContours(thresh, [box], 0, (0, 0, 255), 1)
+                cv2.putText(thresh, shapeType, (int(cX + 10), int(cY)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
 
             # Append shape to detected objects
             # 'detection' type is tuple
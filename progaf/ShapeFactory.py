@@ -11,6 +11,7 @@
 from collections import OrderedDict
 import numpy as np
 import random
+import time
 import cv2
 
 
@@ -30,6 +31,23 @@ class RandomRect:
 
 
 class ShapeFactory:
+	"""
+	ShapeFactory animates moving rectangles bouncing on the frame borders (used
+	as a load generator and for calibration patterns).
+
+	The state of all shapes is stored as NumPy arrays (one row per shape):
+	position (top-left corner), size and velocity (signed pixels per frame at
+	referenceRate frames per second), and all shapes are moved and drawn at
+	once. Motion is frame rate independent: shapes move according to the time
+	elapsed since the last update (or timeStep seconds per update, if set).
+	objects maps object ids to rows.
+
+	Shapes are rasterized with one cv2.polylines call (drawMode "outline") or
+	one cv2.fillConvexPoly call per shape (drawMode "fill") into a frame buffer
+	reused (and cleared in place) on every update. Rasterization time is dominated by the number of
+	pixels drawn: for thousands of shapes use small shapes, drawMode "fill" or
+	thickness 1.
+	"""
 
 	def __init__(self, width, height):
 
@@ -41,47 +59,123 @@ class ShapeFactory:
 		self.objects = OrderedDict()
 		self.nextObject = 0
 
+		# Shapes state
+		self.count = 0
+		self.allocate(64)
+
+		# Motion timing
+		self.referenceRate = 60
+		self.timeStep = None
+		self.maxTimeStep = 0.1
+		self.lastUpdateTime = None
+
+		# Rasterization
+		self.drawMode = "outline"
+		self.colour = (255, 255, 255)
+		self.thickness = 3
+
+		# Rectangle corners (relative to the top-left corner, in units of size)
+		self.corners = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], np.float64)
+
+	def allocate(self, capacity):
+		# (Re)allocate shape arrays, keeping current content
+		n = self.count
+		position = np.zeros((capacity, 2), np.float64)
+		size = np.zeros((capacity, 2), np.float64)
+		velocity = np.zeros((capacity, 2), np.float64)
+		if n > 0:
+			position[:n] = self.position[:n]
+			size[:n] = self.size[:n]
+			velocity[:n] = self.velocity[:n]
+		self.capacity = capacity
+		self.position = position
+		self.size = size
+		self.velocity = velocity
+
+	def addObject(self, x, y, w, h, vx, vy):
+		# Add a shape (top-left corner, size and velocity). Returns its id
+		if self.count == self.capacity:
+			self.allocate(2 * self.capacity)
+
+		row = self.count
+		self.position[row] = (x, y)
+		self.size[row] = (w, h)
+		self.velocity[row] = (vx, vy)
+		self.count += 1
+
+		self.objects[self.nextObject] = row
+		self.nextObject += 1
+		return self.nextObject - 1
+
 	def createRandomObject(self):
 
-		self.objects[self.nextObject] = RandomRect(self.width, self.height)
-		self.nextObject += 1
+		rect = RandomRect(self.width, self.height)
+		vx = rect.sx if rect.moveRight is True else -rect.sx
+		vy = rect.sy if rect.moveDown is True else -rect.sy
+		return self.addObject(rect.p1x, rect.p1y, rect.p2x - rect.p1x, rect.p2y - rect.p1y, vx, vy)
+
+	def createRandomObjects(self, n, generator=None):
+		# Create n random shapes at once (as createRandomObject), using a NumPy
+		# random generator (a new one if None)
+		if generator is None:
+			generator = np.random.default_rng()
+		if self.count + n > self.capacity:
+			self.allocate(max(2 * self.capacity, self.count + n))
+
+		rows = slice(self.count, self.count + n)
+		self.position[rows, 0] = generator.integers(0, self.width + 1, n)
+		self.position[rows, 1] = generator.integers(0, self.height + 1, n)
+		self.size[rows] = 100
+		self.velocity[rows] = generator.integers(0, 4, (n, 2)) * generator.choice((-1, 1), (n, 2))
+
+		for row in range(self.count, self.count + n):
+			self.objects[self.nextObject] = row
+			self.nextObject += 1
+		self.count += n
+
+	def getRects(self):
+		# (N, 4) array with the (p1x, p1y, p2x, p2y) corners of all shapes
+		n = self.count
+		return np.hstack((self.position[:n], self.position[:n] + self.size[:n]))
 
 	def update(self):
-		self.frame = np.zeros((self.height, self.width, 3), np.uint8)
-
-		for n, obj in self.objects.items():
-			self.updateRect(obj)
-			cv2.rectangle(self.frame, (obj.p1x, obj.p1y), (obj.p2x, obj.p2y), (255, 255, 255), 3)
+		# Time elapsed since the last update, in reference frames
+		now = time.perf_counter()
+		if self.timeStep is not None:
+			dt = self.timeStep
+		elif self.lastUpdateTime is None:
+			dt = 1 / self.referenceRate
+		else:
+			dt = min(now - self.lastUpdateTime, self.maxTimeStep)
+		self.lastUpdateTime = now
+
+		self.updateRects(dt * self.referenceRate * self.speed)
+
+		# Clear the frame (in place) and draw all shapes. Shapes are filled
+		# one by one (see Drawing.fillCircles)
+		self.frame.fill(0)
+		n = self.count
+		if n > 0:
+			polygons = (self.position[:n, None, :] + self.corners[None, :, :] * self.size[:n, None, :]).astype(np.int32)
+			if self.drawMode == "fill":
+				for polygon in polygons:
+					cv2.fillConvexPoly(self.frame, polygon, self.colour)
+			else:
+				cv2.polylines(self.frame, list(polygons), True, self.colour, self.thickness)
 
 		self.frameCounter += 1
 		return self.frame
 
-	def updateRect(self, rect):
-
-		if rect.moveRight is True:
-			rect.p1x = rect.p1x + rect.sx*self.speed
-			rect.p2x = rect.p2x + rect.sx*self.speed
-
-			if rect.p2x >= self.width:
-				rect.moveRight = False
+	def updateRects(self, steps):
+		# Move all shapes, and bounce those reaching the frame borders
+		n = self.count
+		position = self.position[:n]
+		size = self.size[:n]
+		velocity = self.velocity[:n]
 
-		else:
-			rect.p1x = rect.p1x - rect.sx*self.speed
-			rect.p2x = rect.p2x - rect.sx*self.speed
-
-			if rect.p1x <= 0:
-				rect.moveRight = True
-
-		if rect.moveDown is True:
-			rect.p1y = rect.p1y + rect.sy*self.speed
-			rect.p2y = rect.p2y + rect.sy*self.speed
-
-			if rect.p2y >= self.height:
-				rect.moveDown = False
-
-		else:
-			rect.p1y = rect.p1y - rect.sy*self.speed
-			rect.p2y = rect.p2y - rect.sy*self.speed
+		position += velocity * steps
+		limit = np.array((self.width, self.height), np.float64)
 
-			if rect.p1y <= 0:
-				rect.moveDown = True
+		bounceLow = (velocity < 0) & (position <= 0)
+		bounceHigh = (velocity > 0) & (position + size >= limit)
+		velocity[bounceLow | bounceHigh] *= -1
@@ -0,0 +1,237 @@
+############################################
+# PROGAF                                   #
+# Projection Games Framework               #
+############################################
+# SharedFrameBus.py                        #
+############################################
+#
+# 2026/10/18 Initial Release
+#
+############################################
+from multiprocessing import shared_memory
+from threading import Lock
+import numpy as np
+
+
+class SharedFrameBus:
+    """
+    SharedFrameBus publishes frames into preallocated slots of a shared memory
+    block, so they can be read (without copies) from other processes. It is
+    the inter-process counterpart of FrameBuffer: one writer process, up to
+    maxReaders reader processes, sequence numbers and capture timestamps for
+    every frame.
+
+    The shared memory block is laid out as:
+        - int64 header: latest sequence number, sequence number stored in
+          every slot (0 when empty, -1 while being written) and sequence
+          number pinned by every reader (0 when none)
+        - float64 capture timestamp of every slot
+        - capacity frame slots
+
+    Readers pin the frame they are processing. The writer never writes into a
+    pinned slot (or the latest one). Readers can also check isValid(seq)
+    after processing a frame, to discard results from overwritten frames.
+    Pins are checked (by the writer) and set (by readers) holding lock, a
+    lock shared by the writer and every reader process (a multiprocessing
+    Lock, passed to reader processes when they are started), so the writer
+    and readers always see each other's updates of the header. Without it
+    (lock=None), pins are only reliable within a single process.
+
+    Writers can render frames directly into the bus (acquire, then
+    publishSlot), or copy them (publish). A FrameBuffer can also allocate
+    its slots in a bus (see FrameBuffer.share), so frames published by a
+    Camera are readable from other processes without copies.
+
+    Objects are created by the writer (name=None) and attached from the
+    readers using the name of the shared memory block.
+    """
+
+    def __init__(self, shape, dtype=np.uint8, capacity=4, maxReaders=4, name=None, lock=None):
+        # Class attributes
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.maxReaders = maxReaders
+        self.writeIndex = 0
+        self.latestIndex = -1
+        self.isUnlinked = False
+
+        # Lock protecting the pin handshake (see class description)
+        if lock is None:
+            lock = Lock()
+        self.lock = lock
+
+        # Shared memory layout
+        headerSize = (1 + capacity + maxReaders) * 8
+        timesOffset = self.align(headerSize)
+        framesOffset = self.align(timesOffset + capacity * 8)
+        frameSize = int(np.prod(self.shape)) * self.dtype.itemsize
+        size = framesOffset + capacity * frameSize
+
+        # Create (writer) or attach (reader) the shared memory block
+        self.isOwner = name is None
+        if self.isOwner is True:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = self.attach(name)
+
+        # Numpy views over the shared memory block
+        buf = self.shm.buf
+        self.header = np.ndarray((1 + capacity + maxReaders,), np.int64, buf, 0)
+        self.slotSeq = self.header[1:1 + capacity]
+        self.readerSeq = self.header[1 + capacity:]
+        self.slotTime = np.ndarray((capacity,), np.float64, buf, timesOffset)
+        self.frames = np.ndarray((capacity,) + self.shape, self.dtype, buf, framesOffset)
+
+        if self.isOwner is True:
+            self.header[:] = 0
+            self.slotTime[:] = 0
+
+    @staticmethod
+    def align(offset, alignment=64):
+        # Align offsets to cache lines
+        return (offset + alignment - 1) // alignment * alignment
+
+    @staticmethod
+    def attach(name):
+        # Attach an existing shared memory block, without registering it in
+        # the resource tracker (only the owner process must unlink it)
+        try:
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13. Reader processes started by multiprocessing
+            # share the resource tracker of the owner process (see
+            # ProcessDetector.start), where the block is already registered,
+            # so registering it again is harmless (and unregistering it would
+            # cancel the owner registration)
+            return shared_memory.SharedMemory(name=name)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def latestSeq(self):
+        return int(self.header[0])
+
+    ##############################
+    # Writer side
+    ############################################################################
+    def acquire(self):
+        """
+        Return (index, frame) for the next writable slot, so the writer can
+        render directly into it. The frame is published calling
+        publishSlot(index, ...). Returns (-1, None) if every slot is in use.
+        """
+        for n in range(self.capacity):
+            index = (self.writeIndex + n) % self.capacity
+            if index == self.latestIndex:
+                continue
+            if self.claim(index) is True:
+                self.writeIndex = (index + 1) % self.capacity
+                return index, self.frames[index]
+        return -1, None
+
+    def claim(self, index):
+        # Invalidate slot index for writing, unless it is pinned by a
+        # reader. Returns True if the slot can be written
+        with self.lock:
+            previousSeq = int(self.slotSeq[index])
+            if previousSeq > 0 and previousSeq in self.readerSeq:
+                return False
+            self.slotSeq[index] = -1
+            return True
+
+    def publishSlot(self, index, seq, timestamp):
+        # Publish the frame written into slot index, with the given sequence
+        # number and capture timestamp
+        with self.lock:
+            self.slotTime[index] = timestamp
+            self.slotSeq[index] = seq
+            self.header[0] = seq
+        self.latestIndex = index
+
+    def publish(self, frame, seq, timestamp):
+        """
+        Copy frame into the next free slot and publish it with the given
+        sequence number and capture timestamp. Returns False if every slot
+        is in use (the frame is dropped).
+        """
+        index, slot = self.acquire()
+        if index < 0:
+            return False
+        np.copyto(slot, frame)
+        self.publishSlot(index, seq, timestamp)
+        return True
+
+    ##############################
+    # Reader side
+    ############################################################################
+    def findSlot(self, seq):
+        # Return the slot index holding frame seq, or -1 if not available
+        if seq <= 0:
+            return -1
+        indexes = np.flatnonzero(self.slotSeq == seq)
+        if len(indexes) == 0:
+            return -1
+        return int(indexes[0])
+
+    def readLatest(self, reader, lastSeq=0):
+        """
+        Pin and return (ok, seq, timestamp, frame) for the latest frame, if
+        newer than lastSeq. reader is the index of the reader (0 to
+        maxReaders - 1). The frame is a view over shared memory.
+        """
+        with self.lock:
+            seq = self.latestSeq
+            if seq <= lastSeq:
+                return False, lastSeq, 0.0, None
+
+            # Pin the frame, if the slot still holds it
+            index = self.findSlot(seq)
+            if index < 0:
+                return False, lastSeq, 0.0, None
+            self.readerSeq[reader] = seq
+            timestamp = float(self.slotTime[index])
+
+        return True, seq, timestamp, self.frames[index]
+
+    def release(self, reader):
+        # Release the frame pinned by reader
+        with self.lock:
+            self.readerSeq[reader] = 0
+
+    def isValid(self, seq):
+        # Check if frame seq is still stored in the bus
+        return self.findSlot(seq) >= 0
+
+    def unlink(self):
+        # Destroy the shared memory block name (owner only), so no more
+        # processes can attach it. Memory is released once every process
+        # detaches it
+        if self.isOwner is True and self.isUnlinked is False:
+            self.isUnlinked = True
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """
+        Release numpy views and detach from the shared memory block. The
+        owner also destroys the block (processes already attached keep their
+        mapping). Returns False if views over the frames are still in use in
+        this process, so the block cannot be detached yet (close can be
+        invoked again later).
+        """
+        self.unlink()
+        self.header = None
+        self.slotSeq = None
+        self.readerSeq = None
+        self.slotTime = None
+        self.frames = None
+        try:
+            self.shm.close()
+        except BufferError:
+            return False
+        return True
@@ -0,0 +1,258 @@
+############################################
+# PROGAF                                   #
+# Projection Games Framework               #
+############################################
+# SyntheticCamera.py                       #
+############################################
+#
+# 2026/10/18 Initial Release
+#
+############################################
+from progaf.ShapeFactory import ShapeFactory
+from progaf.Camera import Camera
+from collections import OrderedDict
+import numpy as np
+import time
+import cv2
+
+
+class SyntheticStream:
+    """
+    SyntheticStream is a VideoCapture-like object (read, get, set, isOpened,
+    release) rendering synthetic scenes, so the complete detection and
+    tracking pipeline can be benchmarked or tested without a camera.
+
+    Available scenes are:
+        - "rects": nObjects moving rectangles rendered by a ShapeFactory
+          (white outlines over black, as expected by RectDetector)
+        - "blobs": nObjects moving dark circles over a white background (as
+          expected by BlobDetector default parameters)
+        - "shapes": nObjects moving white shapes (square, triangle, circle,
+          pentagon, rhombus and 6-point-star) over black (as expected by
+          ShapeDetector)
+        - "noise": just noise
+
+    Random noise (0 to noise) can be added to any scene. Frames are rendered
+    into a preallocated buffer, at a fixed rate (fps) or as fast as they are
+    read (fps=None). The position of every object in the last frame read is
+    available in groundTruth (float array, one (x, y) row per object) and the
+    object types in groundTruthTypes.
+    """
+
+    shapeTypes = ("square", "triangle", "circle", "pentagon", "rhombus", "6-point-star")
+
+    def __init__(self, width, height, scene="rects", nObjects=5, fps=None, noise=0, objectSize=60, seed=None):
+        # Class attributes
+        self.width = width
+        self.height = height
+        self.scene = scene
+        self.nObjects = nObjects
+        self.fps = fps
+        self.noise = noise
+        self.objectSize = objectSize
+        self.isOpen = True
+        self.frameCounter = 0
+        self.nextFrameTime = None
+        self.random = np.random.default_rng(seed)
+
+        # Preallocated frame
+        self.frame = np.zeros((height, width, 3), np.uint8)
+
+        # Precomputed noise table. Every frame uses a different window of the
+        # table, so noise changes without generating random numbers
+        self.noiseMargin = 64
+        self.noiseTable = None
+        if noise > 0:
+            self.noiseTable = self.random.integers(0, noise + 1, (height, width + self.noiseMargin, 3),
+                                                   dtype=np.uint8)
+
+        # Scene objects
+        self.shapeFactory = None
+        self.templates = []
+        self.groundTruthTypes = []
+        self.position = np.zeros((nObjects, 2), np.float64)
+        self.velocity = np.zeros((nObjects, 2), np.float64)
+
+        if scene == "rects":
+            # Moving rectangles are rendered by a ShapeFactory
+            self.shapeFactory = ShapeFactory(width, height)
+            self.shapeFactory.createRandomObjects(nObjects, self.random)
+
+            # Motion does not depend on the time between reads
+            self.shapeFactory.timeStep = 1 / self.shapeFactory.referenceRate
+            self.groundTruthTypes = ["RotatedRect"] * nObjects
+
+        elif scene in ("blobs", "shapes"):
+            # Random positions and velocities (pixels per frame)
+            r = objectSize / 2
+            self.position[:, 0] = self.random.uniform(r, width - r, nObjects)
+            self.position[:, 1] = self.random.uniform(r, height - r, nObjects)
+            self.velocity[:] = self.random.uniform(-3, 3, (nObjects, 2))
+
+            # Polygon templates centered at (0, 0)
+            for n in range(nObjects):
+                if scene == "blobs":
+                    shapeType = "circle"
+                    self.groundTruthTypes.append("Blob")
+                else:
+                    shapeType = self.shapeTypes[n % len(self.shapeTypes)]
+                    self.groundTruthTypes.append(shapeType)
+                self.templates.append(self.createTemplate(shapeType, r))
+
+        self.groundTruth = np.zeros((nObjects, 2), np.float64)
+
+    @staticmethod
+    def createTemplate(shapeType, r):
+        # Create a polygon (float array of points) centered at (0, 0)
+        if shapeType == "circle":
+            return cv2.ellipse2Poly((0, 0), (int(r), int(r)), 0, 0, 360, 5).astype(np.float64)
+
+        if shapeType == "6-point-star":
+            angles = np.arange(12) * np.pi / 6
+            radius = np.where(np.arange(12) % 2 == 0, r, r / 2)
+        else:
+            sides = {"square": 4, "triangle": 3, "pentagon": 5, "rhombus": 4}[shapeType]
+            angles = np.arange(sides) * 2 * np.pi / sides
+            radius = np.full(sides, r)
+            if shapeType == "square":
+                angles = angles + np.pi / 4
+
+        template = np.stack((radius * np.cos(angles), radius * np.sin(angles)), axis=1)
+        if shapeType == "rhombus":
+            template[:, 0] *= 0.6
+        return template
+
+    def isOpened(self):
+        return self.isOpen
+
+    def get(self, propId):
+        if propId == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if propId == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        if propId == cv2.CAP_PROP_FPS:
+            return self.fps if self.fps is not None else 0
+        if propId == cv2.CAP_PROP_POS_FRAMES:
+            return self.frameCounter
+        return 0
+
+    def set(self, propId, value):
+        # Synthetic stream properties can not be changed
+        return False
+
+    def release(self):
+        self.isOpen = False
+
+    def read(self):
+        if self.isOpen is False:
+            return False, None
+
+        # Fixed rate: sleep until the next frame is due
+        if self.fps is not None:
+            now = time.perf_counter()
+            if self.nextFrameTime is None:
+                self.nextFrameTime = now
+            delay = self.nextFrameTime - now
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Running late. Do not try to catch up
+                self.nextFrameTime = now
+            self.nextFrameTime += 1 / self.fps
+
+        # Render the scene
+        if self.scene == "rects":
+            frame = self.updateRects()
+        elif self.scene in ("blobs", "shapes"):
+            frame = self.updateShapes()
+        else:
+            frame = self.frame
+            frame[:] = 0
+
+        # Noise
+        if self.noiseTable is not None:
+            offset = self.frameCounter % self.noiseMargin
+            cv2.add(frame, self.noiseTable[:, offset:offset + self.width], dst=frame)
+
+        self.frameCounter += 1
+        return True, frame
+
+    def updateRects(self):
+        frame = self.shapeFactory.update()
+        rects = self.shapeFactory.getRects()
+        self.groundTruth[:] = (rects[:, :2] + rects[:, 2:]) / 2
+        return frame
+
+    def updateShapes(self):
+        # Move all objects and bounce on frame borders
+        r = self.objectSize / 2
+        self.position += self.velocity
+        low = self.position < r
+        high = self.position > (self.width - r, self.height - r)
+        self.velocity[low | high] *= -1
+        np.clip(self.position, r, (self.width - r, self.height - r), out=self.position)
+        self.groundTruth[:] = self.position
+
+        # Draw all objects. Every polygon is filled in its own call (see
+        # Drawing.fillCircles)
+        if self.scene == "blobs":
+            background, colour = 255, (0, 0, 0)
+        else:
+            background, colour = 0, (255, 255, 255)
+        self.frame[:] = background
+        for template, position in zip(self.templates, self.position):
+            cv2.fillPoly(self.frame, [(template + position).astype(np.int32)], colour, cv2.LINE_AA)
+        return self.frame
+
+
+class SyntheticCamera(Camera):
+    """
+    SyntheticCamera is a Camera reading frames from a SyntheticStream, so
+    detectors, trackers and applications can be run, benchmarked and tested
+    without camera hardware. Pre-processing (flip, undistort, crop), the
+    frame buffer and profiling work as in any other Camera. Flip and FPS
+    display are disabled by default, so frames are exactly the rendered
+    scenes.
+
+    Ground truth for every published frame is available through
+    getGroundTruth(seq), in output frame coordinates (flip and crop are
+    applied; undistortion is not).
+    """
+
+    def __init__(self, width, height, scene="rects", nObjects=5, fps=None, noise=0, objectSize=60, seed=None,
+                 cameraMatrix=None, cameraDistor=None, bufferCapacity=4):
+        stream = SyntheticStream(width, height, scene, nObjects, fps, noise, objectSize, seed)
+        super().__init__(stream, width, height, cameraMatrix, cameraDistor, bufferCapacity)
+
+        # Synthetic frames defaults
+        self.flip = False
+        self.displayFPS = False
+
+        # Ground truth history (by frame sequence number)
+        self.groundTruthHistory = OrderedDict()
+        self.groundTruthHistorySize = 256
+
+    def preprocessFrame(self, frame, dst):
+        # Record the ground truth of the frame being published. The frame
+        # will get the next sequence number of the frame buffer
+        positions = self.stream.groundTruth.copy()
+        x1, y1, x2, y2 = self.getOutputArea(frame)
+        if self.flip is True:
+            positions[:, 0] = frame.shape[1] - 1 - positions[:, 0]
+        positions -= (x1, y1)
+
+        self.groundTruthHistory[self.frameBuffer.nextSeq] = positions
+        while len(self.groundTruthHistory) > self.groundTruthHistorySize:
+            self.groundTruthHistory.popitem(last=False)
+
+        return super().preprocessFrame(frame, dst)
+
+    def getGroundTruth(self, seq=None):
+        """
+        Return (types, positions) for frame seq (the latest frame if None).
+        positions is a float array with one (x, y) row per object. Returns
+        (types, None) if seq is not available anymore.
+        """
+        if seq is None:
+            seq = self.frameSeq
+        return self.stream.groundTruthTypes, self.groundTruthHistory.get(seq)
@@ -0,0 +1,129 @@
+############################################
+# PROGAF                                   #
+# Projection Games Framework               #
+############################################
+# Tracer.py                                #
+############################################
+#
+# 2026/10/18 Initial Release
+#
+############################################
+from itertools import count
+import threading
+import json
+import time
+import os
+
+
+class Tracer:
+    """
+    Tracer records spans (named begin/end intervals, with the thread and
+    the camera frame sequence number they belong to) of the whole pipeline:
+    Camera, Detector, CentroidTracker, Projector and the game loop phases of
+    the application. Spans are written into a preallocated ring buffer of
+    capacity spans (oldest spans are overwritten), from any thread, without
+    locks, and can be dumped at any time as a Chrome trace (JSON, see
+    chrome://tracing or https://ui.perfetto.dev) with dump(path).
+
+    Objects being traced hold the tracer in their tracer attribute (like the
+    Profiler), and record spans with:
+
+        start = time.perf_counter_ns()
+        ...
+        if self.tracer is not None:
+            self.tracer.span("Name", start, frameSeq)
+    """
+
+    def __init__(self, capacity=65536, cam=None, det=None, trk=None, proj=None, app=None):
+        self.capacity = capacity
+
+        # Ring buffer (one list per field). A span is complete when its name
+        # is set (written last)
+        self.names = [None] * capacity
+        self.starts = [0] * capacity
+        self.ends = [0] * capacity
+        self.threads = [0] * capacity
+        self.frames = [-1] * capacity
+        self.args = [None] * capacity
+
+        # Span counter (next() is atomic)
+        self.counter = count()
+
+        # Names of the threads that recorded spans, by thread id (recorded
+        # on their first span, as threads may be gone when dumping)
+        self.threadNames = {}
+        self.local = threading.local()
+
+        # Objects being traced
+        for obj in (cam, det, trk, proj, app):
+            if obj is not None:
+                obj.tracer = self
+
+    def span(self, name, start, frame=-1, args=None):
+        """
+        Record a span started at start (time.perf_counter_ns) and ending
+        now, for frame (camera frame sequence number, -1 if unknown). args is
+        an optional dict of extra values shown with the span (other frame
+        counters must go here, so "frame" always means the camera frame).
+        Returns the end time, so consecutive spans can be chained.
+        """
+        end = time.perf_counter_ns()
+        try:
+            thread = self.local.thread
+        except AttributeError:
+            thread = self.registerThread()
+        index = next(self.counter) % self.capacity
+        self.names[index] = None
+        self.starts[index] = start
+        self.ends[index] = end
+        self.threads[index] = thread
+        self.frames[index] = frame
+        self.args[index] = args
+        self.names[index] = name
+        return end
+
+    def registerThread(self):
+        # Record the name of the calling thread
+        thread = threading.current_thread()
+        self.threadNames[thread.ident] = thread.name
+        self.local.thread = thread.ident
+        return thread.ident
+
+    def clear(self):
+        # Discard all spans recorded
+        for index in range(self.capacity):
+            self.names[index] = None
+
+    def getEvents(self):
+        # Chrome trace events (complete "X" events, timestamps in
+        # microseconds) of all spans in the ring buffer, oldest first, plus
+        # thread name metadata events
+        pid = os.getpid()
+        events = []
+        threads = set()
+        for index in range(self.capacity):
+            name = self.names[index]
+            if name is None:
+                continue
+            start, end = self.starts[index], self.ends[index]
+            thread, frame, args = self.threads[index], self.frames[index], self.args[index]
+            event = {"name": name, "cat": "progaf", "ph": "X", "pid": pid, "tid": thread,
+                     "ts": start / 1000, "dur": (end - start) / 1000}
+            if frame >= 0 or args is not None:
+                event["args"] = dict(args) if args is not None else {}
+                if frame >= 0:
+                    event["args"]["frame"] = frame
+            events.append(event)
+            threads.add(thread)
+        events.sort(key=lambda event: event["ts"])
+
+        # Thread names
+        for thread in threads:
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread,
+                           "args": {"name": self.threadNames.get(thread, str(thread))}})
+        return events
+
+    def dump(self, path):
+        # Write all spans in the ring buffer into path, as a Chrome trace
+        with open(path, "w") as file:
+            json.dump({"traceEvents": self.getEvents(), "displayTimeUnit": "ms"}, file)
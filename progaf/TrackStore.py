@@ -0,0 +1,190 @@
+############################################
+# PROGAF                                   #
+# Projection Games Framework               #
+############################################
+# TrackStore.py                            #
+############################################
+#
+# 2026/10/18 Initial Release
+#
+############################################
+import numpy as np
+
+
+class TrackStore:
+    """
+    TrackStore holds the state of all tracked objects as a struct of
+    preallocated NumPy arrays (one row per object): id, centroid (x, y),
+    status, miss count and detection (the Detection object, with the type
+    dependent payload). Rows are kept packed: removing an object moves the
+    last row into its place. rowOf maps object ids to rows.
+
+    Every row also holds the motion estimate of the object (see
+    KalmanFilter): state (2, order), covariance (2, order, order) and
+    stateTime. timestamp and frameSeq are the capture time and sequence
+    number of the frame of the last update (the frame of every object
+    detection is recorded in the Detection, see Detection.frameSeq).
+
+    Arrays grow (doubling capacity) when required.
+    """
+
+    # Track status codes (and names, as used by Application.trackerObjectStatus)
+    NEW = 0
+    UPDATED = 1
+    TROUBLE = 2
+    statusNames = ("New", "Updated", "Trouble")
+
+    def __init__(self, capacity=64, order=2):
+        self.count = 0
+        self.order = order
+        self.timestamp = 0.0
+        self.frameSeq = -1
+        self.rowOf = {}
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        # (Re)allocate arrays, keeping current content
+        old = getattr(self, "ids", None)
+        ids = np.zeros(capacity, np.int64)
+        x = np.zeros(capacity, np.float64)
+        y = np.zeros(capacity, np.float64)
+        status = np.zeros(capacity, np.int8)
+        missCount = np.zeros(capacity, np.int32)
+        dets = np.empty(capacity, object)
+        state = np.zeros((capacity, 2, self.order), np.float64)
+        covariance = np.zeros((capacity, 2, self.order, self.order), np.float64)
+        stateTime = np.zeros(capacity, np.float64)
+
+        if old is not None and self.count > 0:
+            n = self.count
+            ids[:n] = self.ids[:n]
+            x[:n] = self.x[:n]
+            y[:n] = self.y[:n]
+            status[:n] = self.status[:n]
+            missCount[:n] = self.missCount[:n]
+            dets[:n] = self.dets[:n]
+            state[:n] = self.state[:n]
+            covariance[:n] = self.covariance[:n]
+            stateTime[:n] = self.stateTime[:n]
+
+        self.capacity = capacity
+        self.ids = ids
+        self.x = x
+        self.y = y
+        self.status = status
+        self.missCount = missCount
+        self.dets = dets
+        self.state = state
+        self.covariance = covariance
+        self.stateTime = stateTime
+
+    def add(self, id_, x, y, det, status=0):
+        # Add a new object. Returns its row
+        if self.count == self.capacity:
+            self.allocate(2 * self.capacity)
+
+        row = self.count
+        self.ids[row] = id_
+        self.x[row] = x
+        self.y[row] = y
+        self.status[row] = status
+        self.missCount[row] = 0
+        self.dets[row] = det
+        self.rowOf[id_] = row
+        self.count += 1
+        return row
+
+    def remove(self, row):
+        # Remove the object in row, moving the last row into its place
+        last = self.count - 1
+        del self.rowOf[int(self.ids[row])]
+        if row != last:
+            self.ids[row] = self.ids[last]
+            self.x[row] = self.x[last]
+            self.y[row] = self.y[last]
+            self.status[row] = self.status[last]
+            self.missCount[row] = self.missCount[last]
+            self.dets[row] = self.dets[last]
+            self.state[row] = self.state[last]
+            self.covariance[row] = self.covariance[last]
+            self.stateTime[row] = self.stateTime[last]
+            self.rowOf[int(self.ids[row])] = row
+        self.dets[last] = None
+        self.count = last
+
+    def centroids(self):
+        # (N, 2) array with the centroids of all objects
+        n = self.count
+        return np.stack((self.x[:n], self.y[:n]), axis=1)
+
+
+class TrackSnapshot(TrackStore):
+    """
+    TrackSnapshot is a copy of a TrackStore handed to the Application, plus
+    the changes since the previous snapshot delivered to the Application:
+        - added: ids of new objects
+        - updated: ids of objects with a new detection
+        - troubled: ids of objects that were missed (status Trouble)
+        - removed: ids of objects that are no longer tracked
+
+    Snapshots are reused (see Application.publishTrackerSnapshot), so
+    copying them does not allocate memory in the steady state.
+    """
+
+    def __init__(self, capacity=64, order=2):
+        super().__init__(capacity, order)
+        self.added = set()
+        self.updated = set()
+        self.troubled = set()
+        self.removed = set()
+
+    def copyFrom(self, store, added, updated, troubled, removed):
+        # Copy the current state of store, and the given changes
+        if self.order != store.order:
+            self.order = store.order
+            self.count = 0
+            self.allocate(store.capacity)
+        elif self.capacity < store.capacity:
+            self.allocate(store.capacity)
+
+        n = store.count
+        self.count = n
+        np.copyto(self.ids[:n], store.ids[:n])
+        np.copyto(self.x[:n], store.x[:n])
+        np.copyto(self.y[:n], store.y[:n])
+        np.copyto(self.status[:n], store.status[:n])
+        np.copyto(self.missCount[:n], store.missCount[:n])
+        np.copyto(self.dets[:n], store.dets[:n])
+        self.dets[n:] = None
+        np.copyto(self.state[:n], store.state[:n])
+        np.copyto(self.covariance[:n], store.covariance[:n])
+        np.copyto(self.stateTime[:n], store.stateTime[:n])
+        self.timestamp = store.timestamp
+        self.frameSeq = store.frameSeq
+        self.rowOf = store.rowOf.copy()
+
+        self.added.clear()
+        self.added.update(added)
+        self.updated.clear()
+        self.updated.update(updated)
+        self.troubled.clear()
+        self.troubled.update(troubled)
+        self.removed.clear()
+        self.removed.update(removed)
+
+    def mergePrevious(self, previous):
+        """
+        Merge the changes of a previous snapshot that was never delivered to
+        the Application, so no change is lost. Objects added and removed
+        between deliveries are never reported.
+        """
+        cancelled = previous.added & self.removed
+        self.added = (previous.added - cancelled) | self.added
+        self.removed = (previous.removed | self.removed) - cancelled
+        self.updated = (previous.updated | self.updated) - self.added - self.removed
+        self.troubled = (previous.troubled | self.troubled) - self.added - self.removed
+
+    def get(self, id_):
+        # Return (detection, status name) for object id_
+        row = self.rowOf[id_]
+        return self.dets[row], self.statusNames[self.status[row]]
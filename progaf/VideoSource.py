@@ -0,0 +1,92 @@
+############################################
+# PROGAF                                   #
+# Projection Games Framework               #
+############################################
+# VideoSource.py                           #
+############################################
+#
+# 2026/10/18 Initial Release
+#
+############################################
+import numpy as np
+import cv2
+
+
+class VideoSource:
+    """
+    VideoSource follows the latest frame of a Camera or the debug frame of a
+    Detector (Detector.read()), to be used as a video background by game
+    engine integrations (see PyGameApp.setVideoBackground and
+    panda3DApp.setVideoBackground).
+
+    Camera frames are read with a FrameReader, so they are not copied: the
+    frame returned is a slot of the camera frame buffer, pinned until the
+    next frame is read. update() only reports new frames (new frame sequence
+    numbers), and key identifies the memory holding the frame (the frame
+    buffer slot), so engines can cache one texture or surface per slot.
+
+    Detector frames are copied (converted when required, for instance from
+    grayscale) into a reused buffer owned by this object, so they are not
+    modified by the detector while in use (for instance, as the background
+    surface cached by PyGameApp dirty rectangles rendering) until the next
+    update.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.reader = None
+        self.frameSeq = 0
+        self.frame = None
+        self.key = None
+        self.convertBuffer = None
+
+        # Cameras provide a frame buffer. Detectors provide read()
+        if hasattr(source, "frameBuffer"):
+            self.reader = source.frameBuffer.reader()
+
+    def update(self):
+        """
+        Check for a new frame. Returns True if self.frame (and self.key) are
+        a new frame.
+        """
+        if self.reader is not None:
+            ok, seq, timestamp, frame = self.reader.readLatest(0)
+            if ok is False:
+                return False
+            self.frameSeq = seq
+            self.key = (id(self.source.frameBuffer.frames), self.reader.pinnedIndex)
+            self.frame = self.getBGRFrame(frame)
+        else:
+            ok, frame = self.source.read()
+            if ok is False or frame is None or self.source.frameCounter == self.frameSeq:
+                return False
+            self.frameSeq = self.source.frameCounter
+            self.frame = self.copyBGRFrame(frame)
+        return True
+
+    def getBGRFrame(self, frame):
+        # Return frame as a contiguous 3 channel uint8 image, converting it
+        # (into a reused buffer) only when required
+        if frame.ndim == 3 and frame.shape[2] == 3 and frame.dtype == np.uint8 and frame.flags.c_contiguous:
+            return frame
+        return self.copyBGRFrame(frame)
+
+    def copyBGRFrame(self, frame):
+        # Copy frame into a reused buffer, as a contiguous 3 channel uint8
+        # image
+        shape = frame.shape[:2] + (3,)
+        if self.convertBuffer is None or self.convertBuffer.shape != shape:
+            self.convertBuffer = np.zeros(shape, np.uint8)
+        if frame.ndim == 2:
+            cv2.cvtColor(frame.astype(np.uint8, copy=False), cv2.COLOR_GRAY2BGR, dst=self.convertBuffer)
+        else:
+            np.copyto(self.convertBuffer, frame[:, :, :3], casting="unsafe")
+
+        # Copied frames always live in the same buffer
+        self.key = ("convertBuffer", shape)
+        return self.convertBuffer
+
+    def release(self):
+        # Release the camera frame pinned by the last read
+        if self.reader is not None:
+            self.reader.release()
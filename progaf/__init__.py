@@ -1,16 +1,72 @@
-from progaf.Application import *
-from progaf.BlobDetector import *
-from progaf.Camera import *
-from progaf.CentroidTracker import *
-from progaf.Detector import *
-from progaf.FaceDetector import *
-from progaf.FaceMeshDetector import *
-from progaf.HandDetector import *
-from progaf.LaserDetector import *
-from progaf.Panda3DApp import *
-from progaf.Profiler import *
-from progaf.Projector import *
-from progaf.PyGameApp import *
-from progaf.RectDetector import *
-from progaf.ShapeDetector import *
-from progaf.ShapeFactory import *
\ No newline at end of file
+import importlib
+import types
+import sys
+
+# Modules are imported lazily, on first access to any of their public names
+# (from progaf import RectDetector only imports progaf.RectDetector and its
+# dependencies), so applications do not pay the startup time and memory of
+# optional engines and detectors they do not use (pygame, panda3d, mediapipe)
+_modules = {
+    "Application": ("Application",),
+    "AssociationEngine": ("AssociationEngine", "GreedyAssociation", "HungarianAssociation", "SparseAssociation"),
+    "BlobDetector": ("BlobDetector",),
+    "Camera": ("Camera",),
+    "CentroidTracker": ("CentroidTracker",),
+    "Detector": ("Detection", "Detector"),
+    "Drawing": ("fillCircles",),
+    "FaceDetector": ("FaceDetector",),
+    "FaceMeshDetector": ("FaceMeshDetector",),
+    "FrameBuffer": ("FrameBuffer", "FrameReader"),
+    "HandDetector": ("HandDetector",),
+    "KalmanFilter": ("KalmanFilter",),
+    "LaserDetector": ("LaserDetector",),
+    "Layer": ("Layer",),
+    "Panda3DApp": ("panda3DApp",),
+    "ProcessDetector": ("ProcessDetector", "SharedFrameCamera", "runDetectorProcess"),
+    "Profiler": ("Profiler",),
+    "Projector": ("Projector", "Transform", "unionRect"),
+    "PyGameApp": ("PyGameApp",),
+    "QualityController": ("QualityController",),
+    "RectDetector": ("RectDetector",),
+    "ShapeDetector": ("ShapeDetector",),
+    "ShapeFactory": ("RandomRect", "ShapeFactory"),
+    "SharedFrameBus": ("SharedFrameBus",),
+    "SyntheticCamera": ("SyntheticStream", "SyntheticCamera"),
+    "Tracer": ("Tracer",),
+    "TrackStore": ("TrackStore", "TrackSnapshot"),
+    "VideoSource": ("VideoSource",),
+}
+
+# Module of every public name
+_names = {name: module for module, names in _modules.items() for name in names}
+
+__all__ = list(_names)
+
+
+def __getattr__(name):
+    # Import the module defining name on first access. Names already
+    # imported are module attributes, so this is only invoked once per name
+    module = _names.get(name)
+    if module is None:
+        raise AttributeError("module 'progaf' has no attribute '{}'".format(name))
+    value = getattr(importlib.import_module("progaf." + module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+class _Package(types.ModuleType):
+    # The import system binds every imported submodule to the package
+    # (progaf.Camera would be the progaf.Camera module). Most modules are
+    # named after their class, so submodules are not bound and the class is
+    # returned (by __getattr__) instead, as with the former star imports
+    def __setattr__(self, name, value):
+        if name in _names and isinstance(value, types.ModuleType):
+            return
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package